@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Throughput benchmarks of mssh-copy-id against a fleet of fake SSH servers (see `tests/fleet-tests/fakessh.py`).
+
+Each scenario (a suite, a number of hosts and a round-trip time) runs in its own process, so that its peak RSS is
+measured alone. The results are written as JSON.
+
+Usage::
+
+    python benchmarks/bench.py --hosts 10,1000 --rtt 0,20,100 --output results.json
+
+The fake servers run in the same process as mssh-copy-id: the results are meant to be compared between two versions on
+the same machine, not as absolute numbers.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLEET_TESTS_DIR = os.path.join(PROJECT_DIR, 'tests', 'fleet-tests')
+sys.path[:0] = [PROJECT_DIR, FLEET_TESTS_DIR]
+
+import paramiko  # noqa: E402
+
+import msshcopyid  # noqa: E402
+from msshcopyid import cli  # noqa: E402
+from msshcopyid.stats import percentile  # noqa: E402
+from fakessh import FakeSSHFleet  # noqa: E402
+
+SUITE_COPY = 'copy'
+SUITE_KNOWN_HOSTS = 'known-hosts'
+SUITES = (SUITE_COPY, SUITE_KNOWN_HOSTS)
+
+DEFAULT_HOSTS = '10,1000,10000'
+DEFAULT_RTT = '0,20,100'
+DEFAULT_PARALLEL = 50
+
+
+def get_peak_rss():
+    """
+    :return: the peak RSS of the current process, in bytes.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In kilobytes on Linux, in bytes on macOS
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def raise_open_files_limit(size, parallel):
+    """
+    Raise the limit of open files: each fake host needs a listening socket, and each connection two sockets.
+    """
+    needed = size + 4 * parallel + 256
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        if hard != resource.RLIM_INFINITY and hard < needed:
+            raise SystemExit('Error: {0} hosts need {1} open files, but the limit is {2}.'.format(size, needed, hard))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+
+class TimedMain(cli.Main):
+    """
+    A `cli.Main` recording the duration of the copy of the SSH keys to each host.
+    """
+
+    def __init__(self):
+        super(TimedMain, self).__init__()
+        self.latencies = []
+
+    def copy_ssh_keys_to_host(self, host, known_hosts=None):
+        start = time.time()
+        try:
+            return super(TimedMain, self).copy_ssh_keys_to_host(host, known_hosts=known_hosts)
+        finally:
+            self.latencies.append(time.time() - start)
+
+
+def run_copy(fleet, tmp_dir, parallel):
+    """
+    Copy the SSH key to the hosts with `cli.Main.copy_ssh_keys_to_hosts()`: first with the password, then again when
+    the SSH key is already authorized.
+
+    :return: a list of `(operation, duration, per-host latencies)`.
+    """
+    priv_key = os.path.join(tmp_dir, 'id_rsa')
+    key = paramiko.RSAKey.generate(2048)
+    key.write_private_key_file(priv_key)
+    with open('{0}.pub'.format(priv_key), 'w') as fh:
+        fh.write('{0} {1} bench@localhost\n'.format(key.get_name(), key.get_base64()))
+    known_hosts = os.path.join(tmp_dir, 'known_hosts')
+
+    main = TimedMain()
+    main.args = main.get_parser().parse_args(['-i', priv_key, '-P', 'password', '-j', str(parallel), 'dummy'])
+    main.sshcopyid = msshcopyid.SSHCopyId(priv_key=priv_key, default_password='password',
+                                          connect_timeout=main.args.connect_timeout,
+                                          auth_timeout=main.args.auth_timeout, exec_timeout=main.args.exec_timeout)
+    main.sshcopyid.read_pub_key()
+    main.sshcopyid.load_priv_key()
+
+    results = []
+    for operation in ('copy-added', 'copy-unchanged'):
+        hosts = [msshcopyid.Host(hostname=host.hostname, port=host.port, user='user') for host in fleet.hosts]
+        main.latencies = []
+        start = time.time()
+        main.copy_ssh_keys_to_hosts(hosts, known_hosts=known_hosts, parallel=parallel)
+        results.append((operation, time.time() - start, main.latencies))
+    return results
+
+
+def run_known_hosts(fleet, tmp_dir, parallel):
+    """
+    Add the host keys to a `known_hosts` file with `SSHCopyId.add_to_known_hosts()`, then remove them with
+    `SSHCopyId.remove_from_known_hosts()`.
+
+    :return: a list of `(operation, duration, per-host latencies)`.
+    """
+    known_hosts = os.path.join(tmp_dir, 'known_hosts')
+    open(known_hosts, 'w').close()
+    sshcopyid = msshcopyid.SSHCopyId(connect_timeout=cli.DEFAULT_CONNECT_TIMEOUT)
+    hosts = [msshcopyid.Host(hostname=host.hostname, port=host.port, user='user') for host in fleet.hosts]
+
+    latencies = []
+    scan_host_keys = msshcopyid.scan_host_keys
+
+    def timed_scan_host_keys(*args, **kwargs):
+        start = time.time()
+        try:
+            return scan_host_keys(*args, **kwargs)
+        finally:
+            latencies.append(time.time() - start)
+
+    msshcopyid.scan_host_keys = timed_scan_host_keys
+    try:
+        start = time.time()
+        sshcopyid.add_to_known_hosts(hosts, known_hosts=known_hosts, parallel=parallel)
+        results = [('known-hosts-add', time.time() - start, latencies)]
+    finally:
+        msshcopyid.scan_host_keys = scan_host_keys
+
+    start = time.time()
+    sshcopyid.remove_from_known_hosts(hosts, known_hosts=known_hosts)
+    results.append(('known-hosts-remove', time.time() - start, []))
+    return results
+
+
+def run_scenario(suite, size, rtt, parallel):
+    """
+    Run a scenario in the current process.
+
+    :param suite: `SUITE_COPY` or `SUITE_KNOWN_HOSTS`.
+    :param size: the number of hosts.
+    :param rtt: the emulated round-trip time of the hosts, in milliseconds.
+    :param parallel: the number of hosts processed at the same time.
+    :return: the list of results, one dict per operation.
+    """
+    raise_open_files_limit(size, parallel)
+    # Only the SSH key given is tried
+    os.environ.pop('SSH_AUTH_SOCK', None)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with FakeSSHFleet(size, latency=rtt / 1000) as fleet:
+            if suite == SUITE_COPY:
+                operations = run_copy(fleet, tmp_dir, parallel)
+            else:
+                operations = run_known_hosts(fleet, tmp_dir, parallel)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    results = []
+    peak_rss = get_peak_rss()
+    for operation, duration, latencies in operations:
+        latencies = sorted(latencies)
+        results.append({'suite': suite,
+                        'operation': operation,
+                        'hosts': size,
+                        'rtt_ms': rtt,
+                        'parallel': parallel,
+                        'duration': duration,
+                        'hosts_per_sec': size / duration if duration else None,
+                        'latency_p50': percentile(latencies, 50),
+                        'latency_p99': percentile(latencies, 99),
+                        'peak_rss': peak_rss})
+    return results
+
+
+def parse_ints(value):
+    try:
+        return [int(item) for item in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid list of integers: {0!r}'.format(value))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark mssh-copy-id against a fleet of fake SSH servers.')
+    parser.add_argument('--suite', choices=SUITES, action='append',
+                        help='the suite to run. Can be given several times. Default: all')
+    parser.add_argument('--hosts', type=parse_ints, default=parse_ints(DEFAULT_HOSTS), metavar='N,N,...',
+                        help='the numbers of hosts. Default: {0}'.format(DEFAULT_HOSTS))
+    parser.add_argument('--rtt', type=parse_ints, default=parse_ints(DEFAULT_RTT), metavar='MS,MS,...',
+                        help='the emulated round-trip times, in milliseconds. Default: {0}'.format(DEFAULT_RTT))
+    parser.add_argument('-j', '--parallel', type=int, default=DEFAULT_PARALLEL, metavar='N',
+                        help='the number of hosts processed at the same time. Default: {0}'.format(DEFAULT_PARALLEL))
+    parser.add_argument('-o', '--output', metavar='PATH', help='the JSON file to write. Default: the STDOUT')
+    # Internal: run a single scenario in the current process
+    parser.add_argument('--scenario', nargs=3, metavar=('SUITE', 'HOSTS', 'RTT'), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=sys.argv):
+    args = get_parser().parse_args(argv[1:])
+
+    if args.scenario:
+        suite, size, rtt = args.scenario
+        json.dump(run_scenario(suite, int(size), int(rtt), args.parallel), sys.stdout)
+        return
+
+    results = []
+    for suite in args.suite or SUITES:
+        for size in args.hosts:
+            for rtt in args.rtt:
+                print('Running {0}: {1} host(s), RTT {2} ms...'.format(suite, size, rtt), file=sys.stderr)
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '-j', str(args.parallel),
+                                                  '--scenario', suite, str(size), str(rtt)])
+                results.extend(json.loads(output.decode('utf-8')))
+
+    report = {'version': msshcopyid.__version__,
+              'paramiko': paramiko.__version__,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.time(),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,22 @@ from __future__ import unicode_literals
 
 import logging
 import os
-import subprocess
+import socket
 import sys
-
-import paramiko
+import threading
 
 from msshcopyid._version import __version__, __version_info__
 from msshcopyid.constants import DEFAULT_KNOWN_HOSTS
 from msshcopyid.constants import DEFAULT_SSH_PORT
+from msshcopyid.constants import SCANNER_PARAMIKO, SCANNER_SSH_KEYSCAN
+from msshcopyid.constants import STATUS_ADDED, STATUS_UNCHANGED
+from msshcopyid.errors import CancelledError, RemoteCommandError
+from msshcopyid.known_hosts import file_lock, get_host_key_name, iter_entries, KnownHosts, KnownHostsPolicy
+from msshcopyid.known_hosts import iter_keyscan_batches, KEYSCAN_BATCH_SIZE, remove_hosts, scan_host_keys, ssh_keyscan
+from msshcopyid.lazy import LazyModule
+from msshcopyid.pool import WorkerPool
+from msshcopyid.stats import PHASE_AUTH, PHASE_CLOSE, PHASE_CONNECT, PHASE_EXEC, PHASE_HANDSHAKE, PHASE_RESOLVE
+from msshcopyid.stats import PhaseTimer
 
 from msshcopyid.log import format_error
 from msshcopyid.log import format_exception
@@ -17,10 +25,17 @@ from msshcopyid import utils
 
 logger = logging.getLogger(__name__)
 
+paramiko = LazyModule('paramiko')
+
+# The classes of SSH private keys, if supported by the installed version of paramiko
+PKEY_CLASS_NAMES = ('RSAKey', 'DSSKey', 'ECDSAKey', 'Ed25519Key')
+
 
 class SSHCopyId(object):
-    def __init__(self, priv_key=None, pub_key=None, ssh_config=None, default_password=None):
+    def __init__(self, priv_key=None, pub_key=None, ssh_config=None, default_password=None, connect_timeout=None,
+                 auth_timeout=None, exec_timeout=None):
         self.priv_key = priv_key
+        self.pkey = None  # the `paramiko.PKey` object loaded from `priv_key`
         self.pub_key = None
         self.set_pub_key(pub_key)
         self.pub_key_content = None
@@ -28,6 +43,29 @@ class SSHCopyId(object):
 
         self.default_password = default_password
 
+        # Timeouts (in seconds) for each host. `None` means no timeout.
+        self.connect_timeout = connect_timeout
+        self.auth_timeout = auth_timeout
+        self.exec_timeout = exec_timeout
+
+        # The `KnownHosts` indexes, by `known_hosts` file
+        self.known_hosts = {}
+        self.known_hosts_lock = threading.Lock()
+
+        # The SSH connections in progress, to be able to close them on cancellation
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Cancel the copies of the SSH keys: close the SSH connections in progress, and refuse the new ones.
+        """
+        self.cancelled.set()
+        with self.clients_lock:
+            for client in self.clients:
+                client.close()
+
     def set_pub_key(self, pub_key):
         if pub_key:
             self.pub_key = pub_key
@@ -43,32 +81,143 @@ class SSHCopyId(object):
         with open(self.pub_key) as fh:
             self.pub_key_content = fh.read().strip()
 
-    def add_to_known_hosts(self, hosts, known_hosts=DEFAULT_KNOWN_HOSTS, dry=False):
+    def load_priv_key(self, get_passphrase=None):
+        """
+        Load the SSH private key in memory, once for all the SSH connections.
+
+        :param get_passphrase: if the SSH private key is encrypted, this function is called to get its passphrase.
+        """
+        try:
+            try:
+                self.pkey = self._load_pkey()
+            except paramiko.ssh_exception.PasswordRequiredException:
+                if not get_passphrase:
+                    raise
+                self.pkey = self._load_pkey(passphrase=get_passphrase())
+        except (paramiko.ssh_exception.SSHException, IOError) as ex:
+            logger.error(format_error('Cannot load the SSH private key [%s]: %s'), self.priv_key, ex)
+            sys.exit(1)
+        logger.debug('Loaded the SSH private key [%s]', self.priv_key)
+
+    def _load_pkey(self, passphrase=None):
+        for pkey_class in (getattr(paramiko, name) for name in PKEY_CLASS_NAMES if hasattr(paramiko, name)):
+            try:
+                return pkey_class.from_private_key_file(self.priv_key, password=passphrase)
+            except paramiko.ssh_exception.PasswordRequiredException:
+                raise
+            except paramiko.ssh_exception.SSHException:
+                # Not the right type of key
+                pass
+        raise paramiko.ssh_exception.SSHException('unsupported type of key')
+
+    def get_known_hosts(self, known_hosts=DEFAULT_KNOWN_HOSTS):
+        """
+        Get the index of the `known_hosts` file, loading it the first time.
+
+        :param known_hosts: the `known_hosts` file.
+        :return: the `msshcopyid.known_hosts.KnownHosts` object.
+        """
+        with self.known_hosts_lock:
+            if known_hosts not in self.known_hosts:
+                self.known_hosts[known_hosts] = KnownHosts(known_hosts).load()
+            return self.known_hosts[known_hosts]
+
+    def save_known_hosts(self):
+        """
+        Write the host keys added during the copies of the SSH keys to the `known_hosts` files.
+        """
+        with self.known_hosts_lock:
+            indexes = list(self.known_hosts.values())
+        for index in indexes:
+            try:
+                index.save()
+            except (IOError, OSError) as ex:
+                logger.error(format_error('Cannot write the host keys to [%s]: %s'), index.filename, ex)
+
+    def add_to_known_hosts(self, hosts, known_hosts=DEFAULT_KNOWN_HOSTS, dry=False, parallel=1,
+                           scanner=SCANNER_PARAMIKO):
         """
         Add the remote host SSH public key to the `known_hosts` file.
 
         :param hosts: the list of the remote `Host` objects.
         :param known_hosts: the `known_hosts` file to store the SSH public keys.
         :param dry: perform a dry run.
+        :param parallel: the number of hosts to scan at the same time.
+        :param scanner: the tool to fetch the host keys: `SCANNER_PARAMIKO` or `SCANNER_SSH_KEYSCAN`.
+        """
+        if scanner == SCANNER_SSH_KEYSCAN:
+            self.add_to_known_hosts_with_ssh_keyscan(hosts, known_hosts=known_hosts, dry=dry, parallel=parallel)
+        else:
+            self.add_to_known_hosts_with_paramiko(hosts, known_hosts=known_hosts, dry=dry, parallel=parallel)
+
+    def add_to_known_hosts_with_paramiko(self, hosts, known_hosts=DEFAULT_KNOWN_HOSTS, dry=False, parallel=1):
+        """
+        Add the remote host SSH public key to the `known_hosts` file, fetching the host keys with paramiko.
+
+        The hosts are scanned concurrently, on their own SSH port and with the connection timeout. Each host key is
+        written to the `known_hosts` file as soon as it is fetched.
+
+        :param hosts: the list of the remote `Host` objects.
+        :param known_hosts: the `known_hosts` file to store the SSH public keys.
+        :param dry: perform a dry run.
+        :param parallel: the number of hosts to scan at the same time.
+        """
+        def scan(host):
+            return scan_host_keys(host.hostname, port=host.port, timeout=self.connect_timeout)
+
+        with file_lock(known_hosts):
+            index = KnownHosts(known_hosts).load()
+            with open(os.devnull if dry else known_hosts, 'a') as fh:
+                pool = WorkerPool(scan, size=parallel, name='keyscan')
+                for host, keys, ex in pool.map(hosts):
+                    if ex is not None:
+                        logger.error('[%s] %s', host.hostname, format_error(format_exception(ex)))
+                        continue
+                    name = get_host_key_name(host.hostname, host.port)
+                    for key in keys:
+                        logger.info('[%s] Add the remote host SSH public key to [%s]...', name, known_hosts)
+                        if index.lookup(name).get(key.get_name()) != key.get_base64():
+                            index.add(name, key)
+                            fh.write('{0} {1} {2}\n'.format(name, key.get_name(), key.get_base64()))
+                            fh.flush()
+
+    def add_to_known_hosts_with_ssh_keyscan(self, hosts, known_hosts=DEFAULT_KNOWN_HOSTS, dry=False, parallel=1,
+                                            batch_size=KEYSCAN_BATCH_SIZE):
+        """
+        Add the remote host SSH public key to the `known_hosts` file, fetching the host keys with `ssh-keyscan`.
+
+        The hosts are grouped by SSH port into batches, each one scanned by its own `ssh-keyscan` process. Each host
+        key is written to the `known_hosts` file as soon as `ssh-keyscan` outputs it.
+
+        :param hosts: the list of the remote `Host` objects.
+        :param known_hosts: the `known_hosts` file to store the SSH public keys.
+        :param dry: perform a dry run.
+        :param parallel: the number of `ssh-keyscan` processes to run at the same time.
+        :param batch_size: the maximum number of hosts given to each `ssh-keyscan` process.
         """
-        to_add = []
-        with open(known_hosts) as fh:
-            known_hosts_set = set(line.strip() for line in fh.readlines())
-
-        cmd = ['ssh-keyscan'] + [host.hostname for host in hosts]
-        logger.debug('Call: %s',  ' '.join(cmd))
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = p.communicate()
-        for line in stdout.splitlines():
-            line = line.strip()
-            logger.info('[%s] Add the remote host SSH public key to [%s]...', line.split(' ', 1)[0], known_hosts)
-            if line not in known_hosts_set:
-                known_hosts_set.add(line)
-                to_add.append('{0}\n'.format(line))
-
-        if not dry:
-            with open(known_hosts, 'a') as fh:
-                fh.writelines(to_add)
+        write_lock = threading.Lock()
+
+        with file_lock(known_hosts):
+            index = KnownHosts(known_hosts).load()
+            with open(os.devnull if dry else known_hosts, 'a') as fh:
+                def keyscan(batch):
+                    port, hostnames = batch
+                    for line in ssh_keyscan(hostnames, port=port, timeout=self.connect_timeout):
+                        _, names, key_type, key_base64 = next(iter_entries([line]))
+                        if not names:
+                            continue
+                        logger.info('[%s] Add the remote host SSH public key to [%s]...', names[0], known_hosts)
+                        with write_lock:
+                            if index.lookup(names[0]).get(key_type) != key_base64:
+                                index.add_entry(names[0], key_type, key_base64)
+                                fh.write('{0}\n'.format(line))
+                                fh.flush()
+
+                pool = WorkerPool(keyscan, size=parallel, name='keyscan')
+                for (port, hostnames), _, ex in pool.map(iter_keyscan_batches(hosts, batch_size=batch_size)):
+                    if ex is not None:
+                        logger.error('[%s] %s', ','.join(get_host_key_name(hostname, port) for hostname in hostnames),
+                                     format_error(format_exception(ex)))
 
     def remove_from_known_hosts(self, hosts, known_hosts=DEFAULT_KNOWN_HOSTS, dry=False):
         """
@@ -78,49 +227,199 @@ class SSHCopyId(object):
         :param known_hosts: the `known_hosts` file to store the SSH public keys.
         :param dry: perform a dry run.
         """
+        names = []
         for host in hosts:
             logger.info('[%s] Removing the remote host SSH public key from [%s]...', host.hostname, known_hosts)
-            cmd = ['ssh-keygen', '-f', known_hosts, '-R', host.hostname]
-            logger.debug('Call: %s', ' '.join(cmd))
-            if not dry:
-                try:
-                    subprocess.check_call(cmd)
-                except subprocess.CalledProcessError as ex:
-                    logger.error(format_error(format_exception(ex)))
+            names.append(get_host_key_name(host.hostname, host.port))
+        if not os.path.isfile(known_hosts):
+            return
+        try:
+            removed = remove_hosts(known_hosts, names, dry=dry)
+            logger.debug('Removed %s line(s) from [%s]', removed, known_hosts)
+        except (IOError, OSError) as ex:
+            logger.error(format_error(format_exception(ex)))
 
     # TODO: change no_add_host to add_host
-    def copy_ssh_keys_to_host(self, host, password=None, no_add_host=False, known_hosts=DEFAULT_KNOWN_HOSTS):
+    def copy_ssh_keys_to_host(self, host, password=None, no_add_host=False, known_hosts=DEFAULT_KNOWN_HOSTS,
+                              get_password=None):
         """
         Copy the SSH keys to the given host.
 
+        If the authentication with the SSH key `priv_key` succeeds, the key is already authorized on the host: the
+        remote command is not run.
+
         :param host: the `Host` object to copy the SSH keys to.
         :param password: the SSH password for the given host.
         :param no_add_host: if the host is not in the known_hosts file, write an error instead of adding it to the
                             known_hosts.
-        :param known_hosts: the `known_hosts` file to store the SSH public keys.
+        :param known_hosts: the `known_hosts` file to store the SSH public keys. The new host keys are only written
+                            by `save_known_hosts()`.
+        :param get_password: if no password is given and the authentication with the keys fails, this function is
+                             called to get a password, which is then tried on the same SSH connection.
+        :return: `STATUS_UNCHANGED` if the SSH key was already authorized on the host, else `STATUS_ADDED`. The host key
+                 of the host is set in `host.host_key`, and the durations of the phases of the copy in `host.timings`.
+                 `host.attempts` is incremented.
         :raise paramiko.ssh_exception.AuthenticationException: if SSH authentication error.
         :raise paramiko.ssh_exception.SSHException: generic SSH error.
         :raise socket.error: if error at the socket level.
+        :raise msshcopyid.errors.RemoteCommandError: if the remote command failed or timed out.
+        :raise msshcopyid.errors.CancelledError: if the copies have been cancelled.
         """
-        client = None
+        if self.cancelled.is_set():
+            raise CancelledError()
+
+        host.attempts += 1
+        timer = PhaseTimer()
+        host.timings = timer.timings
+        sock = None
+        client = paramiko.SSHClient()
+        with self.clients_lock:
+            self.clients.add(client)
         try:
-            client = paramiko.SSHClient()
-            if not no_add_host:
-                client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
-            if os.path.isfile(known_hosts):
-                client.load_host_keys(filename=known_hosts)
+            # The host keys are checked against the shared index of the known_hosts file
+            client.set_missing_host_key_policy(KnownHostsPolicy(self.get_known_hosts(known_hosts),
+                                                                add_host=not no_add_host))
 
-            client.connect(host.hostname, port=host.port, username=host.user, password=password,
-                           key_filename=self.priv_key)
+            sock = self.open_socket(host, timer=timer)
+            # paramiko starts the authentication once the SSH handshake is done
+            client._auth = timer.wrap(client._auth, PHASE_HANDSHAKE)
+            authorized = self.connect(client, host, password=password, get_password=get_password, sock=sock)
+            timer.mark(PHASE_AUTH)
+            host_key = client.get_transport().get_remote_server_key()
+            host.host_key = '{0} {1}'.format(host_key.get_name(), host_key.get_base64())
+            if authorized:
+                logger.info('[%s] The SSH public key is already authorized.', host.hostname)
+                return STATUS_UNCHANGED
 
             cmd = (r'''mkdir -p ~/.ssh && chmod 700 ~/.ssh && \
 k='{0}' && if ! grep -qFx "$k" ~/.ssh/authorized_keys; then echo "$k" >> ~/.ssh/authorized_keys; fi'''
                    .format(self.pub_key_content))
             logger.debug('Run on [%s]: %s', host.hostname, cmd)
-            client.exec_command(cmd.encode('utf-8'))
+            _, stdout, _ = client.exec_command(cmd.encode('utf-8'), timeout=self.exec_timeout)
+            channel = stdout.channel
+            if not channel.status_event.wait(self.exec_timeout):
+                raise RemoteCommandError()
+            exit_status = channel.recv_exit_status()
+            timer.mark(PHASE_EXEC)
+            if exit_status != 0:
+                raise RemoteCommandError(exit_status)
+            return STATUS_ADDED
+        except Exception:
+            if self.cancelled.is_set():
+                # The connection has been closed by `cancel()`
+                raise CancelledError()
+            raise
         finally:
-            if client:
-                client.close()
+            client.close()
+            if sock is not None:
+                sock.close()
+            with self.clients_lock:
+                self.clients.discard(client)
+            timer.mark(PHASE_CLOSE)
+
+    def open_socket(self, host, timer=None):
+        """
+        Open a TCP connection to the given host, trying each of its addresses in turn.
+
+        :param host: the `Host` object to connect to.
+        :param timer: the `PhaseTimer` object to mark the end of the resolution and of the connection in.
+        :return: the connected socket.
+        :raise socket.error: if the host name cannot be resolved, or no address can be connected to.
+        """
+        addresses = socket.getaddrinfo(host.hostname, host.port, 0, socket.SOCK_STREAM)
+        if timer:
+            timer.mark(PHASE_RESOLVE)
+        error = socket.error('no address found for {0}'.format(host.hostname))
+        for family, socktype, proto, _, address in addresses:
+            sock = socket.socket(family, socktype, proto)
+            sock.settimeout(self.connect_timeout)
+            try:
+                sock.connect(address)
+            except socket.error as ex:
+                sock.close()
+                error = ex
+                continue
+            if timer:
+                timer.mark(PHASE_CONNECT)
+            return sock
+        raise error
+
+    def connect(self, client, host, password=None, get_password=None, sock=None):
+        """
+        Connect the SSH client to the given host, and authenticate.
+
+        The authentication methods are tried in this order, on the same SSH connection:
+
+        - the SSH key `priv_key` (or `pkey` if it is loaded).
+        - the keys of the SSH agent.
+        - the password, either given or got from `get_password`.
+
+        :param client: the `paramiko.SSHClient` object.
+        :param host: the `Host` object to connect to.
+        :param password: the SSH password for the given host.
+        :param get_password: if no password is given, this function is called to get one.
+        :param sock: a socket already connected to the host. Default: connect to `host.hostname`.
+        :return: `True` if the authentication with the SSH key `priv_key` succeeded, else `False`.
+        :raise paramiko.ssh_exception.AuthenticationException: if SSH authentication error.
+        """
+        try:
+            if self.pkey:
+                client.connect(host.hostname, port=host.port, username=host.user, pkey=self.pkey, allow_agent=False,
+                               look_for_keys=False, timeout=self.connect_timeout, banner_timeout=self.connect_timeout,
+                               auth_timeout=self.auth_timeout, sock=sock)
+                return True
+            elif self.priv_key:
+                client.connect(host.hostname, port=host.port, username=host.user, key_filename=self.priv_key,
+                               allow_agent=False, look_for_keys=False, timeout=self.connect_timeout,
+                               banner_timeout=self.connect_timeout, auth_timeout=self.auth_timeout, sock=sock)
+                return True
+            else:
+                client.connect(host.hostname, port=host.port, username=host.user, password=password,
+                               timeout=self.connect_timeout, banner_timeout=self.connect_timeout,
+                               auth_timeout=self.auth_timeout, sock=sock)
+                return False
+        except paramiko.ssh_exception.AuthenticationException as ex:
+            auth_exception = ex
+            transport = client.get_transport()
+            if transport is None or not transport.is_active():
+                raise
+
+        # Go on with the other authentication methods on the SSH connection that is already established
+        if self.priv_key:
+            if self.auth_with_agent(transport, host):
+                return False
+        elif password:
+            # The password has already been tried
+            raise auth_exception
+
+        if not password:
+            if not get_password:
+                raise auth_exception
+            logger.debug('[%s] Authentication with the SSH keys failed: try with a password.', host.hostname)
+            password = get_password()
+        transport.auth_password(host.user, password)
+        return False
+
+    @staticmethod
+    def auth_with_agent(transport, host):
+        """
+        Authenticate with the keys of the SSH agent, if any.
+
+        :param transport: the `paramiko.Transport` object connected to the host.
+        :param host: the `Host` object.
+        :return: `True` if the authentication succeeded, else `False`.
+        """
+        agent = paramiko.Agent()
+        try:
+            for key in agent.get_keys():
+                try:
+                    transport.auth_publickey(host.user, key)
+                    return True
+                except paramiko.ssh_exception.AuthenticationException:
+                    pass
+        finally:
+            agent.close()
+        return False
 
 
 class Host(object):
@@ -130,6 +429,9 @@ class Host(object):
         self.port = port
         self.user = user
         self.password = password
+        self.host_key = None  # the host key seen when connecting to the host. Eg: `ssh-ed25519 AAAAC3NzaC1lZDI1NTE5...`
+        self.timings = None  # the durations (in seconds) of the phases of the copy of the SSH keys, by phase
+        self.attempts = 0  # the number of attempts to copy the SSH keys
 
     def __repr__(self):
         return '<{0} {1}>'.format(type(self).__name__, self.__dict__)
@@ -0,0 +1,5 @@
+import msshcopyid.cli
+
+
+if __name__ == '__main__':
+    msshcopyid.cli.main()
@@ -2,24 +2,43 @@ from __future__ import unicode_literals
 
 import argparse
 import datetime
+import itertools
 import logging
 import os
+import signal
 import socket
 import sys
-import traceback
-
-import paramiko
+import threading
+import time
 
 import msshcopyid
+from msshcopyid.constants import DEFAULT_AUTH_TIMEOUT
+from msshcopyid.constants import DEFAULT_CACHE_DIR
+from msshcopyid.constants import DEFAULT_CONNECT_TIMEOUT
+from msshcopyid.constants import DEFAULT_EXEC_TIMEOUT
 from msshcopyid.constants import DEFAULT_KNOWN_HOSTS
+from msshcopyid.constants import DEFAULT_MAX_RETRY_DELAY, DEFAULT_RETRIES, DEFAULT_RETRY_DELAY
 from msshcopyid.constants import DEFAULT_SSH_DSA
 from msshcopyid.constants import DEFAULT_SSH_RSA
-from msshcopyid.errors import CopySSHKeyError, CopySSHKeysError
+from msshcopyid.constants import DEFAULT_STATE_DB
+from msshcopyid.constants import SCANNER_PARAMIKO, SCANNER_SSH_KEYSCAN
+from msshcopyid.constants import STATUS_FAILED, STATUS_SKIPPED, STATUS_UNCHANGED
+from msshcopyid.errors import CopySSHKeyError, CopySSHKeysError, MSSHCopyIdException
+from msshcopyid.journal import get_fingerprint, Journal
+from msshcopyid.lazy import LazyModule
 from msshcopyid.log import format_exception, format_error
+from msshcopyid.pool import ProcessPool, WorkerPool
+from msshcopyid.report import Report
+from msshcopyid.retry import get_retry_delay, is_retryable, RetryQueue
+from msshcopyid.ssh_config import SSHConfigIndex
+from msshcopyid.state import StateStore
+from msshcopyid.stats import Stats
 from msshcopyid import utils
 
 logger = logging.getLogger(__name__)
 
+paramiko = LazyModule('paramiko')
+
 
 def main():
     start_dt = datetime.datetime.now()
@@ -43,6 +62,11 @@ class Main(object):
 
         self.sshcopyid = None
 
+        # Only one thread at a time can prompt the user for the password
+        self.password_lock = threading.Lock()
+        # The worker processes cannot prompt the user for the password
+        self.can_prompt_password = True
+
     def init(self, argv=sys.argv):
         # Parse input arguments
         parser = self.get_parser()
@@ -53,27 +77,41 @@ class Main(object):
 
         # Check input arguments
         self.check_ssh_key_exists()
+        self.check_hosts()
         self.check_add_remove_options_exclusion()
+        self.check_journal_options_exclusion()
+        self.check_max_age()
+        self.check_parallel()
+        self.check_timeouts()
 
-        # Get the password
-        default_password = self.args.password or utils.get_password(from_stdin_only=True)
+        # Get the password, unless the STDIN is used for the hosts
+        default_password = self.args.password
+        if not default_password and self.args.hosts_file != '-':
+            default_password = utils.get_password(from_stdin_only=True)
 
-        # Load ~/.ssh/config if it exists
-        self.ssh_config = utils.load_ssh_config()
+        # Load ~/.ssh/config if it exists, and index it for the lookups of the hosts
+        ssh_config = utils.load_ssh_config(cache_dir=DEFAULT_CACHE_DIR)
+        self.ssh_config = SSHConfigIndex(ssh_config) if ssh_config is not None else None
 
         # Init `SSHCopyId` object
         self.sshcopyid = msshcopyid.SSHCopyId(priv_key=self.args.identity, ssh_config=self.ssh_config,
-                                              default_password=default_password)
+                                              default_password=default_password,
+                                              connect_timeout=self.args.connect_timeout,
+                                              auth_timeout=self.args.auth_timeout,
+                                              exec_timeout=self.args.exec_timeout)
 
-        # Parse the hosts to extract the username if given
-        self.hosts = utils.parse_hosts(self.args.hosts, ssh_port=self.args.port, ssh_config=self.ssh_config)
+        # Parse the hosts to extract the username if given. The hosts file is read lazily, as the hosts are processed.
+        hosts = self.args.hosts
+        if self.args.hosts_file:
+            hosts = itertools.chain(hosts, utils.read_hosts_file(self.args.hosts_file))
+        self.hosts = utils.iter_hosts(hosts, ssh_port=self.args.port, ssh_config=self.ssh_config)
 
     def init_log(self, verbose):
         root_logger = logging.getLogger()
         sh = logging.StreamHandler()
         root_logger.addHandler(sh)
         if verbose:
-            sh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] [%(name)s] %(message)s"))
+            sh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] [%(threadName)s] [%(name)s] %(message)s"))
             root_logger.setLevel(logging.DEBUG)
         else:
             sh.setFormatter(logging.Formatter('%(message)s'))
@@ -100,19 +138,72 @@ class Main(object):
         else:
             logger.debug('Found SSH key: %s', self.args.identity)
 
+    def check_hosts(self):
+        error_msg = None
+
+        if not self.args.hosts and not self.args.hosts_file:
+            error_msg = 'no host given: give the hosts as arguments or with -f/--hosts-file.'
+        elif self.args.hosts_file and self.args.hosts_file != '-' and not os.path.isfile(self.args.hosts_file):
+            error_msg = 'Cannot find the hosts file "{0}".'.format(self.args.hosts_file)
+
+        if error_msg:
+            logger.error(format_error(error_msg))
+            sys.exit(1)
+
+    def check_parallel(self):
+        for option in ('parallel', 'processes'):
+            if getattr(self.args, option) < 1:
+                logger.error(format_error('argument --{0} must be greater than or equal to 1.'.format(option)))
+                sys.exit(1)
+        if self.args.retries < 0:
+            logger.error(format_error('argument --retries must be greater than or equal to 0.'))
+            sys.exit(1)
+
+    def check_timeouts(self):
+        for option in ('connect_timeout', 'auth_timeout', 'exec_timeout', 'deadline', 'retry_delay', 'max_retry_delay'):
+            value = getattr(self.args, option)
+            if value is not None and value <= 0:
+                logger.error(format_error('argument --{0} must be greater than 0.'.format(option.replace('_', '-'))))
+                sys.exit(1)
+
     def check_add_remove_options_exclusion(self):
         if self.args.add and self.args.remove:
             logger.error(format_error('argument -a/--add not allowed with argument -r/--remove.'))
             sys.exit(1)
 
+    def check_journal_options_exclusion(self):
+        if self.args.journal and self.args.resume:
+            logger.error(format_error('argument --journal not allowed with argument --resume.'))
+            sys.exit(1)
+
+    def check_max_age(self):
+        if self.args.max_age is not None and not self.args.skip_known_good:
+            logger.error(format_error('argument --max-age requires argument --skip-known-good.'))
+            sys.exit(1)
+
     def get_parser(self):
         parser = argparse.ArgumentParser(description='Copy SSH keys to multiple servers.')
-        parser.add_argument('hosts', metavar='host', nargs='+',
+        parser.add_argument('hosts', metavar='host', nargs='*',
                             help='the remote hosts to copy the keys to.  Syntax: [user@]hostname')
+        parser.add_argument('-f', '--hosts-file', metavar='PATH',
+                            help='read the hosts from a file (or from the STDIN with "-"): one or several hosts per '
+                                 'line, with the same syntax as the arguments. The password cannot be sent on the '
+                                 'STDIN in that case.')
         parser.add_argument('-k', '--known-hosts', default=DEFAULT_KNOWN_HOSTS,
                             help='the known_hosts file to use. Default: ~/.ssh/known_hosts')
         parser.add_argument('-n', '--dry', action='store_true', help='do a dry run. Do not change anything')
         parser.add_argument('-v', '--verbose', action='store_true', help='enable verbose mode.')
+        parser.add_argument('-j', '--parallel', type=int, default=1, metavar='N',
+                            help='process N hosts at the same time. Default: 1')
+        parser.add_argument('--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT, metavar='SECONDS',
+                            help='the timeout to connect to a remote host. Default: {0}'
+                                 .format(DEFAULT_CONNECT_TIMEOUT))
+        parser.add_argument('--stats', action='store_true',
+                            help='print the durations of the phases of the copies (resolve, connect, handshake, auth, '
+                                 'exec, close) and the slowest hosts at the end.')
+        parser.add_argument('--report', metavar='PATH',
+                            help='write the result of each host to PATH (or to the STDOUT with "-") as it completes: '
+                                 'one JSON object per line.')
         parser.add_argument('--version', action='version', version=msshcopyid.__version__)
 
         copy_group = parser.add_argument_group('Copy SSH keys')
@@ -127,6 +218,43 @@ class Main(object):
                                 help='the password to log into the remote hosts.  It is NOT SECURED to set the '
                                      'password that way, since it stays in the bash history. Password can also be sent '
                                      'on the STDIN.')
+        copy_group.add_argument('--processes', type=int, default=1, metavar='N',
+                                help='spread the hosts over N processes, each one copying the SSH keys to --parallel '
+                                     'hosts at the same time. The password cannot be prompted in that mode. Default: 1')
+        copy_group.add_argument('--auth-timeout', type=float, default=DEFAULT_AUTH_TIMEOUT, metavar='SECONDS',
+                                help='the timeout to authenticate on a remote host. Default: {0}'
+                                     .format(DEFAULT_AUTH_TIMEOUT))
+        copy_group.add_argument('--exec-timeout', type=float, default=DEFAULT_EXEC_TIMEOUT, metavar='SECONDS',
+                                help='the timeout of the command that installs the SSH keys on a remote host. '
+                                     'Default: {0}'.format(DEFAULT_EXEC_TIMEOUT))
+        copy_group.add_argument('--deadline', type=float, metavar='SECONDS',
+                                help='the maximum duration of the whole copy. The copies still in progress are '
+                                     'cancelled when it is exceeded.')
+        copy_group.add_argument('--retries', type=int, default=DEFAULT_RETRIES, metavar='N',
+                                help='retry up to N times the hosts failing with a transient error (connection refused '
+                                     'or reset, timeout...), after an exponential backoff. Default: {0}'
+                                     .format(DEFAULT_RETRIES))
+        copy_group.add_argument('--retry-delay', type=float, default=DEFAULT_RETRY_DELAY, metavar='SECONDS',
+                                help='the base delay before retrying a host, doubled after each attempt. Default: {0}'
+                                     .format(DEFAULT_RETRY_DELAY))
+        copy_group.add_argument('--max-retry-delay', type=float, default=DEFAULT_MAX_RETRY_DELAY, metavar='SECONDS',
+                                help='the maximum delay before retrying a host. Default: {0}'
+                                     .format(DEFAULT_MAX_RETRY_DELAY))
+        copy_group.add_argument('--journal', metavar='JOURNAL',
+                                help='record the outcome of each host in the JOURNAL file, to be able to resume the '
+                                     'copy with --resume')
+        copy_group.add_argument('--resume', metavar='JOURNAL',
+                                help='skip the hosts that already have the SSH public key according to the JOURNAL '
+                                     'file, and record the outcome of the other hosts in it')
+        copy_group.add_argument('--skip-known-good', action='store_true',
+                                help='skip the hosts where the SSH public key has already been copied by a previous '
+                                     'run, according to the state database')
+        copy_group.add_argument('--max-age', type=utils.parse_duration, metavar='DURATION',
+                                help='with --skip-known-good, only skip the hosts where the SSH public key has been '
+                                     'copied within DURATION. Eg: 12h, 7d')
+        copy_group.add_argument('--state-db', metavar='PATH',
+                                help='the state database recording the hosts where the SSH public key has been copied. '
+                                     'Default with --skip-known-good: {0}'.format(DEFAULT_STATE_DB))
 
         known_host_group = parser.add_argument_group('Manage the "known_host" file only')
         known_host_group.add_argument('-a', '--add', action='store_true',
@@ -135,6 +263,10 @@ class Main(object):
         known_host_group.add_argument('-r', '--remove', action='store_true',
                                       help='don\'t copy the SSH keys, but instead, remove the given hosts from the '
                                            '"known_hosts" file')
+        known_host_group.add_argument('--scanner', choices=(SCANNER_PARAMIKO, SCANNER_SSH_KEYSCAN),
+                                      default=SCANNER_PARAMIKO,
+                                      help='the tool to fetch the host keys with -a/--add. Default: {0}'
+                                           .format(SCANNER_PARAMIKO))
         return parser
 
     def run(self):
@@ -152,71 +284,285 @@ class Main(object):
                     pass
 
             if self.args.add:
-                self.sshcopyid.add_to_known_hosts(self.hosts, known_hosts=self.args.known_hosts, dry=self.args.dry)
+                self.sshcopyid.add_to_known_hosts(self.hosts, known_hosts=self.args.known_hosts, dry=self.args.dry,
+                                                  parallel=self.args.parallel, scanner=self.args.scanner)
             else:
                 self.sshcopyid.remove_from_known_hosts(self.hosts, known_hosts=self.args.known_hosts, dry=self.args.dry)
 
         else:
             # Copy the SSH keys to the hosts
             if self.args.clear:
-                # Clear the hosts from the known_hosts file
+                # Clear the hosts from the known_hosts file. The hosts are then needed again for the copy: keep them.
+                self.hosts = list(self.hosts)
                 self.sshcopyid.remove_from_known_hosts(self.hosts, known_hosts=self.args.known_hosts, dry=self.args.dry)
 
             # Read the public key
             if not self.sshcopyid.pub_key_content:
                 self.sshcopyid.read_pub_key()
 
+            # Load the private key once for all the hosts
+            if not self.args.dry and not self.sshcopyid.pkey:
+                self.sshcopyid.load_priv_key(get_passphrase=lambda: utils.get_passphrase(self.sshcopyid.priv_key))
+
+            # Open the journal and the state database
+            fingerprint = get_fingerprint(self.sshcopyid.pub_key_content)
+            journal = None
+            if self.args.journal or self.args.resume:
+                journal = Journal(self.args.journal or self.args.resume, fingerprint=fingerprint)
+                if self.args.resume:
+                    journal.load()
+            state = None
+            if self.args.skip_known_good or self.args.state_db:
+                state = StateStore(self.args.state_db or DEFAULT_STATE_DB, fingerprint=fingerprint).open()
+            report = Report(self.args.report).open() if self.args.report else None
+
             try:
-                self.copy_ssh_keys_to_hosts(self.hosts, known_hosts=self.args.known_hosts, dry=self.args.dry)
+                self.copy_ssh_keys_to_hosts(self.hosts, known_hosts=self.args.known_hosts, dry=self.args.dry,
+                                            parallel=self.args.parallel, processes=self.args.processes,
+                                            deadline=self.args.deadline, journal=journal, state=state,
+                                            skip_known_good=self.args.skip_known_good, max_age=self.args.max_age,
+                                            stats=Stats() if self.args.stats else None, report=report,
+                                            retries=self.args.retries, retry_delay=self.args.retry_delay,
+                                            max_retry_delay=self.args.max_retry_delay)
             except CopySSHKeysError as ex:
                 logger.error(format_error(format_exception(ex)))
                 raise
-
-    def copy_ssh_keys_to_hosts(self, hosts, known_hosts=DEFAULT_KNOWN_HOSTS, dry=False):
+            finally:
+                if journal:
+                    journal.close()
+                if state:
+                    state.close()
+                if report:
+                    report.close()
+
+    def copy_ssh_keys_to_hosts(self, hosts, known_hosts=DEFAULT_KNOWN_HOSTS, dry=False, parallel=1, processes=1,
+                               deadline=None, journal=None, state=None, skip_known_good=False, max_age=None,
+                               stats=None, report=None, retries=0, retry_delay=DEFAULT_RETRY_DELAY,
+                               max_retry_delay=DEFAULT_MAX_RETRY_DELAY):
         """
         Copy the SSH keys to the given hosts.
 
+        The hosts that fail with a transient error are tried again after an exponential backoff with jitter, behind the
+        hosts not tried yet.
+
+        On Ctrl-C, no new host is started, but the hosts in progress are completed (and recorded in the journal). A
+        second Ctrl-C aborts immediately.
+
         :param hosts: the list of `Host` objects to copy the SSH keys to.
         :param known_hosts: the `known_hosts` file to store the SSH public keys.
         :param dry: perform a dry run.
+        :param parallel: the number of hosts to copy the SSH keys to at the same time (in each process).
+        :param processes: the number of processes to spread the hosts over.
+        :param deadline: the maximum duration (in seconds) of the whole copy. `None` means no deadline.
+        :param journal: the `Journal` object to record the outcome of each host in. The hosts that already have the
+                        SSH public key according to the journal are skipped.
+        :param state: the `StateStore` object to record the hosts where the SSH public key is copied in.
+        :param skip_known_good: skip the hosts where the SSH public key has already been copied according to `state`.
+        :param max_age: with `skip_known_good`, only skip the hosts where the SSH public key has been copied within
+                        `max_age` seconds.
+        :param stats: the `Stats` object to add the durations of the phases of each host to. The summary is printed at
+                      the end.
+        :param report: the `Report` object to write the result of each host to.
+        :param retries: the maximum number of retries of a host failing with a transient error.
+        :param retry_delay: the base delay (in seconds) before retrying a host, doubled after each attempt.
+        :param max_retry_delay: the maximum delay (in seconds) before retrying a host.
         :raise msshcopyid.errors.CopySSHKeysError:
+        :raise KeyboardInterrupt: if interrupted by Ctrl-C, once the hosts in progress are completed.
         """
-        exceptions = []  # list of `CopySSHKeyError`
-        for host in hosts:
+        interrupted = threading.Event()
+        hosts = self.filter_hosts(hosts, journal=journal, state=state if skip_known_good else None, max_age=max_age,
+                                  stop_event=interrupted, report=report)
+
+        if dry:
+            for host in hosts:
+                logger.info('[%s] Copy the SSH public key [%s]...', host.hostname, self.sshcopyid.pub_key)
+            return
+
+        def copy(host):
             logger.info('[%s] Copy the SSH public key [%s]...', host.hostname, self.sshcopyid.pub_key)
-            if not dry:
-                try:
-                    self.copy_ssh_keys_to_host(host, known_hosts=known_hosts)
-                except (paramiko.ssh_exception.SSHException, socket.error) as ex:
-                    logger.error(format_error(format_exception(ex)))
-                    logger.debug(traceback.format_exc())
-                    exceptions.append(CopySSHKeyError(host=host, exception=ex))
+            return self.copy_ssh_keys_to_host(host, known_hosts=known_hosts)
+
+        deadline_time = time.time() + deadline if deadline else None
+        timer = self.start_deadline_timer(deadline_time, self.cancel, deadline) if deadline else None
+
+        if processes > 1:
+            def init_process():
+                # Ctrl-C is handled by the main process only: it stops sending the hosts to the worker processes
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                # The threads are not inherited by the forked processes: start a new deadline timer
+                self.can_prompt_password = False
+                if deadline:
+                    self.start_deadline_timer(deadline_time, self.sshcopyid.cancel)
+
+            pool = ProcessPool(copy, processes=processes, size=parallel, name='copy', initializer=init_process,
+                               finalizer=self.sshcopyid.save_known_hosts)
+        else:
+            pool = WorkerPool(copy, size=parallel, name='copy')
+
+        unchanged = 0
+        retried = 0
+        count = 0
+        exceptions = []  # list of `CopySSHKeyError`
+
+        def fail(host, ex):
+            logger.error('[%s] %s', host.hostname, format_error(format_exception(ex)))
+            exceptions.append(CopySSHKeyError(host=host, exception=ex))
+            if journal:
+                journal.record(host, STATUS_FAILED, error=str(ex))
+            if report:
+                report.record(host, STATUS_FAILED, exception=ex)
 
+        retry_queue = RetryQueue(hosts, stop_event=interrupted)
+        previous_sigint_handler = self.set_sigint_handler(interrupted)
+        try:
+            for host, status, ex in pool.map(retry_queue):
+                if stats and host.timings:
+                    stats.add(host)
+                if ex is not None and host.attempts <= retries and is_retryable(ex):
+                    delay = get_retry_delay(host.attempts, delay=retry_delay, max_delay=max_retry_delay)
+                    if deadline_time is None or time.time() + delay < deadline_time:
+                        logger.info('[%s] %s: retry in %.1f second(s) (attempt %s of %s).', host.hostname,
+                                    format_exception(ex), delay, host.attempts + 1, retries + 1)
+                        retry_queue.retry(host, delay, exception=ex)
+                        continue
+                retry_queue.done(host)
+                count += 1
+                if host.attempts > 1:
+                    retried += 1
+                if ex is None:
+                    if status == STATUS_UNCHANGED:
+                        unchanged += 1
+                    if journal:
+                        journal.record(host, status)
+                    if state:
+                        state.record_success(host)
+                    if report:
+                        report.record(host, status)
+                    continue
+                elif isinstance(ex, (paramiko.ssh_exception.SSHException, socket.error, MSSHCopyIdException)):
+                    fail(host, ex)
+                else:
+                    raise ex
+            # The hosts still waiting to be retried when interrupted
+            for host, ex in retry_queue.pending():
+                count += 1
+                retried += 1
+                fail(host, ex)
+        finally:
+            retry_queue.close()
+            if previous_sigint_handler is not None:
+                signal.signal(signal.SIGINT, previous_sigint_handler)
+            if timer:
+                timer.cancel()
+            # Write the new host keys all at once
+            self.sshcopyid.save_known_hosts()
+
+        logger.info('Copied the SSH public key to %s host(s) out of %s (%s already had it, %s retried).',
+                    count - len(exceptions), count, unchanged, retried)
+        if stats:
+            for line in stats.format():
+                logger.info(line)
+        if interrupted.is_set():
+            logger.error(format_error('Interrupted: the remaining hosts have been skipped.'))
+            raise KeyboardInterrupt()
         if exceptions:
             raise CopySSHKeysError(exceptions=exceptions)
 
+    @staticmethod
+    def filter_hosts(hosts, journal=None, state=None, max_age=None, stop_event=None, report=None):
+        """
+        :param hosts: an iterable of `Host` objects.
+        :param journal: the `Journal` object. The hosts that already have the SSH public key according to it are
+                        skipped.
+        :param state: the `StateStore` object. The hosts where the SSH public key has already been copied (within
+                      `max_age` seconds) according to it are skipped.
+        :param max_age: the maximum age (in seconds) of the copies in `state`. `None` means no limit.
+        :param stop_event: a `threading.Event`. When it is set, no more host is given.
+        :param report: the `Report` object to write the skipped hosts to.
+        :return: a generator of the `Host` objects to copy the SSH keys to.
+        """
+        for host in hosts:
+            if stop_event is not None and stop_event.is_set():
+                return
+            if journal is not None and journal.is_done(host):
+                logger.info('[%s] Skip: the SSH public key has already been copied according to the journal.',
+                            host.hostname)
+                if report is not None:
+                    report.record(host, STATUS_SKIPPED)
+                continue
+            if state is not None and state.is_known_good(host, max_age=max_age):
+                logger.info('[%s] Skip: the SSH public key has already been copied according to the state database.',
+                            host.hostname)
+                if report is not None:
+                    report.record(host, STATUS_SKIPPED)
+                continue
+            yield host
+
+    @staticmethod
+    def set_sigint_handler(interrupted):
+        """
+        Handle Ctrl-C: the first one sets the `interrupted` event, the second one raises `KeyboardInterrupt`.
+
+        :param interrupted: a `threading.Event`.
+        :return: the previous SIGINT handler, or `None` if the handler cannot be set (not in the main thread).
+        """
+        def handle_sigint(signum, frame):
+            if interrupted.is_set():
+                raise KeyboardInterrupt()
+            logger.error(format_error('Interrupted: waiting for the hosts in progress. Press Ctrl-C again to abort.'))
+            interrupted.set()
+
+        try:
+            return signal.signal(signal.SIGINT, handle_sigint)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def start_deadline_timer(deadline_time, func, *args):
+        """
+        Start a timer that calls `func(*args)` when the deadline is exceeded.
+
+        :param deadline_time: the deadline, as a timestamp.
+        :return: the started `threading.Timer`.
+        """
+        timer = threading.Timer(max(0, deadline_time - time.time()), func, args=args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def cancel(self, deadline):
+        logger.error(format_error('The deadline of {0} seconds has been exceeded: cancel the remaining copies.'
+                                  .format(deadline)))
+        self.sshcopyid.cancel()
+
     def copy_ssh_keys_to_host(self, host, known_hosts=DEFAULT_KNOWN_HOSTS):
         """
         Copy the SSH keys to the given host.
 
         :param host: the `Host` object to copy the SSH keys to.
         :param known_hosts: the `known_hosts` file to store the SSH public keys.
+        :return: `STATUS_ADDED` or `STATUS_UNCHANGED`.
         :raise paramiko.ssh_exception.AuthenticationException:
         """
         password = host.password or self.sshcopyid.default_password
-        try:
-            self.sshcopyid.copy_ssh_keys_to_host(host, password=password, no_add_host=self.args.no_add_host,
-                                                 known_hosts=known_hosts)
+        # If no password is given, prompt for it only if the authentication with the SSH keys fails
+        get_password = None if password else self.get_default_password
+        return self.sshcopyid.copy_ssh_keys_to_host(host, password=password, no_add_host=self.args.no_add_host,
+                                                    known_hosts=known_hosts, get_password=get_password)
 
-        except paramiko.ssh_exception.AuthenticationException:
-            if password:
-                # A password was given, and it is wrong
-                raise
-            else:
-                # Ask for password
-                password = utils.get_password()
-                self.sshcopyid.default_password = password
+    def get_default_password(self):
+        """
+        Get the default password, prompting the user for it if it has not been given yet.
+
+        Only one thread at a time can prompt the user: the other threads wait, then reuse the given password.
 
-                # Try to connect again
-                self.sshcopyid.copy_ssh_keys_to_host(host, password=password, no_add_host=self.args.no_add_host,
-                                                     known_hosts=known_hosts)
+        :return: the default password.
+        :raise paramiko.ssh_exception.AuthenticationException: if the password is needed, but cannot be prompted.
+        """
+        with self.password_lock:
+            if not self.sshcopyid.default_password:
+                if not self.can_prompt_password:
+                    raise paramiko.ssh_exception.AuthenticationException(
+                        'Cannot prompt for the password with --processes: give it with -P or on the STDIN.')
+                self.sshcopyid.default_password = utils.get_password()
+            return self.sshcopyid.default_password
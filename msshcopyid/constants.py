@@ -7,3 +7,29 @@ DEFAULT_SSH_CONFIG = os.path.join(DEFAULT_SSH_DIR, 'config')
 DEFAULT_SSH_DSA = os.path.join(DEFAULT_SSH_DIR, 'id_dsa')
 DEFAULT_SSH_RSA = os.path.join(DEFAULT_SSH_DIR, 'id_rsa')
 DEFAULT_SSH_PORT = 22
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), '.cache'),
+                                 'mssh-copy-id')
+DEFAULT_DATA_DIR = os.path.join(os.environ.get('XDG_DATA_HOME') or
+                                os.path.join(os.path.expanduser("~"), '.local', 'share'), 'mssh-copy-id')
+DEFAULT_STATE_DB = os.path.join(DEFAULT_DATA_DIR, 'state.db')
+
+# Tools to fetch the host keys for `--add`
+SCANNER_PARAMIKO = 'paramiko'
+SCANNER_SSH_KEYSCAN = 'ssh-keyscan'
+
+# Status of a host after the copy of the SSH keys
+STATUS_ADDED = 'added'
+STATUS_UNCHANGED = 'unchanged'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+# Timeouts (in seconds)
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_AUTH_TIMEOUT = 30
+DEFAULT_EXEC_TIMEOUT = 30
+
+# Retries of the copies that failed with a transient error
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_DELAY = 1  # the base delay (in seconds) of the exponential backoff
+DEFAULT_MAX_RETRY_DELAY = 30  # the maximum delay (in seconds) between two attempts
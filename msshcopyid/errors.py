@@ -2,6 +2,29 @@ class MSSHCopyIdException(Exception):
     pass
 
 
+class CancelledError(MSSHCopyIdException):
+    """
+    The copy of the SSH keys has been cancelled (e.g. because the deadline has been exceeded).
+    """
+
+    def __str__(self):
+        return 'Cancelled'
+
+
+class RemoteCommandError(MSSHCopyIdException):
+    """
+    The command run on the remote host to install the SSH keys failed.
+    """
+
+    def __init__(self, exit_status=None):
+        self.exit_status = exit_status
+
+    def __str__(self):
+        if self.exit_status is None:
+            return 'The remote command timed out.'
+        return 'The remote command exited with status {0}.'.format(self.exit_status)
+
+
 class CopySSHKeyError(MSSHCopyIdException):
     """
     This exception contains the host name and the exception.
@@ -27,4 +50,4 @@ class CopySSHKeysError(MSSHCopyIdException):
         self.exceptions = exceptions
 
     def __str__(self):
-        return '\n'.join(self.exceptions)
+        return '\n'.join(str(ex) for ex in self.exceptions)
@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from msshcopyid.constants import STATUS_ADDED, STATUS_UNCHANGED
+
+logger = logging.getLogger(__name__)
+
+# The statuses of the hosts that have the SSH public key
+SUCCESS_STATUSES = (STATUS_ADDED, STATUS_UNCHANGED)
+
+
+def get_host_id(host):
+    """
+    :param host: the `Host` object.
+    :return: the identifier of the host in the journal. Eg: `root@server1:22`
+    """
+    return '{0}@{1}:{2}'.format(host.user, host.hostname, host.port)
+
+
+def get_fingerprint(pub_key_content):
+    """
+    :param pub_key_content: the content of the SSH public key file. Eg: `ssh-rsa AAAAB3NzaC1yc2EAAAAB... me@laptop`
+    :return: the SHA256 fingerprint of the SSH public key, as `ssh-keygen -l`. Eg: `SHA256:nThbg6kXUpJWGl7E1IGOCsp...`
+    """
+    fields = pub_key_content.split()
+    try:
+        blob = base64.b64decode(fields[1])
+    except (IndexError, TypeError, binascii.Error):
+        # Not a valid public key: fingerprint the whole content
+        blob = pub_key_content.encode('utf-8')
+    digest = base64.b64encode(hashlib.sha256(blob).digest()).decode('ascii').rstrip('=')
+    return 'SHA256:{0}'.format(digest)
+
+
+class Journal(object):
+    """
+    An append-only journal of the copies of the SSH public key: one JSON object per line and per host.
+
+    Each line is flushed as soon as it is written, so that the journal is up-to-date even if the process is killed. A
+    truncated last line is ignored when the journal is loaded.
+    """
+
+    def __init__(self, filename, fingerprint):
+        """
+        :param filename: the journal file.
+        :param fingerprint: the fingerprint of the SSH public key being copied.
+        """
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.done = set()  # the identifiers of the hosts that already have the SSH public key
+        self.fh = None
+
+    def load(self):
+        """
+        Load the hosts that already have the SSH public key (the same fingerprint) from the journal, if it exists.
+
+        :return: the `Journal` object itself.
+        """
+        if not os.path.isfile(self.filename):
+            return self
+        with open(self.filename) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.debug('Invalid line in the journal [%s]: %r', self.filename, line)
+                    continue
+                if entry.get('fingerprint') != self.fingerprint:
+                    continue
+                if entry.get('status') in SUCCESS_STATUSES:
+                    self.done.add(entry.get('host'))
+                else:
+                    self.done.discard(entry.get('host'))
+        logger.debug('Loaded [%s]: %s host(s) already have the SSH public key', self.filename, len(self.done))
+        return self
+
+    def is_done(self, host):
+        """
+        :param host: the `Host` object.
+        :return: `True` if the journal records that the host already has the SSH public key.
+        """
+        return get_host_id(host) in self.done
+
+    def record(self, host, status, error=None):
+        """
+        Append the outcome of a host to the journal.
+
+        :param host: the `Host` object.
+        :param status: the status of the host: `STATUS_ADDED`, `STATUS_UNCHANGED` or `STATUS_FAILED`.
+        :param error: the error message, if the copy failed.
+        """
+        entry = {'host': get_host_id(host), 'status': status, 'fingerprint': self.fingerprint, 'time': time.time()}
+        if error is not None:
+            entry['error'] = error
+        line = '{0}\n'.format(json.dumps(entry, sort_keys=True))
+        with self.lock:
+            if self.fh is None:
+                self.fh = open(self.filename, 'a')
+            self.fh.write(line)
+            self.fh.flush()
+
+    def close(self):
+        with self.lock:
+            if self.fh is not None:
+                os.fsync(self.fh.fileno())
+                self.fh.close()
+                self.fh = None
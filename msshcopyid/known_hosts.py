@@ -0,0 +1,426 @@
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import contextlib
+import hashlib
+import hmac
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX
+    fcntl = None
+
+from msshcopyid.constants import DEFAULT_SSH_PORT
+from msshcopyid.errors import MSSHCopyIdException
+from msshcopyid.lazy import LazyModule
+
+logger = logging.getLogger(__name__)
+
+paramiko = LazyModule('paramiko')
+
+# The host key algorithms scanned, as `ssh-keyscan` does: one SSH connection for each group
+KEYSCAN_KEY_TYPES = (
+    ('ssh-ed25519',),
+    ('ecdsa-sha2-nistp256', 'ecdsa-sha2-nistp384', 'ecdsa-sha2-nistp521'),
+    ('rsa-sha2-512', 'rsa-sha2-256', 'ssh-rsa'),
+)
+
+# The maximum number of hosts given to each `ssh-keyscan` process
+KEYSCAN_BATCH_SIZE = 100
+
+
+def get_host_key_name(hostname, port=DEFAULT_SSH_PORT):
+    """
+    :return: the name of the host in the `known_hosts` file. Eg: `server1` or `[server1]:2222`
+    """
+    if port is None or int(port) == DEFAULT_SSH_PORT:
+        return hostname
+    return '[{0}]:{1}'.format(hostname, port)
+
+
+def is_hashed(name):
+    return name.startswith('|1|')
+
+
+def match_hashed(hashed_name, names):
+    """
+    :param hashed_name: a hashed host name. Eg: `|1|salt|hash`
+    :param names: a list of host key names, encoded in UTF-8.
+    :return: `True` if one of the names matches the hashed host name.
+    """
+    try:
+        _, _, salt, expected = hashed_name.split('|')
+        salt = base64.b64decode(salt)
+        expected = base64.b64decode(expected)
+    except (ValueError, TypeError, binascii.Error):
+        return False
+    return any(hmac.new(salt, name, hashlib.sha1).digest() == expected for name in names)
+
+
+def iter_entries(lines):
+    """
+    Parse the lines of a `known_hosts` file.
+
+    :param lines: an iterable of lines.
+    :return: a generator of `(line, names, key_type, key_base64)` tuples. `names` is `None` for the comments, the empty
+             lines, the markers (`@cert-authority`, `@revoked`) and the invalid lines.
+    """
+    for line in lines:
+        fields = line.strip().split()
+        if len(fields) < 3 or fields[0].startswith('#') or fields[0].startswith('@'):
+            yield line, None, None, None
+        else:
+            yield line, fields[0].split(','), fields[1], fields[2]
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """
+    Hold an exclusive lock on `<filename>.lock`, shared with the other `mssh-copy-id` processes.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open('{0}.lock'.format(filename), 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def atomic_write(filename, lines):
+    """
+    Write the lines in a temporary file, then rename it to `filename`, so that the file is never seen half-written.
+
+    The permissions of the existing file are kept.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(prefix='.{0}.'.format(os.path.basename(filename)), dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.writelines(lines)
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmp_filename)
+        os.rename(tmp_filename, filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+
+
+def remove_hosts(filename, names, dry=False):
+    """
+    Remove the lines of the given hosts from the `known_hosts` file, in a single pass over the file.
+
+    As `ssh-keygen -R` does, a line is removed if any of its host names (plain or hashed) matches, and the original
+    file is kept as `<filename>.old`.
+
+    :param filename: the `known_hosts` file.
+    :param names: the host key names to remove. Eg: `['server1', '[server2]:2222']`
+    :param dry: perform a dry run.
+    :return: the number of removed lines.
+    """
+    names = set(names)
+    encoded_names = [name.encode('utf-8') for name in names]
+    with file_lock(filename):
+        lines = []
+        removed = 0
+        with open(filename) as fh:
+            for line, entry_names, _, _ in iter_entries(fh):
+                if entry_names and any(name in names if not is_hashed(name) else match_hashed(name, encoded_names)
+                                       for name in entry_names):
+                    removed += 1
+                else:
+                    lines.append(line)
+
+        if removed and not dry:
+            shutil.copy2(filename, '{0}.old'.format(filename))
+            atomic_write(filename, lines)
+    return removed
+
+
+def scan_host_keys(hostname, port=DEFAULT_SSH_PORT, timeout=None):
+    """
+    Fetch the host keys of a remote host, with one SSH connection (key exchange only) for each type of key.
+
+    :param hostname: the remote host name.
+    :param port: the remote SSH port.
+    :param timeout: the timeout (in seconds) of each SSH connection.
+    :return: the list of `paramiko.PKey` objects.
+    :raise paramiko.ssh_exception.SSHException: if no host key can be fetched.
+    :raise socket.error: if error at the socket level.
+    """
+    keys = []
+    last_exception = None
+    for key_types in KEYSCAN_KEY_TYPES:
+        try:
+            key = scan_host_key(hostname, port=port, key_types=key_types, timeout=timeout)
+        except paramiko.ssh_exception.SSHException as ex:
+            # Most likely, the remote host does not have this type of key
+            logger.debug('[%s] Cannot fetch the %s host key: %s', hostname, key_types[0], ex)
+            last_exception = ex
+            continue
+        if key is not None:
+            keys.append(key)
+    if not keys and last_exception is not None:
+        raise last_exception
+    return keys
+
+
+def scan_host_key(hostname, port=DEFAULT_SSH_PORT, key_types=None, timeout=None):
+    """
+    Fetch a host key of a remote host.
+
+    :param hostname: the remote host name.
+    :param port: the remote SSH port.
+    :param key_types: the host key algorithms to negotiate. `None` means the paramiko defaults.
+    :param timeout: the timeout (in seconds) of the SSH connection.
+    :return: the `paramiko.PKey` object, or `None` if none of the host key algorithms is supported by paramiko.
+    :raise paramiko.ssh_exception.SSHException: generic SSH error.
+    :raise socket.error: if error at the socket level.
+    """
+    sock = socket.create_connection((hostname, port), timeout)
+    try:
+        transport = paramiko.Transport(sock)
+    except Exception:
+        sock.close()
+        raise
+    try:
+        if key_types:
+            options = transport.get_security_options()
+            supported = []
+            for key_type in key_types:
+                try:
+                    options.key_types = [key_type]
+                    supported.append(key_type)
+                except ValueError:
+                    # Not supported by this version of paramiko
+                    pass
+            if not supported:
+                return None
+            options.key_types = supported
+        if timeout is not None:
+            transport.banner_timeout = timeout
+        transport.start_client(timeout=timeout)
+        return transport.get_remote_server_key()
+    finally:
+        transport.close()
+
+
+def iter_keyscan_batches(hosts, batch_size=KEYSCAN_BATCH_SIZE):
+    """
+    Split the hosts into batches for `ssh-keyscan`, which takes a single port for all its hosts.
+
+    The hosts are consumed lazily: a batch is yielded as soon as it is full, and the incomplete batches at the end.
+
+    :param hosts: an iterable of `Host` objects.
+    :param batch_size: the maximum number of hosts in a batch.
+    :return: a generator of `(port, hostnames)` tuples.
+    """
+    batches = {}  # {port: [hostname, ...]}
+    for host in hosts:
+        port = DEFAULT_SSH_PORT if host.port is None else int(host.port)
+        batch = batches.setdefault(port, [])
+        batch.append(host.hostname)
+        if len(batch) >= batch_size:
+            yield port, batches.pop(port)
+    for port, batch in batches.items():
+        yield port, batch
+
+
+def ssh_keyscan(hostnames, port=DEFAULT_SSH_PORT, timeout=None):
+    """
+    Fetch the host keys of remote hosts with `ssh-keyscan`.
+
+    The host names are given on the standard input of `ssh-keyscan` (`-f -`), so their number is not limited by the
+    size of the command line, and its output is read line by line as the hosts answer.
+
+    :param hostnames: the list of the remote host names.
+    :param port: the remote SSH port of all the hosts.
+    :param timeout: the timeout (in seconds) of `ssh-keyscan` for each host.
+    :return: a generator of `known_hosts` lines, without the trailing newline.
+    :raise MSSHCopyIdException: if `ssh-keyscan` fails.
+    :raise OSError: if `ssh-keyscan` cannot be run.
+    """
+    cmd = ['ssh-keyscan']
+    if int(port) != DEFAULT_SSH_PORT:
+        cmd += ['-p', str(port)]
+    if timeout:
+        cmd += ['-T', str(max(1, int(timeout)))]
+    cmd += ['-f', '-']
+    logger.debug('Call: %s (%s host(s))', ' '.join(cmd), len(hostnames))
+
+    with open(os.devnull, 'w') as devnull:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull,
+                             universal_newlines=True)
+
+    def write_hostnames():
+        # In a thread, so that `ssh-keyscan` never blocks on a full stdout while we are writing its stdin
+        try:
+            for hostname in hostnames:
+                p.stdin.write('{0}\n'.format(hostname))
+            p.stdin.close()
+        except (IOError, OSError) as ex:
+            logger.debug('Cannot write the host names to ssh-keyscan: %s', ex)
+
+    writer = threading.Thread(target=write_hostnames, name='{0}-stdin'.format(threading.current_thread().name))
+    writer.daemon = True
+    writer.start()
+
+    try:
+        for line in iter(p.stdout.readline, ''):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        p.stdout.close()
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        writer.join()
+    if p.returncode:
+        raise MSSHCopyIdException('{0} exited with status {1}.'.format(' '.join(cmd), p.returncode))
+
+
+class KnownHosts(object):
+    """
+    In-memory index of a `known_hosts` file, loaded once and shared by all the SSH connections.
+
+    The plain host names are looked up in a dict. The hashed host names (`|1|salt|hash`) have to be hashed again with
+    each salt, so they are checked only once for each host name: the result is then stored in the dict as well.
+
+    The new host keys are only written to the file by `save()`.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the `known_hosts` file.
+        """
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.keys = {}  # {host key name: {key type: key base64}}
+        self.hashed_keys = []  # list of `(hashed name, key type, key base64)`
+        self.checked_names = set()  # the host key names already checked against the hashed names
+        self.new_entries = []  # list of `(host key name, key type, key base64)` to write to the file
+
+    def load(self):
+        """
+        Load the `known_hosts` file, if it exists.
+
+        :return: the `KnownHosts` object itself.
+        """
+        if os.path.isfile(self.filename):
+            with open(self.filename) as fh:
+                for _, names, key_type, key_base64 in iter_entries(fh):
+                    for name in names or ():
+                        if is_hashed(name):
+                            self.hashed_keys.append((name, key_type, key_base64))
+                        else:
+                            self.keys.setdefault(name, {})[key_type] = key_base64
+            logger.debug('Loaded [%s]: %s host names, %s hashed host names', self.filename, len(self.keys),
+                         len(self.hashed_keys))
+        return self
+
+    def lookup(self, name):
+        """
+        :param name: the host key name. Eg: `server1` or `[server1]:2222`
+        :return: a dict `{key type: key base64}`, empty if the host is unknown.
+        """
+        with self.lock:
+            if name not in self.checked_names:
+                self.checked_names.add(name)
+                encoded_names = [name.encode('utf-8')]
+                for hashed_name, key_type, key_base64 in self.hashed_keys:
+                    if match_hashed(hashed_name, encoded_names):
+                        self.keys.setdefault(name, {})[key_type] = key_base64
+            return dict(self.keys.get(name, {}))
+
+    def add(self, name, key):
+        """
+        Add a host key. It is written to the file by `save()`.
+
+        :param name: the host key name. Eg: `server1` or `[server1]:2222`
+        :param key: the `paramiko.PKey` object.
+        """
+        self.add_entry(name, key.get_name(), key.get_base64())
+
+    def add_entry(self, name, key_type, key_base64):
+        """
+        Add a host key, as found in a `known_hosts` line. It is written to the file by `save()`.
+
+        :param name: the host key name. Eg: `server1` or `[server1]:2222`
+        :param key_type: the type of the key. Eg: `ssh-rsa`
+        :param key_base64: the key, encoded in base64.
+        """
+        with self.lock:
+            self.keys.setdefault(name, {})[key_type] = key_base64
+            self.new_entries.append((name, key_type, key_base64))
+
+    def save(self):
+        """
+        Write the new host keys to the `known_hosts` file, all at once.
+
+        The file is locked against the other `mssh-copy-id` processes, and read again so that the host keys that they
+        have written in the meantime are kept.
+        """
+        with self.lock:
+            new_entries, self.new_entries = self.new_entries, []
+        if not new_entries:
+            return
+
+        with file_lock(self.filename):
+            lines = []
+            if os.path.isfile(self.filename):
+                with open(self.filename) as fh:
+                    lines = fh.readlines()
+            if lines and not lines[-1].endswith('\n'):
+                lines[-1] += '\n'
+            existing = set(line.strip() for line in lines)
+            for entry in new_entries:
+                line = ' '.join(entry)
+                if line not in existing:
+                    existing.add(line)
+                    lines.append('{0}\n'.format(line))
+            atomic_write(self.filename, lines)
+        logger.debug('Saved %s new host key(s) to [%s]', len(new_entries), self.filename)
+
+
+class KnownHostsPolicy(object):
+    """
+    Check the host keys against a `KnownHosts` index, instead of the host keys loaded in the `paramiko.SSHClient`.
+
+    This is a `paramiko.client.MissingHostKeyPolicy`, but it does not inherit from it, so that paramiko is not imported
+    with this module: paramiko only calls `missing_host_key()`.
+    """
+
+    def __init__(self, known_hosts, add_host=True):
+        """
+        :param known_hosts: the `KnownHosts` object.
+        :param add_host: add the unknown hosts to the `KnownHosts` object, instead of rejecting them.
+        """
+        self.known_hosts = known_hosts
+        self.add_host = add_host
+
+    def missing_host_key(self, client, hostname, key):
+        known_keys = self.known_hosts.lookup(hostname)
+        known_key_base64 = known_keys.get(key.get_name())
+        if known_key_base64 is None:
+            if not self.add_host:
+                ex = paramiko.ssh_exception.SSHException('Server [{0}] not found in known_hosts'.format(hostname))
+                # Connecting again would not help
+                ex.retryable = False
+                raise ex
+            logger.debug('[%s] Add the %s host key to [%s]', hostname, key.get_name(), self.known_hosts.filename)
+            self.known_hosts.add(hostname, key)
+        elif known_key_base64 != key.get_base64():
+            known_key = paramiko.hostkeys.HostKeyEntry.from_line(
+                '{0} {1} {2}'.format(hostname, key.get_name(), known_key_base64)).key
+            raise paramiko.ssh_exception.BadHostKeyException(hostname, key, known_key)
@@ -0,0 +1,36 @@
+from __future__ import unicode_literals
+
+import sys
+import threading
+
+
+class LazyModule(object):
+    """
+    A module imported only when one of its attributes is used for the first time.
+
+    Eg: `paramiko` pulls in `cryptography` and its native libraries, which is slow and useless for the commands that
+    never open an SSH connection (`--version`, `--remove`, `--dry`...).
+    """
+
+    def __init__(self, name):
+        """
+        :param name: the name of the module. Eg: `paramiko`
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                __import__(self._name)
+                self.__dict__['_module'] = sys.modules[self._name]
+        return self._module
+
+    def __getattr__(self, name):
+        # Only called for the attributes not found in the `LazyModule` object itself
+        return getattr(self._module or self._load(), name)
+
+    def __repr__(self):
+        return '<{0} {1!r} ({2})>'.format(type(self).__name__, self._name,
+                                          'not imported' if self._module is None else 'imported')
@@ -0,0 +1,228 @@
+from __future__ import unicode_literals
+
+import logging
+import multiprocessing
+import pickle
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from msshcopyid.errors import MSSHCopyIdException
+from msshcopyid.log import format_exception
+
+logger = logging.getLogger(__name__)
+
+# Timeout (in seconds) used when waiting on the queues, so that the main thread stays responsive to Ctrl-C.
+POLL_INTERVAL = 0.2
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of worker threads calling a function on each item of an iterable.
+
+    The items are consumed lazily: at most `2 * size` items are pulled from the iterable ahead of the workers.
+    """
+
+    _STOP = object()
+
+    def __init__(self, func, size=1, name='worker'):
+        """
+        :param func: the function to call on each item.
+        :param size: the number of worker threads.
+        :param name: the prefix of the worker thread names.
+        """
+        self.func = func
+        self.size = max(1, size)
+        self.name = name
+
+    def map(self, items):
+        """
+        Call the function on each item, and yield the results as they complete (unordered).
+
+        :param items: an iterable of items.
+        :return: a generator of `(item, result, exception)` tuples. `exception` is `None` if the call succeeded.
+        """
+        in_queue = queue.Queue(maxsize=2 * self.size)
+        out_queue = queue.Queue()
+        stop_event = threading.Event()
+
+        threads = [threading.Thread(target=self._feed, name='{0}-feeder'.format(self.name),
+                                    args=(items, in_queue, stop_event))]
+        for i in range(self.size):
+            threads.append(threading.Thread(target=self._work, name='{0}-{1}'.format(self.name, i + 1),
+                                            args=(in_queue, out_queue)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        running = self.size
+        try:
+            while running:
+                try:
+                    output = out_queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if output is self._STOP:
+                    running -= 1
+                else:
+                    yield output
+        finally:
+            # Stop feeding new items if the consumer gives up early (error or Ctrl-C)
+            stop_event.set()
+
+    def _feed(self, items, in_queue, stop_event):
+        try:
+            for item in items:
+                while not stop_event.is_set():
+                    try:
+                        in_queue.put(item, timeout=POLL_INTERVAL)
+                        break
+                    except queue.Full:
+                        pass
+                if stop_event.is_set():
+                    break
+        except Exception:
+            logger.exception('Error while reading the items.')
+        finally:
+            for _ in range(self.size):
+                in_queue.put(self._STOP)
+
+    def _work(self, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is self._STOP:
+                out_queue.put(self._STOP)
+                return
+            try:
+                out_queue.put((item, self.func(item), None))
+            except Exception as ex:
+                logger.debug(traceback.format_exc())
+                out_queue.put((item, None, ex))
+
+
+class ProcessPool(object):
+    """
+    A pool of worker processes, each one running a `WorkerPool` of threads.
+
+    The items are sent to the processes through a bounded queue, so they are consumed lazily as well. The items, the
+    results and the exceptions must be picklable: the exceptions that are not are converted into
+    `MSSHCopyIdException`.
+
+    The worker processes are forked, so the function does not need to be picklable.
+    """
+
+    def __init__(self, func, processes=1, size=1, name='worker', initializer=None, finalizer=None):
+        """
+        :param func: the function to call on each item.
+        :param processes: the number of worker processes.
+        :param size: the number of worker threads in each process.
+        :param name: the prefix of the worker process names.
+        :param initializer: a function to call at the start of each worker process.
+        :param finalizer: a function to call at the end of each worker process.
+        """
+        self.func = func
+        self.processes = max(1, processes)
+        self.size = max(1, size)
+        self.name = name
+        self.initializer = initializer
+        self.finalizer = finalizer
+
+    def map(self, items):
+        """
+        Call the function on each item, and yield the results as they complete (unordered).
+
+        :param items: an iterable of items.
+        :return: a generator of `(item, result, exception)` tuples. `exception` is `None` if the call succeeded.
+        """
+        context = get_fork_context()
+        in_queue = context.Queue(maxsize=2 * self.processes * self.size)
+        out_queue = context.Queue()
+        stop_event = threading.Event()
+
+        processes = [context.Process(target=self._work, name='{0}-{1}'.format(self.name, i + 1),
+                                     args=(in_queue, out_queue))
+                     for i in range(self.processes)]
+        for process in processes:
+            process.daemon = True
+            process.start()
+
+        feeder = threading.Thread(target=self._feed, name='{0}-feeder'.format(self.name),
+                                  args=(items, in_queue, stop_event))
+        feeder.daemon = True
+        feeder.start()
+
+        running = self.processes
+        try:
+            while running:
+                try:
+                    output = out_queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        logger.error('The worker processes have stopped unexpectedly.')
+                        break
+                    continue
+                if output is None:
+                    running -= 1
+                else:
+                    yield output
+        finally:
+            stop_event.set()
+            for process in processes:
+                process.join(POLL_INTERVAL)
+                if process.is_alive():
+                    process.terminate()
+
+    def _feed(self, items, in_queue, stop_event):
+        try:
+            for item in items:
+                while not stop_event.is_set():
+                    try:
+                        in_queue.put(item, timeout=POLL_INTERVAL)
+                        break
+                    except queue.Full:
+                        pass
+                if stop_event.is_set():
+                    break
+        except Exception:
+            logger.exception('Error while reading the items.')
+        finally:
+            for _ in range(self.processes):
+                in_queue.put(None)
+
+    def _work(self, in_queue, out_queue):
+        if self.initializer:
+            self.initializer()
+        pool = WorkerPool(self.func, size=self.size, name=multiprocessing.current_process().name)
+        try:
+            for item, result, ex in pool.map(iter(in_queue.get, None)):
+                out_queue.put((item, result, ex if ex is None else picklable_exception(ex)))
+        finally:
+            if self.finalizer:
+                self.finalizer()
+        out_queue.put(None)
+
+
+def get_fork_context():
+    """
+    :return: the multiprocessing context that forks the worker processes.
+    """
+    try:
+        return multiprocessing.get_context('fork')
+    except AttributeError:  # Python 2: always fork on POSIX
+        return multiprocessing
+
+
+def picklable_exception(ex):
+    """
+    :param ex: an exception.
+    :return: the exception itself if it can be sent to another process, else a `MSSHCopyIdException` describing it.
+    """
+    try:
+        pickle.loads(pickle.dumps(ex))
+        return ex
+    except Exception:
+        return MSSHCopyIdException(format_exception(ex))
@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+
+import json
+import logging
+import sys
+import threading
+import time
+
+from msshcopyid.journal import get_host_id
+
+logger = logging.getLogger(__name__)
+
+# The maximum time (in seconds) a result stays in the buffer before being written
+FLUSH_INTERVAL = 1.0
+
+
+class Report(object):
+    """
+    A stream of the results of the hosts, one JSON object per line and per host, written as each host completes.
+
+    The lines are buffered, but flushed at least every `flush_interval` seconds by a background thread, so that a
+    consumer reading the stream gets the results without much delay.
+    """
+
+    def __init__(self, filename, flush_interval=FLUSH_INTERVAL):
+        """
+        :param filename: the report file, or `-` for the STDOUT.
+        :param flush_interval: the maximum time (in seconds) a result stays in the buffer.
+        """
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.fh = None
+        self.dirty = False  # `True` if some results have not been flushed yet
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def open(self):
+        """
+        Open the report file, truncating it, and start the flushing thread.
+
+        :return: the `Report` object itself.
+        """
+        self.fh = sys.stdout if self.filename == '-' else open(self.filename, 'w')
+        self.thread = threading.Thread(target=self._flush_periodically, name='report-flush')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def record(self, host, status, exception=None):
+        """
+        Write the result of a host.
+
+        :param host: the `Host` object.
+        :param status: the status of the host: `STATUS_ADDED`, `STATUS_UNCHANGED`, `STATUS_FAILED` or `STATUS_SKIPPED`.
+        :param exception: the exception, if the copy failed.
+        """
+        entry = {'host': get_host_id(host),
+                 'hostname': host.hostname,
+                 'port': host.port,
+                 'user': host.user,
+                 'status': status,
+                 'attempts': host.attempts,
+                 'timings': host.timings or {},
+                 'time': time.time()}
+        if exception is not None:
+            entry['error'] = str(exception)
+            entry['error_class'] = type(exception).__name__
+        line = '{0}\n'.format(json.dumps(entry, sort_keys=True))
+        with self.lock:
+            self.fh.write(line)
+            self.dirty = True
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self.fh.flush()
+                self.dirty = False
+
+    def _flush_periodically(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except (IOError, OSError, ValueError) as ex:
+                logger.debug('Cannot flush the report [%s]: %s', self.filename, ex)
+                return
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            if self.fh is not None:
+                self.fh.flush()
+                if self.fh is not sys.stdout:
+                    self.fh.close()
+                self.fh = None
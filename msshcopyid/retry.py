@@ -0,0 +1,143 @@
+from __future__ import unicode_literals
+
+import heapq
+import itertools
+import logging
+import random
+import socket
+import threading
+import time
+
+from msshcopyid.constants import DEFAULT_MAX_RETRY_DELAY, DEFAULT_RETRY_DELAY
+from msshcopyid.errors import CancelledError, RemoteCommandError
+from msshcopyid.lazy import LazyModule
+from msshcopyid.pool import POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+paramiko = LazyModule('paramiko')
+
+
+def is_retryable(ex):
+    """
+    Classify an error of the copy of the SSH keys to a host.
+
+    The transient errors (connection refused or reset, `MaxStartups` reached, banner timeout...) are retryable. An
+    authentication failure, a host key mismatch, an unknown host name or a cancellation are fatal: trying again would
+    fail the same way. An exception can also force its class with a `retryable` attribute.
+
+    :param ex: the exception.
+    :return: `True` if the copy may succeed if it is tried again.
+    """
+    retryable = getattr(ex, 'retryable', None)
+    if retryable is not None:
+        return retryable
+    if isinstance(ex, CancelledError):
+        return False
+    if isinstance(ex, RemoteCommandError):
+        # Only a timeout may be transient
+        return ex.exit_status is None
+    if isinstance(ex, (paramiko.ssh_exception.AuthenticationException, paramiko.ssh_exception.BadHostKeyException,
+                       socket.gaierror)):
+        return False
+    return isinstance(ex, (socket.error, EOFError, paramiko.ssh_exception.SSHException))
+
+
+def get_retry_delay(attempt, delay=DEFAULT_RETRY_DELAY, max_delay=DEFAULT_MAX_RETRY_DELAY):
+    """
+    :param attempt: the number of the attempt that failed, starting from 1.
+    :param delay: the base delay (in seconds), doubled after each attempt.
+    :param max_delay: the maximum delay (in seconds).
+    :return: the delay (in seconds) before the next attempt: a random delay between 0 and the capped exponential
+             backoff ("full jitter"), so that the hosts failing together are not tried again together.
+    """
+    return random.uniform(0, min(max_delay, delay * 2 ** (attempt - 1)))
+
+
+class RetryQueue(object):
+    """
+    An iterable of hosts, given to a pool of workers: first the fresh hosts, then the hosts to retry, each one once its
+    delay has elapsed. So the retries do not hold the workers while they wait, nor delay the fresh hosts.
+
+    As a host may have to be retried until its result is known, the consumer of the results must tell the outcome of
+    every host given: `done()` or `retry()`. The iteration ends when there is no more fresh host, no host to retry and
+    no host in progress.
+    """
+
+    def __init__(self, hosts, stop_event=None):
+        """
+        :param hosts: an iterable of fresh `Host` objects.
+        :param stop_event: a `threading.Event`. When it is set, no more host is given.
+        """
+        self.hosts = iter(hosts)
+        self.stop_event = stop_event
+        self.condition = threading.Condition()
+        self.retries = []  # heap of `(time, sequence number, host, exception)`
+        self.sequence = itertools.count()
+        self.in_progress = 0  # the number of hosts given, whose outcome is not known yet
+        self.fresh = True  # `True` until the fresh hosts are exhausted
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.fresh:
+            if not self._is_stopped():
+                for host in self.hosts:
+                    with self.condition:
+                        self.in_progress += 1
+                    return host
+            self.fresh = False
+
+        with self.condition:
+            while not self._is_stopped() and (self.retries or self.in_progress):
+                if self.retries:
+                    wait = self.retries[0][0] - time.time()
+                    if wait <= 0:
+                        _, _, host, _ = heapq.heappop(self.retries)
+                        self.in_progress += 1
+                        return host
+                else:
+                    wait = POLL_INTERVAL
+                self.condition.wait(min(wait, POLL_INTERVAL))
+        raise StopIteration()
+
+    next = __next__  # Python 2
+
+    def _is_stopped(self):
+        return self.closed or (self.stop_event is not None and self.stop_event.is_set())
+
+    def close(self):
+        """
+        Stop giving hosts, e.g. when the consumer gives up early.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def done(self, host):
+        """
+        :param host: a `Host` object given by the queue, whose outcome is final.
+        """
+        with self.condition:
+            self.in_progress -= 1
+            self.condition.notify_all()
+
+    def retry(self, host, delay, exception=None):
+        """
+        :param host: a `Host` object given by the queue, to give again.
+        :param delay: the delay (in seconds) before giving the host again.
+        :param exception: the exception of the attempt that failed.
+        """
+        with self.condition:
+            heapq.heappush(self.retries, (time.time() + delay, next(self.sequence), host, exception))
+            self.in_progress -= 1
+            self.condition.notify_all()
+
+    def pending(self):
+        """
+        :return: the list of `(host, exception)` of the hosts still waiting to be retried, once the queue is stopped.
+        """
+        with self.condition:
+            return [(host, exception) for _, _, host, exception in sorted(self.retries)]
@@ -0,0 +1,186 @@
+from __future__ import unicode_literals
+
+import errno
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+
+from msshcopyid.known_hosts import atomic_write
+from msshcopyid.lazy import LazyModule
+
+logger = logging.getLogger(__name__)
+
+paramiko = LazyModule('paramiko')
+
+# The version of the format of the SSH config cache files
+CACHE_VERSION = 1
+
+# The maximum number of host names whose SSH configuration is kept in memory
+LOOKUP_CACHE_SIZE = 10000
+
+WILDCARD_CHARS = ('*', '?', '[')
+
+
+class SSHConfigIndex(object):
+    """
+    A faster `lookup()` for a `paramiko.config.SSHConfig` object with many `Host` blocks.
+
+    `paramiko.config.SSHConfig.lookup()` runs `fnmatch` on every pattern of every block. Instead, the blocks are
+    indexed once:
+
+    - the blocks with literal host names only, in a dict.
+    - the blocks with wildcards, each one with a compiled regex, behind a single regex combining all of them: it is
+      enough to skip them all for most of the host names.
+    - the blocks that must always be checked: `Match` blocks and negated patterns (`!host`).
+
+    Then only the blocks that may match a host name are given to paramiko, in the same order, so the result is exactly
+    the one of `paramiko.config.SSHConfig.lookup()`. The results are memoized for each host name.
+    """
+
+    def __init__(self, ssh_config, cache_size=LOOKUP_CACHE_SIZE):
+        """
+        :param ssh_config: the `paramiko.config.SSHConfig` object.
+        :param cache_size: the maximum number of host names whose result is memoized.
+        """
+        self.ssh_config = ssh_config
+        self.cache_size = cache_size
+        self.cache = {}  # {host name: SSH config dict}
+
+        self.contexts = None  # the blocks of the SSH config. `None` if they cannot be indexed
+        self.literals = {}  # {host name: [block index, ...]}
+        self.wildcards = []  # list of `(block index, compiled regex)`
+        self.wildcards_regex = None  # a compiled regex matching any of the wildcards
+        self.always = []  # list of block indexes
+        self._build_index()
+
+    def _build_index(self):
+        contexts = getattr(self.ssh_config, '_config', None)
+        if not isinstance(contexts, list):
+            logger.debug('Cannot index the SSH config: use the paramiko lookup.')
+            return
+        # The canonicalization looks the SSH config up again with another host name: do not index
+        if any('canonicalizehostname' in context.get('config', {}) for context in contexts):
+            logger.debug('CanonicalizeHostname is set in the SSH config: use the paramiko lookup.')
+            return
+
+        wildcard_patterns = []
+        for index, context in enumerate(contexts):
+            patterns = context.get('host', [])
+            if hasattr(patterns, 'split'):
+                patterns = patterns.split(',')
+            if context.get('matches') or any(pattern.startswith('!') for pattern in patterns):
+                self.always.append(index)
+                continue
+
+            regexes = []
+            for pattern in patterns:
+                if any(char in pattern for char in WILDCARD_CHARS):
+                    regexes.append(fnmatch.translate(pattern))
+                else:
+                    self.literals.setdefault(pattern, []).append(index)
+            if regexes:
+                self.wildcards.append((index, re.compile('|'.join(regexes))))
+                wildcard_patterns.extend(regexes)
+
+        if wildcard_patterns:
+            self.wildcards_regex = re.compile('|'.join(wildcard_patterns))
+        self.contexts = contexts
+        logger.debug('Indexed the SSH config: %s literal host names, %s blocks with wildcards, %s other blocks',
+                     len(self.literals), len(self.wildcards), len(self.always))
+
+    def lookup(self, hostname):
+        """
+        :param hostname: the host name.
+        :return: the SSH configuration of the host, as `paramiko.config.SSHConfig.lookup()`.
+        """
+        result = self.cache.get(hostname)
+        if result is not None:
+            return result
+
+        if self.contexts is None:
+            result = self.ssh_config.lookup(hostname)
+        else:
+            indexes = set(self.always)
+            indexes.update(self.literals.get(hostname, ()))
+            if self.wildcards_regex is not None and self.wildcards_regex.match(hostname):
+                indexes.update(index for index, regex in self.wildcards if regex.match(hostname))
+            ssh_config = paramiko.config.SSHConfig()
+            ssh_config._config = [self.contexts[index] for index in sorted(indexes)]
+            result = ssh_config.lookup(hostname)
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[hostname] = result
+        return result
+
+
+def get_cache_file(config, cache_dir):
+    """
+    :param config: the SSH config file.
+    :param cache_dir: the cache directory.
+    :return: the cache file of the SSH config file.
+    """
+    digest = hashlib.sha1(os.path.abspath(config).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'ssh_config-{0}.json'.format(digest))
+
+
+def get_sources(config):
+    """
+    :param config: the SSH config file.
+    :return: the list of `[file, mtime, size, inode]` of the files the parsed SSH config depends on.
+    """
+    st = os.stat(config)
+    return [[os.path.abspath(config), st.st_mtime, st.st_size, st.st_ino]]
+
+
+def load_cached_ssh_config(config, cache_dir):
+    """
+    Load a parsed SSH config from the cache, if it is still valid: the SSH config file must not have changed (same
+    mtime, size and inode) and it must have been parsed by the same version of paramiko.
+
+    :param config: the SSH config file.
+    :param cache_dir: the cache directory.
+    :return: the `paramiko.config.SSHConfig` object, or `None` if not found in the cache.
+    """
+    cache_file = get_cache_file(config, cache_dir)
+    try:
+        with open(cache_file) as fh:
+            cache = json.load(fh)
+        if (cache.get('version') != CACHE_VERSION or cache.get('paramiko') != paramiko.__version__ or
+                cache.get('sources') != get_sources(config)):
+            logger.debug('The SSH config cache [%s] is outdated.', cache_file)
+            return None
+        ssh_config = paramiko.config.SSHConfig()
+        ssh_config._config = cache['config']
+    except (IOError, OSError, ValueError, KeyError) as ex:
+        if getattr(ex, 'errno', None) != errno.ENOENT:
+            logger.debug('Cannot read the SSH config cache [%s]: %s', cache_file, ex)
+        return None
+    logger.debug('Loaded SSH configuration from the cache [%s]', cache_file)
+    return ssh_config
+
+
+def save_cached_ssh_config(config, ssh_config, cache_dir):
+    """
+    Save a parsed SSH config to the cache. The errors are ignored: the cache is only an optimization.
+
+    :param config: the SSH config file.
+    :param ssh_config: the `paramiko.config.SSHConfig` object parsed from the SSH config file.
+    :param cache_dir: the cache directory.
+    """
+    cache_file = get_cache_file(config, cache_dir)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        cache = {'version': CACHE_VERSION,
+                 'paramiko': paramiko.__version__,
+                 'sources': get_sources(config),
+                 'config': ssh_config._config}
+        atomic_write(cache_file, [json.dumps(cache)])
+    except (IOError, OSError, TypeError, ValueError, AttributeError) as ex:
+        logger.debug('Cannot write the SSH config cache [%s]: %s', cache_file, ex)
+        return
+    logger.debug('Saved the SSH configuration to the cache [%s]', cache_file)
@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The number of records written between two commits
+COMMIT_INTERVAL = 100
+
+
+class StateStore(object):
+    """
+    A SQLite database recording, across the runs, the hosts where the SSH public key has been successfully copied.
+
+    A host is identified by its host name, port and user, and by the fingerprint of the SSH public key. The database is
+    only used from the main process, but from several threads: the hosts are filtered by the thread feeding the
+    workers.
+    """
+
+    def __init__(self, filename, fingerprint):
+        """
+        :param filename: the SQLite database file.
+        :param fingerprint: the fingerprint of the SSH public key being copied.
+        """
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pending = 0  # the number of records not committed yet
+
+    def open(self):
+        """
+        Open the database, creating it if needed.
+
+        :return: the `StateStore` object itself.
+        """
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self.connection = sqlite3.connect(self.filename, check_same_thread=False)
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS hosts (
+                                           hostname TEXT NOT NULL,
+                                           port INTEGER NOT NULL,
+                                           user TEXT NOT NULL,
+                                           fingerprint TEXT NOT NULL,
+                                           last_success REAL NOT NULL,
+                                           host_key TEXT,
+                                           PRIMARY KEY (hostname, port, user, fingerprint))''')
+        logger.debug('Opened the state database [%s]', self.filename)
+        return self
+
+    def is_known_good(self, host, max_age=None):
+        """
+        :param host: the `Host` object.
+        :param max_age: the maximum age (in seconds) of the last success. `None` means no limit.
+        :return: `True` if the SSH public key has been successfully copied to the host (within `max_age`).
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT last_success FROM hosts '
+                                          'WHERE hostname = ? AND port = ? AND user = ? AND fingerprint = ?',
+                                          (host.hostname, int(host.port), host.user, self.fingerprint)).fetchone()
+        return row is not None and (max_age is None or time.time() - row[0] <= max_age)
+
+    def record_success(self, host):
+        """
+        Record that the SSH public key has been successfully copied to the host, and the host key that was seen.
+
+        :param host: the `Host` object.
+        """
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO hosts '
+                                    '(hostname, port, user, fingerprint, last_success, host_key) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)',
+                                    (host.hostname, int(host.port), host.user, self.fingerprint, time.time(),
+                                     host.host_key))
+            self.pending += 1
+            if self.pending >= COMMIT_INTERVAL:
+                self._commit()
+
+    def _commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self._commit()
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,117 @@
+from __future__ import division, unicode_literals
+
+import threading
+import time
+
+from msshcopyid.journal import get_host_id
+
+# The phases of the copy of the SSH keys to a host, in order
+PHASE_RESOLVE = 'resolve'
+PHASE_CONNECT = 'connect'
+PHASE_HANDSHAKE = 'handshake'
+PHASE_AUTH = 'auth'
+PHASE_EXEC = 'exec'
+PHASE_CLOSE = 'close'
+PHASES = (PHASE_RESOLVE, PHASE_CONNECT, PHASE_HANDSHAKE, PHASE_AUTH, PHASE_EXEC, PHASE_CLOSE)
+
+# The percentiles of the durations of each phase in the summary
+PERCENTILES = (50, 95, 99)
+
+# The number of slowest hosts in the summary
+SLOWEST_HOSTS = 10
+
+# A clock that cannot go backwards, if available (Python 3.3+)
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def percentile(values, pct):
+    """
+    :param values: a sorted list of numbers.
+    :param pct: the percentile, between 0 and 100.
+    :return: the nearest-rank percentile of the values, or `None` if there is no value.
+    """
+    if not values:
+        return None
+    index = max(0, int(round(pct / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class PhaseTimer(object):
+    """
+    Measure the duration of the consecutive phases of the copy of the SSH keys to a host.
+    """
+
+    def __init__(self, timings=None):
+        """
+        :param timings: the dict `{phase: seconds}` to add the durations to. Default: a new dict.
+        """
+        self.timings = timings if timings is not None else {}
+        self.last = monotonic()
+
+    def mark(self, phase):
+        """
+        End a phase: its duration is the time elapsed since the end of the previous phase.
+
+        :param phase: the phase that has just ended. Eg: `PHASE_CONNECT`
+        """
+        now = monotonic()
+        self.timings[phase] = self.timings.get(phase, 0) + now - self.last
+        self.last = now
+
+    def wrap(self, func, phase):
+        """
+        :param func: a function.
+        :param phase: the phase that ends when the function is called.
+        :return: a function marking the end of the phase, then calling `func`.
+        """
+        def wrapper(*args, **kwargs):
+            self.mark(phase)
+            return func(*args, **kwargs)
+        return wrapper
+
+
+class Stats(object):
+    """
+    The durations of the phases of the copies of the SSH keys, for the summary printed by `--stats`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = []  # list of `(total duration, host identifier, timings)`
+
+    def add(self, host):
+        """
+        :param host: the `Host` object, with the durations of its phases in `host.timings`.
+        """
+        timings = host.timings or {}
+        with self.lock:
+            self.hosts.append((sum(timings.values()), get_host_id(host), timings))
+
+    def format(self, slowest=SLOWEST_HOSTS):
+        """
+        :param slowest: the number of slowest hosts to list.
+        :return: the summary, as a list of lines: the min, percentiles and max of each phase (in seconds), then the
+                 slowest hosts.
+        """
+        with self.lock:
+            hosts = list(self.hosts)
+
+        columns = ['min'] + ['p{0}'.format(pct) for pct in PERCENTILES] + ['max']
+        lines = ['{0:<10} {1}'.format('phase', ' '.join('{0:>8}'.format(column) for column in columns))]
+        for phase in PHASES + ('total',):
+            if phase == 'total':
+                durations = sorted(total for total, _, _ in hosts)
+            else:
+                durations = sorted(timings[phase] for _, _, timings in hosts if phase in timings)
+            if not durations:
+                continue
+            values = [durations[0]] + [percentile(durations, pct) for pct in PERCENTILES] + [durations[-1]]
+            lines.append('{0:<10} {1}'.format(phase, ' '.join('{0:>8.3f}'.format(value) for value in values)))
+
+        if hosts and slowest:
+            lines.append('Slowest hosts:')
+            for total, host_id, timings in sorted(hosts, key=lambda item: item[0], reverse=True)[:slowest]:
+                lines.append('  {0} {1:.3f}s ({2})'.format(
+                    host_id, total, ', '.join('{0} {1:.3f}s'.format(phase, timings[phase])
+                                              for phase in PHASES if phase in timings)))
+        return lines
@@ -1,15 +1,28 @@
+import argparse
 import getpass
+import itertools
 import logging
 import os
+import re
 import sys
 
-import paramiko
-
 from msshcopyid.constants import DEFAULT_SSH_CONFIG, DEFAULT_SSH_PORT
+from msshcopyid.lazy import LazyModule
+from msshcopyid.ssh_config import load_cached_ssh_config, save_cached_ssh_config
 import msshcopyid
 
 logger = logging.getLogger(__name__)
 
+paramiko = LazyModule('paramiko')
+
+# A numeric range (Eg: `[001-500]`) or a brace alternation (Eg: `{a,b,c}`) in a host
+HOST_PATTERN_RE = re.compile(r'\[(?P<start>\d+)-(?P<end>\d+)\]|\{(?P<alternatives>[^{}]*,[^{}]*)\}')
+# A host with a port. Eg: `server1:2222`
+HOST_PORT_RE = re.compile(r'^(?P<hostname>[^:]+):(?P<port>\d+)$')
+# A duration. Eg: `7d`
+DURATION_RE = re.compile(r'^(?P<value>\d+(\.\d+)?)(?P<unit>[smhdw]?)$')
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
 
 def get_password(from_stdin_only=False):
     """
@@ -27,14 +40,53 @@ def get_password(from_stdin_only=False):
     return password
 
 
-def load_ssh_config(config=DEFAULT_SSH_CONFIG):
-    ssh_config = paramiko.config.SSHConfig()
-    if os.path.isfile(config):
-        with open(config) as fh:
-            ssh_config.parse(fh)
-        logger.debug('Loaded SSH configuration from [%s]', config)
-    else:
+def get_passphrase(key_file):
+    """
+    Prompt the user for the passphrase of a SSH private key.
+
+    :param key_file: the SSH private key file.
+    :return: the passphrase.
+    """
+    return getpass.getpass('Enter the passphrase for the key [{0}]: '.format(key_file))
+
+
+def parse_duration(duration):
+    """
+    Parse a duration, for `argparse`.
+
+    :param duration: a number, optionally followed by a unit: `s` (default), `m`, `h`, `d` or `w`. Eg: `7d`
+    :return: the duration in seconds.
+    :raise argparse.ArgumentTypeError: if the duration is invalid.
+    """
+    match = DURATION_RE.match(duration.strip())
+    if not match:
+        raise argparse.ArgumentTypeError('invalid duration: {0!r}. Eg: 3600, 30m, 12h, 7d'.format(duration))
+    return float(match.group('value')) * DURATION_UNITS[match.group('unit')]
+
+
+def load_ssh_config(config=DEFAULT_SSH_CONFIG, cache_dir=None):
+    """
+    Load the SSH config file.
+
+    :param config: the SSH config file.
+    :param cache_dir: the directory where the parsed SSH config is cached, so that it is parsed again only when the
+                      file changes. `None` means no cache.
+    :return: the `paramiko.config.SSHConfig` object, or `None` if the SSH config file does not exist.
+    """
+    if not os.path.isfile(config):
+        # Do not even import paramiko
         logger.debug('SSH config file "{0}" not found.'.format(config))
+        return None
+
+    cached_ssh_config = load_cached_ssh_config(config, cache_dir) if cache_dir else None
+    if cached_ssh_config is not None:
+        return cached_ssh_config
+    ssh_config = paramiko.config.SSHConfig()
+    with open(config) as fh:
+        ssh_config.parse(fh)
+    logger.debug('Loaded SSH configuration from [%s]', config)
+    if cache_dir:
+        save_cached_ssh_config(config, ssh_config, cache_dir)
 
     return ssh_config
 
@@ -52,33 +104,116 @@ def parse_hosts(hosts, ssh_port=None, ssh_config=None):
         - from the `paramiko.config.SSHConfig` object.
         - current logged user.
     - port:
+        - from the host (string) itself.
         - from the function argument `port`.
         - from the `paramiko.config.SSHConfig` object.
         - default SSH port: 22
 
-    :param hosts: list of hosts (string). Eg: ['server1', 'user1@server2']
+    The hosts may contain numeric ranges and brace alternations: see `expand_host()`.
+
+    :param hosts: list of hosts (string). Eg: ['server1', 'user1@server2', 'web[01-10]:2222']
     :param ssh_config: a `paramiko.config.SSHConfig` object.
     :return: a list of `msshcopyid.Host` objects.
     """
-    host_list = []  # list of Host objects
+    return list(iter_hosts(hosts, ssh_port=ssh_port, ssh_config=ssh_config))
+
+
+def iter_hosts(hosts, ssh_port=None, ssh_config=None):
+    """
+    Same as `parse_hosts()`, but parse the hosts lazily, one at a time.
+
+    :param hosts: an iterable of hosts (string). Eg: ['server1', 'user1@server2']
+    :param ssh_config: a `paramiko.config.SSHConfig` object.
+    :return: a generator of `msshcopyid.Host` objects.
+    """
     current_user = getpass.getuser()
-    for host in hosts:
+    for host in (expanded for host_pattern in hosts for expanded in expand_host(host_pattern)):
+        # user
+        if '@' in host:
+            user, hostname = host.split('@', 1)
+        else:
+            user, hostname = None, host
+
+        # hostname & port
+        match = HOST_PORT_RE.match(hostname)
+        if match:
+            hostname, port = match.group('hostname'), int(match.group('port'))
+        else:
+            port = None
+
         # host_info = {'hostname': 'server1', 'hashknownhosts': 'no', 'user': 'user1'}
         if ssh_config is not None:
-            host_info = ssh_config.lookup(host)
+            host_info = ssh_config.lookup(hostname)
         else:
             host_info = {}
 
-        # hostname & user
-        if '@' in host:
-            user, hostname = host.split('@', 1)
-        else:
-            hostname = host
-            user = host_info.get('user', current_user)
+        user = user or host_info.get('user', current_user)
+        port = port or ssh_port or host_info.get('port', DEFAULT_SSH_PORT)
+
+        yield msshcopyid.Host(hostname=hostname, port=port, user=user)
+
+
+def expand_host(host):
+    """
+    Expand the numeric ranges and the brace alternations of a host, lazily.
+
+    - `web[1-3]` gives `web1`, `web2`, `web3`. The leading zeros of the start give the width of the numbers:
+      `web[08-10]` gives `web08`, `web09`, `web10`.
+    - `db{a,b}` gives `dba`, `dbb`.
 
-        # port
-        port = ssh_port or host_info.get('port', DEFAULT_SSH_PORT)
+    They can be combined: `user@web[01-02].dc{1,2}:2222` gives `user@web01.dc1:2222`, `user@web01.dc2:2222`,
+    `user@web02.dc1:2222`, `user@web02.dc2:2222`.
+
+    :param host: a host (string).
+    :return: a generator of hosts (string).
+    """
+    match = HOST_PATTERN_RE.search(host)
+    if not match:
+        yield host
+        return
+
+    prefix, suffix = host[:match.start()], host[match.end():]
+    if match.group('alternatives') is not None:
+        alternatives = match.group('alternatives').split(',')
+    else:
+        alternatives = _number_range(match.group('start'), match.group('end'))
+
+    for alternative in alternatives:
+        # The rest of the host is expanded again for each alternative, so that the product is never materialized
+        for rest in expand_host(suffix):
+            yield prefix + alternative + rest
+
+
+def _number_range(start, end):
+    # A generator rather than `range()`, which builds a list with Python 2
+    width = len(start) if start.startswith('0') else 0
+    step = 1 if int(start) <= int(end) else -1
+    for i in itertools.count(int(start), step):
+        yield '{0:0{1}d}'.format(i, width)
+        if i == int(end):
+            return
+
+
+def read_hosts_file(hosts_file):
+    """
+    Read the hosts from a file, lazily, one line at a time.
+
+    Each line holds one or several hosts, separated by spaces. The empty lines and the comments (`#`) are skipped.
+
+    :param hosts_file: the file to read. `-` means the STDIN.
+    :return: a generator of hosts (string). Eg: 'server1', 'user1@server2'
+    """
+    if hosts_file == '-':
+        for host in _read_hosts(sys.stdin):
+            yield host
+    else:
+        with open(hosts_file) as fh:
+            for host in _read_hosts(fh):
+                yield host
 
-        host_list.append(msshcopyid.Host(hostname=hostname, port=port, user=user))
 
-    return host_list
+def _read_hosts(fh):
+    # `readline()` rather than iterating on the file: Python 2 would read ahead a whole buffer from the STDIN
+    for line in iter(fh.readline, ''):
+        for host in line.split('#', 1)[0].split():
+            yield host
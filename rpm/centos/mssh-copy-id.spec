@@ -11,7 +11,7 @@ Source0:        %{name}-%{version}.tar.gz
 BuildArch:      noarch
 
 BuildRequires: python-setuptools
-Requires:      python-paramiko >= 1.7
+Requires:      python-paramiko >= 2.1
 Requires:      python-argparse
 
 %description
@@ -1,7 +1,7 @@
 from setuptools import setup, find_packages
 
 long_description = '''mssh-copy-id is a command-line tool to copy SSH keys to multiple servers.'''
-install_requires = ['paramiko>=1.7', 'argparse']
+install_requires = ['paramiko>=2.1', 'argparse']
 dev_require = ['invoke', 'twine']
 tests_require = ['unittest2', 'mock', 'pytest', 'pytest-catchlog', 'pytest-runner', 'pytest-cov', 'coverage', 'docker']
 
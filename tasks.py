@@ -13,6 +13,8 @@ FUNC_TESTS_DIR = os.path.join(PROJECT_DIR, 'tests', 'func-tests')
 FUNC_CONF_FILE = os.path.join(FUNC_TESTS_DIR, 'conf.py')
 FUNC_CONF_TEMPLATE_FILE = os.path.join(FUNC_TESTS_DIR, 'conf.py.template')
 UNIT_TESTS_DIR = os.path.join(PROJECT_DIR, 'tests', 'unit-tests')
+FLEET_TESTS_DIR = os.path.join(PROJECT_DIR, 'tests', 'fleet-tests')
+BENCHMARKS_DIR = os.path.join(PROJECT_DIR, 'benchmarks')
 
 DOCKER_DIR = os.path.join(PROJECT_DIR, 'docker')
 DOCKER_COMMON_DIR = os.path.join(DOCKER_DIR, 'common')
@@ -212,3 +214,22 @@ def func_tests(ctx):
 
     os.chdir(PROJECT_DIR)
     ctx.run('py.test --color yes -v "{0}"'.format(FUNC_TESTS_DIR))
+
+
+@task
+def fleet_tests(ctx):
+    """
+    run the functional tests against a fleet of fake SSH servers
+    """
+    os.chdir(PROJECT_DIR)
+    ctx.run('py.test --color yes -v "{0}"'.format(FLEET_TESTS_DIR))
+
+
+@task(help={'output': 'the JSON file to write the results to. Default: the STDOUT'})
+def benchmarks(ctx, output=None):
+    """
+    run the throughput benchmarks against a fleet of fake SSH servers
+    """
+    os.chdir(PROJECT_DIR)
+    ctx.run('python "{0}"{1}'.format(os.path.join(BENCHMARKS_DIR, 'bench.py'),
+                                     ' --output "{0}"'.format(output) if output else ''))
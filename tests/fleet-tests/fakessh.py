@@ -0,0 +1,210 @@
+"""
+An in-process fleet of fake SSH servers, listening on the loopback interface: one port per fake host.
+
+The fake hosts accept the password and the public key authentications, and emulate the remote command run by
+`mssh-copy-id` on an in-memory `authorized_keys` for each user. They are a fast stand-in for the docker `sshd`
+containers of the functional tests, for the tests and the benchmarks that need hundreds of hosts.
+"""
+from __future__ import unicode_literals
+
+import logging
+import re
+import select
+import socket
+import threading
+import time
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+# The SSH public key added by the remote command of `mssh-copy-id`
+AUTHORIZED_KEY_RE = re.compile(r"k='(?P<key>[^']*)'")
+
+
+class FakeHost(object):
+    """
+    A fake SSH host.
+    """
+
+    def __init__(self, port, users, host_key, latency=0):
+        """
+        :param port: the port the fake host listens on.
+        :param users: a dict `{user: password}`.
+        :param host_key: the `paramiko.PKey` host key.
+        :param latency: the delay (in seconds) added to the connection and to each authentication or command, to
+                        emulate the round-trip time of a remote host.
+        """
+        self.hostname = '127.0.0.1'
+        self.port = port
+        self.users = users
+        self.host_key = host_key
+        self.latency = latency
+        self.authorized_keys = dict((user, set()) for user in users)  # {user: set of `<type> <base64>`}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.commands = 0
+
+    def is_authorized(self, user, key):
+        """
+        :param user: the user name.
+        :param key: the `paramiko.PKey` public key.
+        :return: `True` if the public key is in the `authorized_keys` of the user.
+        """
+        with self.lock:
+            return '{0} {1}'.format(key.get_name(), key.get_base64()) in self.authorized_keys.get(user, ())
+
+    def authorize(self, user, pub_key_content):
+        """
+        :param user: the user name.
+        :param pub_key_content: the content of the SSH public key file. Eg: `ssh-rsa AAAAB3NzaC1yc2EAAAAB... me@laptop`
+        """
+        fields = pub_key_content.split()
+        with self.lock:
+            self.authorized_keys[user].add(' '.join(fields[:2]))
+
+
+class FakeSSHServer(paramiko.ServerInterface):
+    """
+    The SSH server side of a connection to a fake host.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.user = None
+
+    def delay(self):
+        if self.host.latency:
+            time.sleep(self.host.latency)
+
+    def get_allowed_auths(self, username):
+        return 'password,publickey'
+
+    def check_auth_password(self, username, password):
+        self.delay()
+        if username in self.host.users and self.host.users[username] == password:
+            self.user = username
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_auth_publickey(self, username, key):
+        self.delay()
+        if self.host.is_authorized(username, key):
+            self.user = username
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        if isinstance(command, bytes):
+            command = command.decode('utf-8')
+        self.delay()
+        with self.host.lock:
+            self.host.commands += 1
+        match = AUTHORIZED_KEY_RE.search(command)
+        if match:
+            self.host.authorize(self.user, match.group('key'))
+            exit_status = 0
+        else:
+            exit_status = 127
+        # The channel is left open: it is closed by the client once it has received the exit status
+        channel.send_exit_status(exit_status)
+        return True
+
+
+class FakeSSHFleet(object):
+    """
+    A fleet of fake SSH hosts, listening on the loopback interface. A single thread accepts the connections for all
+    the hosts, and each connection is then served by its own `paramiko.Transport` thread.
+
+    Usage::
+
+        with FakeSSHFleet(500, users={'user': 'password'}) as fleet:
+            hosts = ['user@127.0.0.1:{0}'.format(host.port) for host in fleet.hosts]
+    """
+
+    def __init__(self, size, users=None, host_key=None, latency=0):
+        """
+        :param size: the number of fake hosts.
+        :param users: a dict `{user: password}`, the same on every host. Default: `{'user': 'password'}`
+        :param host_key: the `paramiko.PKey` host key shared by all the hosts. Default: a new RSA key.
+        :param latency: the emulated round-trip time (in seconds) of the hosts.
+        """
+        self.size = size
+        self.latency = latency
+        self.users = users or {'user': 'password'}
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self.hosts = []
+        self.sockets = {}  # {listening socket: `FakeHost`}
+        self.transports = []
+        self.transports_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        for _ in range(self.size):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(128)
+            sock.setblocking(False)
+            host = FakeHost(sock.getsockname()[1], users=dict(self.users), host_key=self.host_key,
+                            latency=self.latency)
+            self.hosts.append(host)
+            self.sockets[sock] = host
+        self.thread = threading.Thread(target=self._accept, name='fakessh-accept')
+        self.thread.daemon = True
+        self.thread.start()
+        logger.debug('Started %s fake SSH hosts', self.size)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        for sock in self.sockets:
+            sock.close()
+        with self.transports_lock:
+            for transport in self.transports:
+                transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _accept(self):
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select(list(self.sockets), [], [], 0.1)
+            for sock in readable:
+                try:
+                    conn, _ = sock.accept()
+                except socket.error:
+                    continue
+                conn.setblocking(True)
+                host = self.sockets[sock]
+                if host.latency:
+                    # Delay the SSH negotiation without blocking the other connections
+                    timer = threading.Timer(host.latency, self._serve, args=(conn, host))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    self._serve(conn, host)
+
+    def _serve(self, conn, host):
+        with host.lock:
+            host.connections += 1
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host.host_key)
+        with self.transports_lock:
+            self.transports.append(transport)
+        try:
+            # The SSH negotiation happens in the transport thread
+            transport.start_server(event=threading.Event(), server=FakeSSHServer(host))
+        except (paramiko.SSHException, EOFError, socket.error) as ex:
+            logger.debug('[%s] %s', host.port, ex)
@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+import paramiko
+import pytest
+
+from msshcopyid.cli import Main
+from msshcopyid.errors import CopySSHKeysError
+from msshcopyid.known_hosts import get_host_key_name, KnownHosts
+
+from fakessh import FakeSSHFleet
+
+FLEET_SIZE = 500
+PARALLEL = 50
+
+
+@pytest.fixture(scope='module')
+def fleet():
+    with FakeSSHFleet(FLEET_SIZE, users={'user': 'password'}) as fleet:
+        yield fleet
+
+
+@pytest.fixture(scope='module')
+def ssh_key():
+    tmp_dir = tempfile.mkdtemp()
+    priv_key = os.path.join(tmp_dir, 'id_rsa')
+    key = paramiko.RSAKey.generate(2048)
+    key.write_private_key_file(priv_key)
+    with open('{0}.pub'.format(priv_key), 'w') as fh:
+        fh.write('{0} {1} me@laptop\n'.format(key.get_name(), key.get_base64()))
+    yield priv_key
+    shutil.rmtree(tmp_dir)
+
+
+@pytest.fixture
+def known_hosts():
+    tmp_dir = tempfile.mkdtemp()
+    yield os.path.join(tmp_dir, 'known_hosts')
+    shutil.rmtree(tmp_dir)
+
+
+def run_main(argv):
+    main = Main()
+    with patch('msshcopyid.cli.utils.load_ssh_config', return_value=None), patch.object(Main, 'init_log'):
+        main.init(['mssh-copy-id'] + argv)
+        main.run()
+    return main
+
+
+def test_copy_to_fleet(fleet, ssh_key, known_hosts):
+    hosts = ['user@{0}:{1}'.format(host.hostname, host.port) for host in fleet.hosts]
+    with open('{0}.pub'.format(ssh_key)) as fh:
+        pub_key = ' '.join(fh.read().split()[:2])
+
+    # The SSH public key is added to every host, with the password
+    run_main(['-i', ssh_key, '-P', 'password', '-k', known_hosts, '-j', str(PARALLEL)] + hosts)
+
+    assert all(host.authorized_keys['user'] == {pub_key} for host in fleet.hosts)
+    index = KnownHosts(known_hosts).load()
+    for host in fleet.hosts:
+        assert index.lookup(get_host_key_name(host.hostname, host.port)) == {
+            host.host_key.get_name(): host.host_key.get_base64()}
+
+    # The SSH public key is now authorized: the remote command is not run again
+    commands = sum(host.commands for host in fleet.hosts)
+    run_main(['-i', ssh_key, '-P', 'password', '-k', known_hosts, '-j', str(PARALLEL)] + hosts)
+
+    assert sum(host.commands for host in fleet.hosts) == commands
+
+
+def test_copy_to_fleet_wrong_password(fleet, ssh_key, known_hosts):
+    users = {'bob': 'secret'}
+    with FakeSSHFleet(10, users=users, host_key=fleet.host_key) as other_fleet:
+        hosts = ['bob@{0}:{1}'.format(host.hostname, host.port) for host in other_fleet.hosts]
+
+        with pytest.raises(CopySSHKeysError) as excinfo:
+            run_main(['-i', ssh_key, '-P', 'wrong', '-k', known_hosts, '-j', str(PARALLEL)] + hosts)
+
+        assert len(excinfo.value.exceptions) == len(hosts)
+        assert all(not host.authorized_keys['bob'] for host in other_fleet.hosts)
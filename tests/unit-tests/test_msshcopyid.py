@@ -1,13 +1,19 @@
 from __future__ import unicode_literals
 
-import subprocess
+import os
+import shutil
+import socket
 import sys
+import tempfile
 
 import paramiko
 from mock import call, MagicMock, mock_open, patch
 import unittest2 as unittest
 
 import msshcopyid
+from msshcopyid.constants import SCANNER_SSH_KEYSCAN, STATUS_ADDED, STATUS_UNCHANGED
+from msshcopyid.errors import CancelledError, RemoteCommandError
+from msshcopyid.known_hosts import KnownHosts
 
 
 class TestSSHCopyId(unittest.TestCase):
@@ -15,6 +21,23 @@ class TestSSHCopyId(unittest.TestCase):
     def setUp(self):
         self.sshcopyid = msshcopyid.SSHCopyId()
 
+        patcher = patch('msshcopyid.KnownHosts')
+        self.mock_known_hosts = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('msshcopyid.SSHCopyId.open_socket')
+        self.mock_open_socket = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def mock_exec_command(client):
+        """
+        Mock the result of `client.exec_command()`, and return the mocked channel.
+        """
+        stdout = MagicMock()
+        client.exec_command.return_value = (MagicMock(), stdout, MagicMock())
+        return stdout.channel
+
     def test_set_pub_key_none(self):
         self.sshcopyid.set_pub_key(None)
         self.assertEqual(self.sshcopyid.pub_key, None)
@@ -60,74 +83,174 @@ class TestSSHCopyId(unittest.TestCase):
 
         mock_exists.assert_called_once_with(self.sshcopyid.pub_key)
 
-    @patch('msshcopyid.subprocess.Popen')
-    def test_add_to_known_hosts(self, mock_popen):
-        hosts = [msshcopyid.Host(hostname='server1'),
-                 msshcopyid.Host(hostname='server2'),
-                 msshcopyid.Host(hostname='server3')]
-        known_hosts = MagicMock()
+    def test_load_priv_key(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        key = paramiko.RSAKey.generate(1024)
+        self.sshcopyid.priv_key = os.path.join(tmp_dir, 'id_rsa')
+        key.write_private_key_file(self.sshcopyid.priv_key)
+        get_passphrase = MagicMock()
 
-        server1_ssh_key = 'server1 ssh-rsa KRDZhqpguSRxeiqLseaD'
-        server2_ssh_key = 'server2 ssh-rsa AAAAB3NzaC1yc2EAAAAB'
-        server3_ssh_key = 'server3 ssh-rsa O2gDXC6h6QDXCaHo6pOH'
-        server4_ssh_key = 'server4 ssh-rsa hdHWpZ8fDvQArTUFCfgU'
+        self.sshcopyid.load_priv_key(get_passphrase=get_passphrase)
+
+        self.assertEqual(self.sshcopyid.pkey, key)
+        get_passphrase.assert_not_called()
+
+    def test_load_priv_key_encrypted(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        key = paramiko.ECDSAKey.generate()
+        self.sshcopyid.priv_key = os.path.join(tmp_dir, 'id_ecdsa')
+        key.write_private_key_file(self.sshcopyid.priv_key, password='passphrase')
+        get_passphrase = MagicMock(return_value='passphrase')
+
+        self.sshcopyid.load_priv_key(get_passphrase=get_passphrase)
+
+        self.assertEqual(self.sshcopyid.pkey, key)
+        get_passphrase.assert_called_once_with()
+
+    @patch('msshcopyid.logger')
+    def test_load_priv_key_invalid(self, mock_logger):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.sshcopyid.priv_key = os.path.join(tmp_dir, 'id_rsa')
+        with open(self.sshcopyid.priv_key, 'w') as fh:
+            fh.write('not a key')
 
-        keyscans = [server2_ssh_key,
-                    server3_ssh_key,
-                    server1_ssh_key]
-        mock_popen.return_value.communicate.return_value = ('\n'.join(keyscans), MagicMock())
+        with self.assertRaises(SystemExit):
+            self.sshcopyid.load_priv_key()
 
-        known_hosts_content = [server1_ssh_key,
-                               server4_ssh_key]
-        mock_bopen = mock_open(read_data='\n'.join(known_hosts_content))
+        self.assertIsNone(self.sshcopyid.pkey)
+        mock_logger.error.assert_called_once()
 
-        with patch('msshcopyid.open', mock_bopen):
-            self.sshcopyid.add_to_known_hosts(hosts, known_hosts=known_hosts, dry=False)
+    def test_get_known_hosts(self):
+        result1 = self.sshcopyid.get_known_hosts('/path/to/known_hosts')
+        result2 = self.sshcopyid.get_known_hosts('/path/to/known_hosts')
 
-        mock_bopen.return_value.writelines.assert_any_call(['{0}\n'.format(k)
-                                                            for k in (server2_ssh_key, server3_ssh_key)])
+        self.assertIs(result1, self.mock_known_hosts.return_value.load.return_value)
+        self.assertIs(result2, result1)
+        self.mock_known_hosts.assert_called_once_with('/path/to/known_hosts')
 
-    @patch('msshcopyid.subprocess.Popen')
-    def test_add_to_known_hosts_dry(self, mock_popen):
+    @patch('msshcopyid.logger')
+    def test_save_known_hosts(self, mock_logger):
+        known_hosts1 = MagicMock()
+        known_hosts1.save.side_effect = IOError('permission denied')
+        known_hosts2 = MagicMock()
+        self.sshcopyid.known_hosts = {'/path/to/known_hosts1': known_hosts1, '/path/to/known_hosts2': known_hosts2}
+
+        self.sshcopyid.save_known_hosts()
+
+        known_hosts1.save.assert_called_once_with()
+        known_hosts2.save.assert_called_once_with()
+        mock_logger.error.assert_called_once()
+
+    def write_known_hosts(self, lines):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        known_hosts = os.path.join(tmp_dir, 'known_hosts')
+        with open(known_hosts, 'w') as fh:
+            fh.writelines('{0}\n'.format(line) for line in lines)
+        return known_hosts
+
+    @patch('msshcopyid.scan_host_keys')
+    def test_add_to_known_hosts_paramiko(self, mock_scan_host_keys):
         hosts = [msshcopyid.Host(hostname='server1'),
-                 msshcopyid.Host(hostname='server2'),
+                 msshcopyid.Host(hostname='server2', port=2222),
                  msshcopyid.Host(hostname='server3')]
-        known_hosts = MagicMock()
+        key1, key2 = paramiko.RSAKey.generate(1024), paramiko.ECDSAKey.generate()
+        known_hosts = self.write_known_hosts(['server1 {0} {1}'.format(key1.get_name(), key1.get_base64())])
+        self.mock_known_hosts.side_effect = KnownHosts
+        socket_error = socket.error('connection refused')
+        scans = {'server1': [key1, key2], 'server2': [key2], 'server3': socket_error}
+
+        def scan_host_keys(hostname, port, timeout):
+            if isinstance(scans[hostname], Exception):
+                raise scans[hostname]
+            return scans[hostname]
+        mock_scan_host_keys.side_effect = scan_host_keys
+        self.sshcopyid.connect_timeout = 5
+
+        self.sshcopyid.add_to_known_hosts(hosts, known_hosts=known_hosts, dry=False, parallel=2)
+
+        mock_scan_host_keys.assert_any_call('server2', port=2222, timeout=5)
+        with open(known_hosts) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[0], 'server1 {0} {1}'.format(key1.get_name(), key1.get_base64()))
+        self.assertEqual(sorted(lines[1:]), sorted(['server1 {0} {1}'.format(key2.get_name(), key2.get_base64()),
+                                                    '[server2]:2222 {0} {1}'.format(key2.get_name(),
+                                                                                    key2.get_base64())]))
+
+    @patch('msshcopyid.scan_host_keys')
+    def test_add_to_known_hosts_paramiko_dry(self, mock_scan_host_keys):
+        hosts = [msshcopyid.Host(hostname='server1')]
+        known_hosts = self.write_known_hosts([])
+        self.mock_known_hosts.side_effect = KnownHosts
+        mock_scan_host_keys.return_value = [paramiko.RSAKey.generate(1024)]
+
+        self.sshcopyid.add_to_known_hosts(hosts, known_hosts=known_hosts, dry=True)
+
+        with open(known_hosts) as fh:
+            self.assertEqual(fh.read(), '')
+
+    @patch('msshcopyid.ssh_keyscan')
+    def test_add_to_known_hosts_ssh_keyscan(self, mock_ssh_keyscan):
+        hosts = [msshcopyid.Host(hostname='server1'),
+                 msshcopyid.Host(hostname='server2', port=2222),
+                 msshcopyid.Host(hostname='server3'),
+                 msshcopyid.Host(hostname='server5')]
 
         server1_ssh_key = 'server1 ssh-rsa KRDZhqpguSRxeiqLseaD'
-        server2_ssh_key = 'server2 ssh-rsa AAAAB3NzaC1yc2EAAAAB'
+        server2_ssh_key = '[server2]:2222 ssh-rsa AAAAB3NzaC1yc2EAAAAB'
         server3_ssh_key = 'server3 ssh-rsa O2gDXC6h6QDXCaHo6pOH'
         server4_ssh_key = 'server4 ssh-rsa hdHWpZ8fDvQArTUFCfgU'
+        known_hosts = self.write_known_hosts([server1_ssh_key, server4_ssh_key])
+        self.mock_known_hosts.side_effect = KnownHosts
+
+        def ssh_keyscan(hostnames, port, timeout):
+            if hostnames == ['server5']:
+                raise OSError('No such file or directory')
+            return {22: [server3_ssh_key, server1_ssh_key], 2222: [server2_ssh_key]}[port]
+        mock_ssh_keyscan.side_effect = ssh_keyscan
+        self.sshcopyid.connect_timeout = 5
+
+        self.sshcopyid.add_to_known_hosts_with_ssh_keyscan(hosts, known_hosts=known_hosts, dry=False, batch_size=2)
+
+        self.assertEqual(sorted(mock_ssh_keyscan.call_args_list),
+                         sorted([call(['server1', 'server3'], port=22, timeout=5),
+                                 call(['server2'], port=2222, timeout=5),
+                                 call(['server5'], port=22, timeout=5)]))
+        with open(known_hosts) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[:2], [server1_ssh_key, server4_ssh_key])
+        self.assertEqual(sorted(lines[2:]), [server2_ssh_key, server3_ssh_key])
+
+    @patch('msshcopyid.ssh_keyscan')
+    def test_add_to_known_hosts_ssh_keyscan_dry(self, mock_ssh_keyscan):
+        hosts = [msshcopyid.Host(hostname='server1')]
+        known_hosts = self.write_known_hosts([])
+        self.mock_known_hosts.side_effect = KnownHosts
+        mock_ssh_keyscan.return_value = ['server1 ssh-rsa KRDZhqpguSRxeiqLseaD']
+
+        self.sshcopyid.add_to_known_hosts(hosts, known_hosts=known_hosts, dry=True, scanner=SCANNER_SSH_KEYSCAN)
+
+        with open(known_hosts) as fh:
+            self.assertEqual(fh.read(), '')
 
-        keyscans = [server2_ssh_key,
-                    server3_ssh_key,
-                    server1_ssh_key]
-        mock_popen.return_value.communicate.return_value = ('\n'.join(keyscans), MagicMock())
-
-        known_hosts_content = [server1_ssh_key,
-                               server4_ssh_key]
-        mock_bopen = mock_open(read_data='\n'.join(known_hosts_content))
-
-        with patch('msshcopyid.open', mock_bopen):
-            self.sshcopyid.add_to_known_hosts(hosts, known_hosts=known_hosts, dry=True)
-
-        mock_bopen.return_value.writelines.assert_not_called()
-
-    @patch('msshcopyid.subprocess.check_call')
-    def test_remove_from_known_hosts(self, mock_check_call):
+    @patch('msshcopyid.os.path.isfile', return_value=True)
+    @patch('msshcopyid.remove_hosts')
+    def test_remove_from_known_hosts(self, mock_remove_hosts, mock_isfile):
         hosts = [msshcopyid.Host(hostname='server1'),
-                 msshcopyid.Host(hostname='server2'),
+                 msshcopyid.Host(hostname='server2', port=2222),
                  msshcopyid.Host(hostname='server3')]
         known_hosts = '/path/to/known_hosts'
 
         self.sshcopyid.remove_from_known_hosts(hosts, known_hosts=known_hosts, dry=False)
 
-        for host in hosts:
-            cmd = ['ssh-keygen', '-f', known_hosts, '-R', host.hostname]
-            mock_check_call.assert_any_call(cmd)
+        mock_remove_hosts.assert_called_once_with(known_hosts, ['server1', '[server2]:2222', 'server3'], dry=False)
 
-    @patch('msshcopyid.subprocess.check_call')
-    def test_remove_from_known_hosts_dry(self, mock_check_call):
+    @patch('msshcopyid.os.path.isfile', return_value=True)
+    @patch('msshcopyid.remove_hosts')
+    def test_remove_from_known_hosts_dry(self, mock_remove_hosts, mock_isfile):
         hosts = [msshcopyid.Host(hostname='server1'),
                  msshcopyid.Host(hostname='server2'),
                  msshcopyid.Host(hostname='server3')]
@@ -135,58 +258,254 @@ class TestSSHCopyId(unittest.TestCase):
 
         self.sshcopyid.remove_from_known_hosts(hosts, known_hosts=known_hosts, dry=True)
 
-        mock_check_call.assert_not_called()
+        mock_remove_hosts.assert_called_once_with(known_hosts, ['server1', 'server2', 'server3'], dry=True)
+
+    @patch('msshcopyid.os.path.isfile', return_value=False)
+    @patch('msshcopyid.remove_hosts')
+    def test_remove_from_known_hosts_not_exist(self, mock_remove_hosts, mock_isfile):
+        self.sshcopyid.remove_from_known_hosts([msshcopyid.Host(hostname='server1')],
+                                               known_hosts='/path/to/known_hosts', dry=False)
+
+        mock_remove_hosts.assert_not_called()
 
     @patch('msshcopyid.format_exception')
     @patch('msshcopyid.format_error')
-    @patch('msshcopyid.subprocess.check_call')
+    @patch('msshcopyid.os.path.isfile', return_value=True)
+    @patch('msshcopyid.remove_hosts')
     @patch('msshcopyid.logger')
-    def test_remove_from_known_hosts_error(self, mock_logger, mock_check_call, mock_format_error,
+    def test_remove_from_known_hosts_error(self, mock_logger, mock_remove_hosts, mock_isfile, mock_format_error,
                                            mock_format_exception):
         hosts = [msshcopyid.Host(hostname='server1'),
                  msshcopyid.Host(hostname='server2'),
                  msshcopyid.Host(hostname='server3')]
         known_hosts = '/path/to/known_hosts'
-        cmds = []
-        check_call_side_effect = []
-        for host in hosts:
-            cmd = ['ssh-keygen', '-f', known_hosts, '-R', host.hostname]
-            cmds.append(cmd)
-            check_call_side_effect.append(subprocess.CalledProcessError(1, cmd))
-        mock_check_call.side_effect = check_call_side_effect
+        ex = IOError('permission denied')
+        mock_remove_hosts.side_effect = ex
 
         self.sshcopyid.remove_from_known_hosts(hosts, known_hosts=known_hosts, dry=False)
 
-        for cmd, ex in zip(cmds, check_call_side_effect):
-            mock_check_call.assert_any_call(cmd)
-            mock_logger.error.assert_any_call(mock_format_error(mock_format_exception(ex)))
+        mock_logger.error.assert_called_once_with(mock_format_error(mock_format_exception(ex)))
+        mock_format_exception.assert_any_call(ex)
 
-    @patch('msshcopyid.os.path.isfile', return_value=True)
-    @patch('msshcopyid.paramiko.client.AutoAddPolicy')
+    @patch('msshcopyid.paramiko.Agent')
+    @patch('msshcopyid.KnownHostsPolicy')
     @patch('msshcopyid.paramiko.SSHClient')
-    def test_copy_ssh_keys_to_host(self, mock_ssh_client, mock_auto_add_policy, mock_isfile):
+    def test_copy_ssh_keys_to_host(self, mock_ssh_client, mock_known_hosts_policy, mock_agent):
         host = msshcopyid.Host(hostname='server1', port=12345, user='a_user', password='a_password')
         known_hosts = MagicMock()
 
+        client = mock_ssh_client.return_value
+        client.connect.side_effect = paramiko.ssh_exception.AuthenticationException('authentication exception')
+        transport = client.get_transport.return_value
+        transport.is_active.return_value = True
+        transport.get_remote_server_key.return_value.get_name.return_value = 'ssh-ed25519'
+        transport.get_remote_server_key.return_value.get_base64.return_value = 'AAAAC3NzaC1lZDI1NTE5'
+        mock_agent.return_value.get_keys.return_value = []
+        self.mock_exec_command(client).recv_exit_status.return_value = 0
+
         self.sshcopyid.priv_key = MagicMock()
         self.sshcopyid.pub_key_content = 'ssh-rsa AAAAB3NzaC1yc2EAAAAD'
-        password = None
-
-        self.sshcopyid.copy_ssh_keys_to_host(host, password=password, no_add_host=False, known_hosts=known_hosts)
-
-        client = mock_ssh_client.return_value
-        client.set_missing_host_key_policy.assert_called_once_with(mock_auto_add_policy.return_value)
+        password = 'a_password'
+
+        result = self.sshcopyid.copy_ssh_keys_to_host(host, password=password, no_add_host=False,
+                                                      known_hosts=known_hosts)
+
+        self.assertEqual(result, STATUS_ADDED)
+        self.assertEqual(host.host_key, 'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5')
+        self.assertEqual(sorted(host.timings), ['auth', 'close', 'exec'])
+        self.assertEqual(host.attempts, 1)
+        mock_known_hosts_policy.assert_called_once_with(self.mock_known_hosts.return_value.load.return_value,
+                                                        add_host=True)
+        client.set_missing_host_key_policy.assert_called_once_with(mock_known_hosts_policy.return_value)
         client.connect.assert_called_once_with(host.hostname, port=host.port, username=host.user,
-                                               password=password, key_filename=self.sshcopyid.priv_key)
+                                               key_filename=self.sshcopyid.priv_key, allow_agent=False,
+                                               look_for_keys=False, timeout=None, banner_timeout=None,
+                                               auth_timeout=None, sock=self.mock_open_socket.return_value)
+        transport.auth_password.assert_called_once_with(host.user, password)
         cmd = (r'''mkdir -p ~/.ssh && chmod 700 ~/.ssh && \
 k='{0}' && if ! grep -qFx "$k" ~/.ssh/authorized_keys; then echo "$k" >> ~/.ssh/authorized_keys; fi'''
                .format(self.sshcopyid.pub_key_content))
-        client.exec_command.assert_called_once_with(cmd)
+        client.exec_command.assert_called_once_with(cmd.encode('utf-8'), timeout=None)
+        client.close.assert_called_once_with()
+        self.assertEqual(self.sshcopyid.clients, set())
 
-    @patch('msshcopyid.os.path.isfile', return_value=True)
-    @patch('msshcopyid.paramiko.client.AutoAddPolicy')
     @patch('msshcopyid.paramiko.SSHClient')
-    def test_copy_ssh_keys_to_host_no_add_host(self, mock_ssh_client, mock_auto_add_policy, mock_isfile):
+    def test_copy_ssh_keys_to_host_already_authorized(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1', port=12345, user='a_user')
+        client = mock_ssh_client.return_value
+
+        self.sshcopyid.priv_key = '/home/user/.ssh/id_rsa'
+        self.sshcopyid.pub_key_content = 'ssh-rsa AAAAB3NzaC1yc2EAAAAD'
+
+        result = self.sshcopyid.copy_ssh_keys_to_host(host, password='a_password', known_hosts=MagicMock())
+
+        self.assertEqual(result, STATUS_UNCHANGED)
+        client.connect.assert_called_once_with(host.hostname, port=host.port, username=host.user,
+                                               key_filename='/home/user/.ssh/id_rsa', allow_agent=False,
+                                               look_for_keys=False, timeout=None, banner_timeout=None,
+                                               auth_timeout=None, sock=self.mock_open_socket.return_value)
+        client.get_transport.return_value.auth_password.assert_not_called()
+        client.exec_command.assert_not_called()
+        client.close.assert_called_once_with()
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_loaded_pkey(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1', port=12345, user='a_user')
+        client = mock_ssh_client.return_value
+
+        self.sshcopyid.priv_key = '/home/user/.ssh/id_rsa'
+        self.sshcopyid.pkey = MagicMock()
+
+        result = self.sshcopyid.copy_ssh_keys_to_host(host, known_hosts=MagicMock())
+
+        self.assertEqual(result, STATUS_UNCHANGED)
+        client.connect.assert_called_once_with(host.hostname, port=host.port, username=host.user,
+                                               pkey=self.sshcopyid.pkey, allow_agent=False, look_for_keys=False,
+                                               timeout=None, banner_timeout=None, auth_timeout=None,
+                                               sock=self.mock_open_socket.return_value)
+
+    @patch('msshcopyid.paramiko.Agent')
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_agent(self, mock_ssh_client, mock_agent):
+        host = msshcopyid.Host(hostname='server1', user='a_user')
+        client = mock_ssh_client.return_value
+        client.connect.side_effect = paramiko.ssh_exception.AuthenticationException('authentication exception')
+        transport = client.get_transport.return_value
+        transport.is_active.return_value = True
+        agent_key1, agent_key2 = MagicMock(), MagicMock()
+        mock_agent.return_value.get_keys.return_value = [agent_key1, agent_key2]
+        transport.auth_publickey.side_effect = [paramiko.ssh_exception.AuthenticationException('wrong key'), None]
+        self.mock_exec_command(client).recv_exit_status.return_value = 0
+        get_password = MagicMock()
+
+        self.sshcopyid.priv_key = '/home/user/.ssh/id_rsa'
+
+        result = self.sshcopyid.copy_ssh_keys_to_host(host, known_hosts=MagicMock(), get_password=get_password)
+
+        self.assertEqual(result, STATUS_ADDED)
+        transport.auth_publickey.assert_any_call('a_user', agent_key1)
+        transport.auth_publickey.assert_any_call('a_user', agent_key2)
+        mock_agent.return_value.close.assert_called_once_with()
+        get_password.assert_not_called()
+        transport.auth_password.assert_not_called()
+        client.exec_command.assert_called_once()
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_timeouts(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1', port=12345, user='a_user')
+        client = mock_ssh_client.return_value
+        channel = self.mock_exec_command(client)
+        channel.recv_exit_status.return_value = 0
+
+        self.sshcopyid = msshcopyid.SSHCopyId(connect_timeout=1, auth_timeout=2, exec_timeout=3)
+        self.sshcopyid.pub_key_content = 'ssh-rsa AAAAB3NzaC1yc2EAAAAD'
+
+        self.sshcopyid.copy_ssh_keys_to_host(host, known_hosts=MagicMock())
+
+        client.connect.assert_called_once_with(host.hostname, port=host.port, username=host.user, password=None,
+                                               timeout=1, banner_timeout=1, auth_timeout=2,
+                                               sock=self.mock_open_socket.return_value)
+        self.assertEqual(client.exec_command.call_args[1], {'timeout': 3})
+        channel.status_event.wait.assert_called_once_with(3)
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_exec_timeout(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1')
+        client = mock_ssh_client.return_value
+        channel = self.mock_exec_command(client)
+        channel.status_event.wait.return_value = False
+
+        with self.assertRaises(RemoteCommandError) as exctx:
+            self.sshcopyid.copy_ssh_keys_to_host(host, known_hosts=MagicMock())
+
+        self.assertEqual(exctx.exception.exit_status, None)
+        client.close.assert_called_once_with()
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_exec_error(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1')
+        client = mock_ssh_client.return_value
+        channel = self.mock_exec_command(client)
+        channel.recv_exit_status.return_value = 1
+
+        with self.assertRaises(RemoteCommandError) as exctx:
+            self.sshcopyid.copy_ssh_keys_to_host(host, known_hosts=MagicMock())
+
+        self.assertEqual(exctx.exception.exit_status, 1)
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_password_fallback(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1', user='a_user')
+        client = mock_ssh_client.return_value
+        client.connect.side_effect = paramiko.ssh_exception.AuthenticationException('authentication exception')
+        transport = client.get_transport.return_value
+        transport.is_active.return_value = True
+        self.mock_exec_command(client).recv_exit_status.return_value = 0
+        get_password = MagicMock(return_value='a_password')
+
+        self.sshcopyid.copy_ssh_keys_to_host(host, known_hosts=MagicMock(), get_password=get_password)
+
+        client.connect.assert_called_once()
+        get_password.assert_called_once_with()
+        transport.auth_password.assert_called_once_with('a_user', 'a_password')
+        client.exec_command.assert_called_once()
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_password_fallback_wrong_password(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1', user='a_user')
+        client = mock_ssh_client.return_value
+        client.connect.side_effect = paramiko.ssh_exception.AuthenticationException('authentication exception')
+        transport = client.get_transport.return_value
+        transport.is_active.return_value = True
+        transport.auth_password.side_effect = paramiko.ssh_exception.AuthenticationException('wrong password')
+
+        with self.assertRaises(paramiko.ssh_exception.AuthenticationException):
+            self.sshcopyid.copy_ssh_keys_to_host(host, known_hosts=MagicMock(), get_password=MagicMock())
+
+        client.exec_command.assert_not_called()
+        client.close.assert_called_once_with()
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_no_password_fallback_if_password_given(self, mock_ssh_client):
+        host = msshcopyid.Host(hostname='server1', user='a_user')
+        client = mock_ssh_client.return_value
+        client.connect.side_effect = paramiko.ssh_exception.AuthenticationException('authentication exception')
+        client.get_transport.return_value.is_active.return_value = True
+        get_password = MagicMock()
+
+        with self.assertRaises(paramiko.ssh_exception.AuthenticationException):
+            self.sshcopyid.copy_ssh_keys_to_host(host, password='a_password', known_hosts=MagicMock(),
+                                                 get_password=get_password)
+
+        get_password.assert_not_called()
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_cancelled(self, mock_ssh_client):
+        self.sshcopyid.cancel()
+
+        with self.assertRaises(CancelledError):
+            self.sshcopyid.copy_ssh_keys_to_host(msshcopyid.Host(hostname='server1'), known_hosts=MagicMock())
+
+        mock_ssh_client.assert_not_called()
+
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_cancelled_in_progress(self, mock_ssh_client):
+        client = mock_ssh_client.return_value
+
+        def connect(*args, **kwargs):
+            self.assertEqual(self.sshcopyid.clients, set([client]))
+            self.sshcopyid.cancel()
+            raise EOFError()
+        client.connect.side_effect = connect
+
+        with self.assertRaises(CancelledError):
+            self.sshcopyid.copy_ssh_keys_to_host(msshcopyid.Host(hostname='server1'), known_hosts=MagicMock())
+
+        self.assertEqual(self.sshcopyid.clients, set())
+
+    @patch('msshcopyid.KnownHostsPolicy')
+    @patch('msshcopyid.paramiko.SSHClient')
+    def test_copy_ssh_keys_to_host_no_add_host(self, mock_ssh_client, mock_known_hosts_policy):
         host = msshcopyid.Host(hostname='server1', port=12345, user='a_user', password='a_password')
         known_hosts = MagicMock()
         client = mock_ssh_client.return_value
@@ -201,15 +520,18 @@ k='{0}' && if ! grep -qFx "$k" ~/.ssh/authorized_keys; then echo "$k" >> ~/.ssh/
             self.sshcopyid.copy_ssh_keys_to_host(host, password=password, no_add_host=True, known_hosts=known_hosts)
             self.assertEqual(exctx.exception, ssh_exception)
 
-        client.set_missing_host_key_policy.assert_not_called()
+        mock_known_hosts_policy.assert_called_once_with(self.mock_known_hosts.return_value.load.return_value,
+                                                        add_host=False)
         client.connect.assert_called_once_with(host.hostname, port=host.port, username=host.user,
-                                               password=password, key_filename=self.sshcopyid.priv_key)
+                                               key_filename=self.sshcopyid.priv_key, allow_agent=False,
+                                               look_for_keys=False, timeout=None, banner_timeout=None,
+                                               auth_timeout=None, sock=self.mock_open_socket.return_value)
         client.exec_command.assert_not_called()
 
-    @patch('msshcopyid.os.path.isfile', return_value=True)
-    @patch('msshcopyid.paramiko.client.AutoAddPolicy')
+    @patch('msshcopyid.paramiko.Agent')
+    @patch('msshcopyid.KnownHostsPolicy')
     @patch('msshcopyid.paramiko.SSHClient')
-    def test_copy_ssh_keys_to_host_wrong_password(self, mock_ssh_client, mock_auto_add_policy, mock_isfile):
+    def test_copy_ssh_keys_to_host_wrong_password(self, mock_ssh_client, mock_known_hosts_policy, mock_agent):
         host = msshcopyid.Host(hostname='server1', port=12345, user='a_user', password='a_password')
         known_hosts = MagicMock()
         client = mock_ssh_client.return_value
@@ -224,7 +546,41 @@ k='{0}' && if ! grep -qFx "$k" ~/.ssh/authorized_keys; then echo "$k" >> ~/.ssh/
             self.sshcopyid.copy_ssh_keys_to_host(host, password=password, no_add_host=True, known_hosts=known_hosts)
             self.assertEqual(exctx.exception, auth_exception)
 
-        client.set_missing_host_key_policy.assert_not_called()
+        mock_known_hosts_policy.assert_called_once_with(self.mock_known_hosts.return_value.load.return_value,
+                                                        add_host=False)
         client.connect.assert_called_once_with(host.hostname, port=host.port, username=host.user,
-                                               password=password, key_filename=self.sshcopyid.priv_key)
+                                               key_filename=self.sshcopyid.priv_key, allow_agent=False,
+                                               look_for_keys=False, timeout=None, banner_timeout=None,
+                                               auth_timeout=None, sock=self.mock_open_socket.return_value)
         client.exec_command.assert_not_called()
+
+
+class TestOpenSocket(unittest.TestCase):
+
+    def setUp(self):
+        self.sshcopyid = msshcopyid.SSHCopyId(connect_timeout=5)
+
+    def test_open_socket(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        host = msshcopyid.Host(hostname='127.0.0.1', port=server.getsockname()[1])
+        timer = MagicMock()
+
+        sock = self.sshcopyid.open_socket(host, timer=timer)
+        sock.close()
+
+        self.assertEqual(timer.mark.call_args_list, [call('resolve'), call('connect')])
+
+    def test_open_socket_refused(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        timer = MagicMock()
+
+        with self.assertRaises(socket.error):
+            self.sshcopyid.open_socket(msshcopyid.Host(hostname='127.0.0.1', port=port), timer=timer)
+
+        timer.mark.assert_called_once_with('resolve')
@@ -1,9 +1,12 @@
 from __future__ import unicode_literals
 
+import os
+import signal
 import socket
 import sys
+import time
 
-from mock import MagicMock, mock_open, patch
+from mock import ANY, call, MagicMock, mock_open, patch
 import paramiko
 import pytest
 import unittest2 as unittest
@@ -11,7 +14,8 @@ import unittest2 as unittest
 import msshcopyid.cli
 from msshcopyid.constants import DEFAULT_SSH_DSA
 from msshcopyid.constants import DEFAULT_SSH_RSA
-from msshcopyid.errors import CopySSHKeysError
+from msshcopyid.constants import STATUS_ADDED, STATUS_FAILED, STATUS_SKIPPED
+from msshcopyid.errors import CancelledError, CopySSHKeysError
 
 
 class TestMain(unittest.TestCase):
@@ -113,6 +117,43 @@ class TestMain(unittest.TestCase):
         else:
             self.assertEquals(exctx.exception.args, (1,))
 
+    def test_check_hosts_ok(self):
+        self.main.args = MagicMock()
+        self.main.args.hosts = []
+        self.main.args.hosts_file = '-'
+
+        self.main.check_hosts()
+
+    def test_check_hosts_no_host(self):
+        self.main.args = MagicMock()
+        self.main.args.hosts = []
+        self.main.args.hosts_file = None
+
+        with self.assertRaises(SystemExit) as exctx:
+            self.main.check_hosts()
+
+        # Behavior is different between Python 2.6 and 2.7 when catching SystemExit
+        if sys.version_info < (2, 7):
+            self.assertEquals(exctx.exception, 1)
+        else:
+            self.assertEquals(exctx.exception.args, (1,))
+
+    @patch('msshcopyid.cli.os.path.isfile', return_value=False)
+    def test_check_hosts_file_not_exists(self, mock_isfile):
+        self.main.args = MagicMock()
+        self.main.args.hosts = ['server1']
+        self.main.args.hosts_file = '/path/to/hosts'
+
+        with self.assertRaises(SystemExit) as exctx:
+            self.main.check_hosts()
+
+        # Behavior is different between Python 2.6 and 2.7 when catching SystemExit
+        if sys.version_info < (2, 7):
+            self.assertEquals(exctx.exception, 1)
+        else:
+            self.assertEquals(exctx.exception.args, (1,))
+        mock_isfile.assert_called_once_with('/path/to/hosts')
+
     @patch('msshcopyid.cli.open', new_callable=mock_open)
     @patch('msshcopyid.cli.os.path.exists', return_value=False)
     def test_run_add(self, mock_exists, mock_bopen):
@@ -127,7 +168,8 @@ class TestMain(unittest.TestCase):
 
         mock_bopen.assert_called_once_with(self.main.args.known_hosts, 'w')
         sshcopyid.add_to_known_hosts.assert_called_once_with(self.main.hosts, known_hosts=self.main.args.known_hosts,
-                                                             dry=self.main.args.dry)
+                                                             dry=self.main.args.dry, parallel=self.main.args.parallel,
+                                                             scanner=self.main.args.scanner)
 
     @patch('msshcopyid.cli.open', new_callable=mock_open)
     @patch('msshcopyid.cli.os.path.exists', return_value=False)
@@ -149,27 +191,70 @@ class TestMain(unittest.TestCase):
     @patch('msshcopyid.cli.Main.copy_ssh_keys_to_hosts')
     def test_run_copy_ssh_keys_to_hosts_no_clear_hosts(self, mock_copy_ssh_keys_to_hosts):
         sshcopyid = MagicMock()
+        sshcopyid.pub_key_content = 'ssh-rsa AAAAB3NzaC1yc2EAAAAB me@laptop'
         self.main.sshcopyid = sshcopyid
         self.main.hosts = MagicMock()
         self.main.args = MagicMock()
         self.main.args.add = False
         self.main.args.remove = False
+        self.main.args.journal = None
+        self.main.args.resume = None
+        self.main.args.skip_known_good = False
+        self.main.args.state_db = None
+        self.main.args.stats = False
+        self.main.args.report = None
         self.main.args.clear = False
 
         self.main.run()
 
         sshcopyid.remove_from_known_hosts.assert_not_called()
+        sshcopyid.load_priv_key.assert_not_called()
         mock_copy_ssh_keys_to_hosts.assert_called_once_with(self.main.hosts, known_hosts=self.main.args.known_hosts,
-                                                            dry=self.main.args.dry)
+                                                            dry=self.main.args.dry, parallel=self.main.args.parallel,
+                                                            processes=self.main.args.processes,
+                                                            deadline=self.main.args.deadline, journal=None,
+                                                            state=None, skip_known_good=False,
+                                                            max_age=self.main.args.max_age,
+                                                            stats=None, report=None)
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_hosts')
+    def test_run_copy_ssh_keys_to_hosts_load_priv_key(self, mock_copy_ssh_keys_to_hosts):
+        sshcopyid = MagicMock()
+        sshcopyid.pub_key_content = 'ssh-rsa AAAAB3NzaC1yc2EAAAAB me@laptop'
+        sshcopyid.pkey = None
+        self.main.sshcopyid = sshcopyid
+        self.main.hosts = MagicMock()
+        self.main.args = MagicMock()
+        self.main.args.add = False
+        self.main.args.remove = False
+        self.main.args.journal = None
+        self.main.args.resume = None
+        self.main.args.skip_known_good = False
+        self.main.args.state_db = None
+        self.main.args.stats = False
+        self.main.args.report = None
+        self.main.args.dry = False
+
+        self.main.run()
+
+        sshcopyid.load_priv_key.assert_called_once()
+        mock_copy_ssh_keys_to_hosts.assert_called_once()
 
     @patch('msshcopyid.cli.Main.copy_ssh_keys_to_hosts')
     def test_run_copy_ssh_keys_to_hosts_clear_hosts(self, mock_copy_ssh_keys_to_hosts):
         sshcopyid = MagicMock()
+        sshcopyid.pub_key_content = 'ssh-rsa AAAAB3NzaC1yc2EAAAAB me@laptop'
         self.main.sshcopyid = sshcopyid
         self.main.hosts = MagicMock()
         self.main.args = MagicMock()
         self.main.args.add = False
         self.main.args.remove = False
+        self.main.args.journal = None
+        self.main.args.resume = None
+        self.main.args.skip_known_good = False
+        self.main.args.state_db = None
+        self.main.args.stats = False
+        self.main.args.report = None
         self.main.args.clear = True
 
         self.main.run()
@@ -178,7 +263,12 @@ class TestMain(unittest.TestCase):
                                                                   known_hosts=self.main.args.known_hosts,
                                                                   dry=self.main.args.dry)
         mock_copy_ssh_keys_to_hosts.assert_called_once_with(self.main.hosts, known_hosts=self.main.args.known_hosts,
-                                                            dry=self.main.args.dry)
+                                                            dry=self.main.args.dry, parallel=self.main.args.parallel,
+                                                            processes=self.main.args.processes,
+                                                            deadline=self.main.args.deadline, journal=None,
+                                                            state=None, skip_known_good=False,
+                                                            max_age=self.main.args.max_age,
+                                                            stats=None, report=None)
 
     @patch('msshcopyid.cli.format_exception')
     @patch('msshcopyid.cli.format_error')
@@ -187,11 +277,18 @@ class TestMain(unittest.TestCase):
     def test_run_copy_ssh_keys_to_hosts_catch_exception(self, mock_copy_ssh_keys_to_hosts, mock_logger,
                                                         mock_format_error, mock_format_exception):
         sshcopyid = MagicMock()
+        sshcopyid.pub_key_content = 'ssh-rsa AAAAB3NzaC1yc2EAAAAB me@laptop'
         self.main.sshcopyid = sshcopyid
         self.main.hosts = MagicMock()
         self.main.args = MagicMock()
         self.main.args.add = False
         self.main.args.remove = False
+        self.main.args.journal = None
+        self.main.args.resume = None
+        self.main.args.skip_known_good = False
+        self.main.args.state_db = None
+        self.main.args.stats = False
+        self.main.args.report = None
         self.main.args.clear = True
         exception = CopySSHKeysError('copy ssh exception')
         mock_copy_ssh_keys_to_hosts.side_effect = exception
@@ -203,7 +300,12 @@ class TestMain(unittest.TestCase):
                                                                   known_hosts=self.main.args.known_hosts,
                                                                   dry=self.main.args.dry)
         mock_copy_ssh_keys_to_hosts.assert_called_once_with(self.main.hosts, known_hosts=self.main.args.known_hosts,
-                                                            dry=self.main.args.dry)
+                                                            dry=self.main.args.dry, parallel=self.main.args.parallel,
+                                                            processes=self.main.args.processes,
+                                                            deadline=self.main.args.deadline, journal=None,
+                                                            state=None, skip_known_good=False,
+                                                            max_age=self.main.args.max_age,
+                                                            stats=None, report=None)
         mock_logger.error.assert_called_once_with(mock_format_error.return_value)
         mock_format_error.assert_called_once_with(mock_format_exception.return_value)
         mock_format_exception.assert_called_once_with(exception)
@@ -268,11 +370,161 @@ class TestMain(unittest.TestCase):
         mock_copy_ssh_keys_to_host.assert_any_call(host2, known_hosts=known_hosts)
         mock_copy_ssh_keys_to_host.assert_any_call(host3, known_hosts=known_hosts)
 
-        mock_logger.error.assert_any_call(mock_format_error.return_value)
+        mock_logger.error.assert_any_call('[%s] %s', 'server1', mock_format_error.return_value)
+        mock_logger.error.assert_any_call('[%s] %s', 'server2', mock_format_error.return_value)
         mock_format_error.assert_any_call(mock_format_exception.return_value)
         mock_format_exception.assert_any_call(ssh_exception)
         mock_format_exception.assert_any_call(socket_error)
 
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_parallel(self, mock_copy_ssh_keys_to_host):
+        hosts = [msshcopyid.Host(hostname='server{0}'.format(i)) for i in range(20)]
+        known_hosts = MagicMock()
+        ssh_exception = paramiko.ssh_exception.SSHException('ssh exception')
+
+        def copy_ssh_keys_to_host(host, known_hosts):
+            if host.hostname == 'server7':
+                raise ssh_exception
+        mock_copy_ssh_keys_to_host.side_effect = copy_ssh_keys_to_host
+
+        self.main.sshcopyid = MagicMock()
+
+        with pytest.raises(CopySSHKeysError) as excinfo:
+            self.main.copy_ssh_keys_to_hosts(hosts, known_hosts=known_hosts, dry=False, parallel=4)
+
+        self.assertEqual([ex.host.hostname for ex in excinfo.value.exceptions], ['server7'])
+        self.assertEqual(mock_copy_ssh_keys_to_host.call_count, 20)
+        for host in hosts:
+            mock_copy_ssh_keys_to_host.assert_any_call(host, known_hosts=known_hosts)
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_journal(self, mock_copy_ssh_keys_to_host):
+        host1 = msshcopyid.Host(hostname='server1')
+        host2 = msshcopyid.Host(hostname='server2')
+        host3 = msshcopyid.Host(hostname='server3')
+        ssh_exception = paramiko.ssh_exception.SSHException('ssh exception')
+        mock_copy_ssh_keys_to_host.side_effect = [STATUS_ADDED, ssh_exception]
+        journal = MagicMock()
+        journal.is_done.side_effect = lambda host: host is host1
+
+        self.main.sshcopyid = MagicMock()
+
+        with pytest.raises(CopySSHKeysError):
+            self.main.copy_ssh_keys_to_hosts([host1, host2, host3], known_hosts=MagicMock(), dry=False,
+                                             journal=journal)
+
+        self.assertEqual(mock_copy_ssh_keys_to_host.call_count, 2)
+        journal.record.assert_any_call(host2, STATUS_ADDED)
+        journal.record.assert_any_call(host3, STATUS_FAILED, error='ssh exception')
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_skip_known_good(self, mock_copy_ssh_keys_to_host):
+        host1 = msshcopyid.Host(hostname='server1')
+        host2 = msshcopyid.Host(hostname='server2')
+        mock_copy_ssh_keys_to_host.return_value = STATUS_ADDED
+        state = MagicMock()
+        state.is_known_good.side_effect = lambda host, max_age: host is host1
+
+        self.main.sshcopyid = MagicMock()
+
+        self.main.copy_ssh_keys_to_hosts([host1, host2], known_hosts=MagicMock(), dry=False, state=state,
+                                         skip_known_good=True, max_age=3600)
+
+        mock_copy_ssh_keys_to_host.assert_called_once_with(host2, known_hosts=ANY)
+        state.is_known_good.assert_any_call(host1, max_age=3600)
+        state.record_success.assert_called_once_with(host2)
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_state_no_skip(self, mock_copy_ssh_keys_to_host):
+        host1 = msshcopyid.Host(hostname='server1')
+        mock_copy_ssh_keys_to_host.return_value = STATUS_ADDED
+        state = MagicMock()
+
+        self.main.sshcopyid = MagicMock()
+
+        self.main.copy_ssh_keys_to_hosts([host1], known_hosts=MagicMock(), dry=False, state=state)
+
+        state.is_known_good.assert_not_called()
+        state.record_success.assert_called_once_with(host1)
+
+    @patch('msshcopyid.cli.logger')
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_stats(self, mock_copy_ssh_keys_to_host, mock_logger):
+        def copy_ssh_keys_to_host(host, known_hosts):
+            host.timings = {'connect': 0.1}
+        mock_copy_ssh_keys_to_host.side_effect = copy_ssh_keys_to_host
+        hosts = [msshcopyid.Host(hostname='server1'), msshcopyid.Host(hostname='server2')]
+        stats = MagicMock()
+        stats.format.return_value = ['line1', 'line2']
+
+        self.main.sshcopyid = MagicMock()
+
+        self.main.copy_ssh_keys_to_hosts(hosts, known_hosts=MagicMock(), dry=False, stats=stats)
+
+        stats.add.assert_has_calls([call(hosts[0]), call(hosts[1])], any_order=True)
+        mock_logger.info.assert_any_call('line1')
+        mock_logger.info.assert_any_call('line2')
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_report(self, mock_copy_ssh_keys_to_host):
+        host1 = msshcopyid.Host(hostname='server1')
+        host2 = msshcopyid.Host(hostname='server2')
+        host3 = msshcopyid.Host(hostname='server3')
+        ex = socket.error('connection refused')
+
+        def copy_ssh_keys_to_host(host, known_hosts):
+            if host is host2:
+                raise ex
+            return STATUS_ADDED
+        mock_copy_ssh_keys_to_host.side_effect = copy_ssh_keys_to_host
+        journal = MagicMock()
+        journal.is_done.side_effect = lambda host: host is host3
+        report = MagicMock()
+
+        self.main.sshcopyid = MagicMock()
+
+        with self.assertRaises(CopySSHKeysError):
+            self.main.copy_ssh_keys_to_hosts([host1, host2, host3], known_hosts=MagicMock(), dry=False,
+                                             journal=journal, report=report)
+
+        report.record.assert_has_calls([call(host3, STATUS_SKIPPED), call(host1, STATUS_ADDED),
+                                        call(host2, STATUS_FAILED, exception=ex)], any_order=True)
+        self.assertEqual(report.record.call_count, 3)
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_sigint(self, mock_copy_ssh_keys_to_host):
+        hosts = [msshcopyid.Host(hostname='server{0}'.format(i)) for i in range(20)]
+        journal = MagicMock()
+        journal.is_done.return_value = False
+
+        def copy_ssh_keys_to_host(host, known_hosts):
+            if host is hosts[0]:
+                os.kill(os.getpid(), signal.SIGINT)
+                # Let the main thread handle the signal
+                time.sleep(0.5)
+            return STATUS_ADDED
+        mock_copy_ssh_keys_to_host.side_effect = copy_ssh_keys_to_host
+
+        self.main.sshcopyid = MagicMock()
+
+        with pytest.raises(KeyboardInterrupt):
+            self.main.copy_ssh_keys_to_hosts(hosts, known_hosts=MagicMock(), dry=False, journal=journal)
+
+        # The hosts in progress are completed and recorded, but the others are skipped
+        self.assertLess(mock_copy_ssh_keys_to_host.call_count, len(hosts))
+        self.assertEqual(journal.record.call_count, mock_copy_ssh_keys_to_host.call_count)
+        self.assertIs(signal.getsignal(signal.SIGINT), signal.default_int_handler)
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_unexpected_exception(self, mock_copy_ssh_keys_to_host):
+        hosts = [msshcopyid.Host(hostname='server1')]
+        mock_copy_ssh_keys_to_host.side_effect = ValueError('bug')
+
+        self.main.sshcopyid = MagicMock()
+
+        with pytest.raises(ValueError):
+            self.main.copy_ssh_keys_to_hosts(hosts, known_hosts=MagicMock(), dry=False, parallel=2)
+
     @patch('msshcopyid.utils.get_password')
     def test_copy_ssh_keys_to_host_prompt_password(self, mock_get_password):
         host = msshcopyid.Host(hostname='server1')
@@ -281,16 +533,15 @@ class TestMain(unittest.TestCase):
         self.main.args = MagicMock()
         sshcopyid = MagicMock()
         sshcopyid.default_password = None
-        sshcopyid.copy_ssh_keys_to_host.side_effect = [paramiko.ssh_exception.AuthenticationException, None]
         self.main.sshcopyid = sshcopyid
 
         self.main.copy_ssh_keys_to_host(host, known_hosts=known_hosts)
 
-        sshcopyid.copy_ssh_keys_to_host.assert_any_call(host, password=None, no_add_host=self.main.args.no_add_host,
-                                                        known_hosts=known_hosts)
-        sshcopyid.copy_ssh_keys_to_host.assert_any_call(host, password=mock_get_password.return_value,
-                                                        no_add_host=self.main.args.no_add_host, known_hosts=known_hosts)
-        self.assertEqual(sshcopyid.default_password, mock_get_password.return_value)
+        sshcopyid.copy_ssh_keys_to_host.assert_called_once_with(host, password=None,
+                                                                no_add_host=self.main.args.no_add_host,
+                                                                known_hosts=known_hosts,
+                                                                get_password=self.main.get_default_password)
+        mock_get_password.assert_not_called()
 
     def test_copy_ssh_keys_to_host_using_host_password_authentication_exception(self):
         host = msshcopyid.Host(hostname='server1', password='server1 password')
@@ -307,7 +558,7 @@ class TestMain(unittest.TestCase):
 
         sshcopyid.copy_ssh_keys_to_host.assert_called_once_with(host, password='server1 password',
                                                                 no_add_host=self.main.args.no_add_host,
-                                                                known_hosts=known_hosts)
+                                                                known_hosts=known_hosts, get_password=None)
         self.assertEqual(sshcopyid.default_password, 'default password')
 
     def test_copy_ssh_keys_to_host_using_default_password_authentication_exception(self):
@@ -325,5 +576,80 @@ class TestMain(unittest.TestCase):
 
         sshcopyid.copy_ssh_keys_to_host.assert_called_once_with(host, password='default password',
                                                                 no_add_host=self.main.args.no_add_host,
-                                                                known_hosts=known_hosts)
+                                                                known_hosts=known_hosts, get_password=None)
         self.assertEqual(sshcopyid.default_password, 'default password')
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_deadline(self, mock_copy_ssh_keys_to_host):
+        hosts = [msshcopyid.Host(hostname='server1'), msshcopyid.Host(hostname='server2')]
+        cancelled_error = CancelledError()
+
+        def copy_ssh_keys_to_host(host, known_hosts):
+            if host.hostname == 'server2':
+                time.sleep(0.2)
+                raise cancelled_error
+        mock_copy_ssh_keys_to_host.side_effect = copy_ssh_keys_to_host
+
+        self.main.sshcopyid = MagicMock()
+
+        with pytest.raises(CopySSHKeysError) as excinfo:
+            self.main.copy_ssh_keys_to_hosts(hosts, known_hosts=MagicMock(), dry=False, parallel=2, deadline=0.05)
+
+        self.assertEqual([ex.exception for ex in excinfo.value.exceptions], [cancelled_error])
+        self.main.sshcopyid.cancel.assert_called_once_with()
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_deadline_not_exceeded(self, mock_copy_ssh_keys_to_host):
+        hosts = [msshcopyid.Host(hostname='server1')]
+
+        self.main.sshcopyid = MagicMock()
+
+        self.main.copy_ssh_keys_to_hosts(hosts, known_hosts=MagicMock(), dry=False, deadline=10)
+
+        self.main.sshcopyid.cancel.assert_not_called()
+
+    @patch('msshcopyid.cli.Main.copy_ssh_keys_to_host')
+    def test_copy_ssh_keys_to_hosts_processes(self, mock_copy_ssh_keys_to_host):
+        hosts = [msshcopyid.Host(hostname='server{0}'.format(i)) for i in range(10)]
+        ssh_exception = paramiko.ssh_exception.SSHException('ssh exception')
+
+        def copy_ssh_keys_to_host(host, known_hosts):
+            if host.hostname in ('server2', 'server5'):
+                raise ssh_exception
+        mock_copy_ssh_keys_to_host.side_effect = copy_ssh_keys_to_host
+
+        self.main.sshcopyid = MagicMock()
+
+        with pytest.raises(CopySSHKeysError) as excinfo:
+            self.main.copy_ssh_keys_to_hosts(hosts, known_hosts='known_hosts', dry=False, parallel=2, processes=3)
+
+        self.assertEqual(sorted(ex.host.hostname for ex in excinfo.value.exceptions), ['server2', 'server5'])
+        self.assertEqual([str(ex.exception) for ex in excinfo.value.exceptions], ['ssh exception'] * 2)
+
+    @patch('msshcopyid.utils.get_password')
+    def test_get_default_password_cannot_prompt(self, mock_get_password):
+        self.main.sshcopyid = MagicMock()
+        self.main.sshcopyid.default_password = None
+        self.main.can_prompt_password = False
+
+        with self.assertRaises(paramiko.ssh_exception.AuthenticationException):
+            self.main.get_default_password()
+
+        mock_get_password.assert_not_called()
+
+    @patch('msshcopyid.utils.get_password')
+    def test_get_default_password_already_given(self, mock_get_password):
+        self.main.sshcopyid = MagicMock()
+        self.main.sshcopyid.default_password = 'default password'
+
+        self.assertEqual(self.main.get_default_password(), 'default password')
+        mock_get_password.assert_not_called()
+
+    @patch('msshcopyid.utils.get_password')
+    def test_get_default_password_prompt_once(self, mock_get_password):
+        self.main.sshcopyid = MagicMock()
+        self.main.sshcopyid.default_password = None
+
+        self.assertEqual(self.main.get_default_password(), mock_get_password.return_value)
+        self.assertEqual(self.main.get_default_password(), mock_get_password.return_value)
+        mock_get_password.assert_called_once_with()
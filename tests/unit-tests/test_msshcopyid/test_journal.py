@@ -0,0 +1,80 @@
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import unittest2 as unittest
+
+from msshcopyid import Host
+from msshcopyid.constants import STATUS_ADDED, STATUS_FAILED, STATUS_UNCHANGED
+from msshcopyid.journal import get_fingerprint, get_host_id, Journal
+
+
+class TestJournalModule(unittest.TestCase):
+
+    def test_get_host_id(self):
+        self.assertEqual(get_host_id(Host(hostname='server1', port=2222, user='root')), 'root@server1:2222')
+
+    def test_get_fingerprint(self):
+        blob = b'\x00\x00\x00\x07ssh-rsa\x00\x00\x00\x01\x23'
+        expected = base64.b64encode(hashlib.sha256(blob).digest()).decode('ascii').rstrip('=')
+
+        result = get_fingerprint('ssh-rsa {0} me@laptop'.format(base64.b64encode(blob).decode('ascii')))
+
+        self.assertEqual(result, 'SHA256:{0}'.format(expected))
+
+    def test_get_fingerprint_invalid_key(self):
+        self.assertEqual(get_fingerprint('not a key'), get_fingerprint('not a key'))
+        self.assertNotEqual(get_fingerprint('not a key'), get_fingerprint('not another key'))
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.filename = os.path.join(self.tmp_dir, 'journal.jsonl')
+        self.host1 = Host(hostname='server1', user='root')
+        self.host2 = Host(hostname='server2', user='root')
+        self.host3 = Host(hostname='server3', user='root')
+
+    def test_record(self):
+        journal = Journal(self.filename, fingerprint='SHA256:key1')
+
+        journal.record(self.host1, STATUS_ADDED)
+        journal.record(self.host2, STATUS_FAILED, error='Authentication failed.')
+        journal.close()
+
+        with open(self.filename) as fh:
+            entries = [json.loads(line) for line in fh]
+        self.assertEqual([(entry['host'], entry['status'], entry['fingerprint'], entry.get('error'))
+                          for entry in entries],
+                         [('root@server1:22', STATUS_ADDED, 'SHA256:key1', None),
+                          ('root@server2:22', STATUS_FAILED, 'SHA256:key1', 'Authentication failed.')])
+
+    def test_load(self):
+        journal = Journal(self.filename, fingerprint='SHA256:key1')
+        journal.record(self.host1, STATUS_ADDED)
+        journal.record(self.host2, STATUS_UNCHANGED)
+        journal.record(self.host2, STATUS_FAILED, error='Connection refused')
+        journal.close()
+        journal = Journal(self.filename, fingerprint='SHA256:key2')
+        journal.record(self.host3, STATUS_ADDED)
+        journal.close()
+        with open(self.filename, 'a') as fh:
+            fh.write('{"host": "root@server')
+
+        result = Journal(self.filename, fingerprint='SHA256:key1').load()
+
+        self.assertTrue(result.is_done(self.host1))
+        self.assertFalse(result.is_done(self.host2))
+        self.assertFalse(result.is_done(self.host3))
+
+    def test_load_not_exists(self):
+        result = Journal(self.filename, fingerprint='SHA256:key1').load()
+
+        self.assertEqual(result.done, set())
@@ -0,0 +1,290 @@
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import stat
+import tempfile
+
+from mock import MagicMock, patch
+import paramiko
+import pytest
+import unittest2 as unittest
+
+from msshcopyid.known_hosts import get_host_key_name, KnownHosts, KnownHostsPolicy, remove_hosts
+from msshcopyid import Host
+from msshcopyid.errors import MSSHCopyIdException
+from msshcopyid.known_hosts import iter_keyscan_batches, scan_host_key, scan_host_keys, ssh_keyscan
+
+
+class KnownHostsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.known_hosts_file = os.path.join(self.tmp_dir, 'known_hosts')
+
+        self.key1 = paramiko.RSAKey.generate(1024)
+        self.key2 = paramiko.ECDSAKey.generate()
+        self.key3 = paramiko.RSAKey.generate(1024)
+
+    def write_known_hosts(self, lines):
+        with open(self.known_hosts_file, 'w') as fh:
+            fh.writelines('{0}\n'.format(line) for line in lines)
+
+    def read_known_hosts(self):
+        with open(self.known_hosts_file) as fh:
+            return fh.read().splitlines()
+
+    @staticmethod
+    def entry(name, key):
+        return '{0} {1} {2}'.format(name, key.get_name(), key.get_base64())
+
+
+class TestKnownHostsModule(KnownHostsTestCase):
+
+    def test_get_host_key_name(self):
+        self.assertEqual(get_host_key_name('server1'), 'server1')
+        self.assertEqual(get_host_key_name('server1', 22), 'server1')
+        self.assertEqual(get_host_key_name('server1', 2222), '[server1]:2222')
+
+    def test_remove_hosts(self):
+        lines = [
+            '# comment',
+            self.entry('server1', self.key1),
+            self.entry('server1', self.key2),
+            self.entry('server2,10.0.0.2', self.key1),
+            self.entry('[server3]:2222', self.key3),
+            self.entry('server3', self.key3),
+            self.entry(paramiko.HostKeys.hash_host('server4'), self.key1),
+            self.entry(paramiko.HostKeys.hash_host('server5'), self.key2),
+            self.entry('|1|invalid', self.key2),
+            self.entry('server6', self.key3),
+        ]
+        self.write_known_hosts(lines)
+
+        result = remove_hosts(self.known_hosts_file, ['server1', '10.0.0.2', '[server3]:2222', 'server4', 'server7'])
+
+        self.assertEqual(result, 5)
+        self.assertEqual(self.read_known_hosts(), [lines[0], lines[5], lines[7], lines[8], lines[9]])
+        with open('{0}.old'.format(self.known_hosts_file)) as fh:
+            self.assertEqual(fh.read().splitlines(), lines)
+
+    def test_remove_hosts_dry(self):
+        lines = [self.entry('server1', self.key1), self.entry('server2', self.key2)]
+        self.write_known_hosts(lines)
+
+        result = remove_hosts(self.known_hosts_file, ['server1'], dry=True)
+
+        self.assertEqual(result, 1)
+        self.assertEqual(self.read_known_hosts(), lines)
+        self.assertFalse(os.path.exists('{0}.old'.format(self.known_hosts_file)))
+
+    def test_remove_hosts_not_found(self):
+        lines = [self.entry('server1', self.key1)]
+        self.write_known_hosts(lines)
+
+        result = remove_hosts(self.known_hosts_file, ['server2'])
+
+        self.assertEqual(result, 0)
+        self.assertEqual(self.read_known_hosts(), lines)
+        self.assertFalse(os.path.exists('{0}.old'.format(self.known_hosts_file)))
+
+
+    @patch('msshcopyid.known_hosts.paramiko.Transport')
+    @patch('msshcopyid.known_hosts.socket.create_connection')
+    def test_scan_host_key(self, mock_create_connection, mock_transport):
+        transport = mock_transport.return_value
+
+        result = scan_host_key('server1', port=2222, key_types=('ssh-ed25519',), timeout=5)
+
+        self.assertEqual(result, transport.get_remote_server_key.return_value)
+        mock_create_connection.assert_called_once_with(('server1', 2222), 5)
+        mock_transport.assert_called_once_with(mock_create_connection.return_value)
+        self.assertEqual(transport.get_security_options.return_value.key_types, ['ssh-ed25519'])
+        self.assertEqual(transport.banner_timeout, 5)
+        transport.start_client.assert_called_once_with(timeout=5)
+        transport.close.assert_called_once_with()
+
+    @patch('msshcopyid.known_hosts.scan_host_key')
+    def test_scan_host_keys(self, mock_scan_host_key):
+        key1, key2 = MagicMock(), MagicMock()
+        mock_scan_host_key.side_effect = [key1, paramiko.ssh_exception.SSHException('no acceptable host key'), key2]
+
+        result = scan_host_keys('server1', port=2222, timeout=5)
+
+        self.assertEqual(result, [key1, key2])
+        self.assertEqual(mock_scan_host_key.call_count, 3)
+        mock_scan_host_key.assert_any_call('server1', port=2222, key_types=('ssh-ed25519',), timeout=5)
+
+    @patch('msshcopyid.known_hosts.scan_host_key')
+    def test_scan_host_keys_error(self, mock_scan_host_key):
+        ssh_exception = paramiko.ssh_exception.SSHException('Error reading SSH protocol banner')
+        mock_scan_host_key.side_effect = ssh_exception
+
+        with pytest.raises(paramiko.ssh_exception.SSHException) as excinfo:
+            scan_host_keys('server1')
+
+        self.assertIs(excinfo.value, ssh_exception)
+
+    def test_iter_keyscan_batches(self):
+        hosts = (Host(hostname='server{0}'.format(i), port=2222 if i % 2 else 22) for i in range(1, 6))
+
+        result = list(iter_keyscan_batches(hosts, batch_size=2))
+
+        self.assertEqual(result, [(2222, ['server1', 'server3']),
+                                  (22, ['server2', 'server4']),
+                                  (2222, ['server5'])])
+
+    @patch('msshcopyid.known_hosts.subprocess.Popen')
+    def test_ssh_keyscan(self, mock_popen):
+        p = mock_popen.return_value
+        p.stdout = io.StringIO('# server1:2222 SSH-2.0-OpenSSH_7.4\n'
+                               '[server1]:2222 ssh-rsa AAAAB3NzaC1yc2EAAAAB\n'
+                               '\n'
+                               '[server2]:2222 ssh-ed25519 AAAAC3NzaC1lZDI1NTE5\n')
+        p.poll.return_value = 0
+        p.returncode = 0
+
+        result = list(ssh_keyscan(['server1', 'server2'], port=2222, timeout=5))
+
+        self.assertEqual(result, ['[server1]:2222 ssh-rsa AAAAB3NzaC1yc2EAAAAB',
+                                  '[server2]:2222 ssh-ed25519 AAAAC3NzaC1lZDI1NTE5'])
+        self.assertEqual(mock_popen.call_args[0][0], ['ssh-keyscan', '-p', '2222', '-T', '5', '-f', '-'])
+        p.stdin.write.assert_any_call('server2\n')
+        p.stdin.close.assert_called_once_with()
+        p.kill.assert_not_called()
+
+    @patch('msshcopyid.known_hosts.subprocess.Popen')
+    def test_ssh_keyscan_error(self, mock_popen):
+        p = mock_popen.return_value
+        p.stdout = io.StringIO('')
+        p.poll.return_value = 1
+        p.returncode = 1
+
+        with pytest.raises(MSSHCopyIdException):
+            list(ssh_keyscan(['server1']))
+
+        self.assertEqual(mock_popen.call_args[0][0], ['ssh-keyscan', '-f', '-'])
+
+
+class TestKnownHosts(KnownHostsTestCase):
+
+    def test_load_not_exist(self):
+        known_hosts = KnownHosts(self.known_hosts_file).load()
+
+        self.assertEqual(known_hosts.lookup('server1'), {})
+
+    def test_lookup(self):
+        self.write_known_hosts([
+            '# comment',
+            '',
+            self.entry('server1,10.0.0.1', self.key1),
+            self.entry('server1', self.key2),
+            self.entry('[server2]:2222', self.key3),
+            '@cert-authority *.acme.com {0} {1}'.format(self.key3.get_name(), self.key3.get_base64()),
+        ])
+
+        known_hosts = KnownHosts(self.known_hosts_file).load()
+
+        self.assertEqual(known_hosts.lookup('server1'), {self.key1.get_name(): self.key1.get_base64(),
+                                                         self.key2.get_name(): self.key2.get_base64()})
+        self.assertEqual(known_hosts.lookup('10.0.0.1'), {self.key1.get_name(): self.key1.get_base64()})
+        self.assertEqual(known_hosts.lookup('[server2]:2222'), {self.key3.get_name(): self.key3.get_base64()})
+        self.assertEqual(known_hosts.lookup('server2'), {})
+        self.assertEqual(known_hosts.lookup('*.acme.com'), {})
+
+    def test_lookup_hashed(self):
+        self.write_known_hosts([
+            self.entry(paramiko.HostKeys.hash_host('server1'), self.key1),
+            self.entry(paramiko.HostKeys.hash_host('[server2]:2222'), self.key2),
+        ])
+
+        known_hosts = KnownHosts(self.known_hosts_file).load()
+
+        self.assertEqual(known_hosts.lookup('server1'), {self.key1.get_name(): self.key1.get_base64()})
+        self.assertEqual(known_hosts.lookup('server1'), {self.key1.get_name(): self.key1.get_base64()})
+        self.assertEqual(known_hosts.lookup('[server2]:2222'), {self.key2.get_name(): self.key2.get_base64()})
+        self.assertEqual(known_hosts.lookup('server2'), {})
+
+    def test_save(self):
+        self.write_known_hosts([self.entry('server1', self.key1)])
+        os.chmod(self.known_hosts_file, 0o600)
+        known_hosts = KnownHosts(self.known_hosts_file).load()
+
+        known_hosts.add('server2', self.key2)
+        known_hosts.add('[server3]:2222', self.key3)
+        self.assertEqual(self.read_known_hosts(), [self.entry('server1', self.key1)])
+
+        # Another process writes to the file in the meantime
+        with open(self.known_hosts_file, 'a') as fh:
+            fh.write('{0}\n'.format(self.entry('server4', self.key1)))
+
+        known_hosts.save()
+
+        self.assertEqual(self.read_known_hosts(), [self.entry('server1', self.key1),
+                                                   self.entry('server4', self.key1),
+                                                   self.entry('server2', self.key2),
+                                                   self.entry('[server3]:2222', self.key3)])
+        self.assertEqual(stat.S_IMODE(os.stat(self.known_hosts_file).st_mode), 0o600)
+        self.assertEqual(known_hosts.new_entries, [])
+
+    def test_save_no_new_entries(self):
+        known_hosts = KnownHosts(self.known_hosts_file).load()
+
+        known_hosts.save()
+
+        self.assertFalse(os.path.exists(self.known_hosts_file))
+
+    def test_save_no_duplicates(self):
+        self.write_known_hosts([self.entry('server1', self.key1)])
+        known_hosts = KnownHosts(self.known_hosts_file).load()
+        known_hosts.add('server1', self.key1)
+        known_hosts.add('server2', self.key2)
+        known_hosts.add('server2', self.key2)
+
+        known_hosts.save()
+
+        self.assertEqual(self.read_known_hosts(), [self.entry('server1', self.key1),
+                                                   self.entry('server2', self.key2)])
+
+
+class TestKnownHostsPolicy(KnownHostsTestCase):
+
+    def setUp(self):
+        super(TestKnownHostsPolicy, self).setUp()
+        self.write_known_hosts([self.entry('server1', self.key1)])
+        self.known_hosts = KnownHosts(self.known_hosts_file).load()
+
+    def test_missing_host_key_known(self):
+        policy = KnownHostsPolicy(self.known_hosts, add_host=False)
+
+        policy.missing_host_key(None, 'server1', self.key1)
+
+        self.assertEqual(self.known_hosts.new_entries, [])
+
+    def test_missing_host_key_add(self):
+        policy = KnownHostsPolicy(self.known_hosts, add_host=True)
+
+        policy.missing_host_key(None, '[server2]:2222', self.key2)
+
+        self.assertEqual(self.known_hosts.new_entries,
+                         [('[server2]:2222', self.key2.get_name(), self.key2.get_base64())])
+        self.assertEqual(self.known_hosts.lookup('[server2]:2222'), {self.key2.get_name(): self.key2.get_base64()})
+
+    def test_missing_host_key_reject(self):
+        policy = KnownHostsPolicy(self.known_hosts, add_host=False)
+
+        with pytest.raises(paramiko.ssh_exception.SSHException):
+            policy.missing_host_key(None, 'server2', self.key2)
+
+        self.assertEqual(self.known_hosts.new_entries, [])
+
+    def test_missing_host_key_bad_host_key(self):
+        policy = KnownHostsPolicy(self.known_hosts, add_host=True)
+
+        with pytest.raises(paramiko.ssh_exception.BadHostKeyException) as excinfo:
+            policy.missing_host_key(None, 'server1', self.key3)
+
+        self.assertEqual(excinfo.value.expected_key, self.key1)
+        self.assertEqual(self.known_hosts.new_entries, [])
@@ -0,0 +1,56 @@
+from __future__ import unicode_literals
+
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+import unittest2 as unittest
+
+from msshcopyid.lazy import LazyModule
+
+# The maximum time (in microseconds) to import `msshcopyid.cli`. Importing paramiko alone takes far longer.
+IMPORT_TIME_BUDGET = 100000
+
+
+class TestLazyModule(unittest.TestCase):
+
+    def test_lazy_module(self):
+        module = LazyModule('json')
+
+        self.assertIsNone(module._module)
+        self.assertEqual(module.dumps([1]), '[1]')
+        self.assertIs(module._module, sys.modules['json'])
+
+    def test_lazy_module_not_found(self):
+        module = LazyModule('msshcopyid_not_found')
+
+        with pytest.raises(ImportError):
+            module.dumps
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime requires Python 3.7+')
+class TestImportTime(unittest.TestCase):
+
+    def import_times(self, *args):
+        """
+        :return: a dict `{module: cumulative import time (in microseconds)}`.
+        """
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        p = subprocess.Popen([sys.executable, '-X', 'importtime', '-m', 'msshcopyid'] + list(args),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, universal_newlines=True)
+        stdout, stderr = p.communicate()
+        self.assertEqual(p.returncode, 0, stderr)
+        times = {}
+        for line in stderr.splitlines():
+            match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)', line)
+            if match:
+                times[match.group(2)] = int(match.group(1))
+        return times
+
+    def test_version_does_not_import_paramiko(self):
+        times = self.import_times('--version')
+
+        self.assertNotIn('paramiko', times)
+        self.assertLess(times['msshcopyid.cli'], IMPORT_TIME_BUDGET)
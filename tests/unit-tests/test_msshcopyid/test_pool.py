@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+import unittest2 as unittest
+
+from msshcopyid.errors import MSSHCopyIdException
+from msshcopyid.pool import picklable_exception, ProcessPool, WorkerPool
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_map(self):
+        pool = WorkerPool(lambda x: x * 2, size=3)
+
+        result = sorted(pool.map(range(10)))
+
+        self.assertEqual(result, [(x, x * 2, None) for x in range(10)])
+
+    def test_map_exception(self):
+        exception = ValueError('error')
+
+        def func(x):
+            if x == 3:
+                raise exception
+            return x
+
+        pool = WorkerPool(func, size=2)
+
+        result = dict((item, (res, ex)) for item, res, ex in pool.map(range(5)))
+
+        self.assertEqual(result[3], (None, exception))
+        self.assertEqual(result[4], (4, None))
+
+    def test_map_concurrency(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'max_running': 0}
+
+        def func(x):
+            with lock:
+                state['running'] += 1
+                state['max_running'] = max(state['max_running'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+
+        pool = WorkerPool(func, size=4)
+
+        self.assertEqual(len(list(pool.map(range(12)))), 12)
+        self.assertEqual(state['max_running'], 4)
+
+    def test_map_lazy(self):
+        consumed = []
+
+        def items():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+
+        pool = WorkerPool(lambda x: x, size=2)
+        results = pool.map(items())
+        next(results)
+        results.close()
+
+        self.assertLess(len(consumed), 1000)
+
+
+class UnpicklableError(Exception):
+
+    def __init__(self, message):
+        super(UnpicklableError, self).__init__(message)
+        self.lock = threading.Lock()
+
+
+class TestProcessPool(unittest.TestCase):
+
+    def test_map(self):
+        pool = ProcessPool(lambda x: (x * 2, os.getpid()), processes=3, size=2)
+
+        outputs = sorted(pool.map(range(30)))
+
+        self.assertEqual([(item, result[0], ex) for item, result, ex in outputs],
+                         [(x, x * 2, None) for x in range(30)])
+        self.assertNotIn(os.getpid(), set(result[1] for _, result, _ in outputs))
+
+    def test_map_exception(self):
+        def func(x):
+            if x == 1:
+                raise ValueError('value error')
+            if x == 2:
+                raise UnpicklableError('unpicklable error')
+            return x
+
+        pool = ProcessPool(func, processes=2, size=2)
+
+        outputs = dict((item, (result, ex)) for item, result, ex in pool.map(range(4)))
+
+        self.assertEqual(outputs[0], (0, None))
+        self.assertIsInstance(outputs[1][1], ValueError)
+        self.assertIsInstance(outputs[2][1], MSSHCopyIdException)
+        self.assertEqual(str(outputs[2][1]), 'UnpicklableError: unpicklable error')
+
+    def test_map_initializer(self):
+        state = {'initialized': False}
+
+        def initializer():
+            state['initialized'] = True
+
+        pool = ProcessPool(lambda x: state['initialized'], processes=2, initializer=initializer)
+
+        self.assertEqual(set(result for _, result, _ in pool.map(range(4))), set([True]))
+        self.assertFalse(state['initialized'])
+
+
+class TestPoolModule(unittest.TestCase):
+
+    def test_picklable_exception(self):
+        ex = ValueError('value error')
+        self.assertIs(picklable_exception(ex), ex)
+
+    def test_picklable_exception_unpicklable(self):
+        result = picklable_exception(UnpicklableError('unpicklable error'))
+
+        self.assertIsInstance(result, MSSHCopyIdException)
+        self.assertEqual(str(result), 'UnpicklableError: unpicklable error')
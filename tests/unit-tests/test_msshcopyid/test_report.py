@@ -0,0 +1,68 @@
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from mock import patch
+import paramiko
+import unittest2 as unittest
+
+from msshcopyid import Host
+from msshcopyid.constants import STATUS_ADDED, STATUS_FAILED
+from msshcopyid.report import Report
+
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.filename = os.path.join(self.tmp_dir, 'report.jsonl')
+
+    def read_report(self):
+        with open(self.filename) as fh:
+            return [json.loads(line) for line in fh]
+
+    @patch('msshcopyid.report.time.time', return_value=1234.5)
+    def test_record(self, mock_time):
+        host1 = Host(hostname='server1', port=22, user='root')
+        host1.attempts = 1
+        host1.timings = {'connect': 0.1, 'auth': 0.2}
+        host2 = Host(hostname='server2', port=2222, user='root')
+        host2.attempts = 3
+
+        report = Report(self.filename).open()
+        report.record(host1, STATUS_ADDED)
+        report.record(host2, STATUS_FAILED, exception=paramiko.ssh_exception.AuthenticationException('denied'))
+        report.close()
+
+        self.assertEqual(self.read_report(), [
+            {'host': 'root@server1:22', 'hostname': 'server1', 'port': 22, 'user': 'root', 'status': 'added',
+             'attempts': 1, 'timings': {'connect': 0.1, 'auth': 0.2}, 'time': 1234.5},
+            {'host': 'root@server2:2222', 'hostname': 'server2', 'port': 2222, 'user': 'root', 'status': 'failed',
+             'attempts': 3, 'timings': {}, 'time': 1234.5, 'error': 'denied',
+             'error_class': 'AuthenticationException'},
+        ])
+
+    def test_flush_periodically(self):
+        report = Report(self.filename, flush_interval=0.05).open()
+        self.addCleanup(report.close)
+
+        report.record(Host(hostname='server1', user='root'), STATUS_ADDED)
+        time.sleep(0.5)
+
+        self.assertEqual([entry['host'] for entry in self.read_report()], ['root@server1:22'])
+
+    @patch('msshcopyid.report.sys.stdout')
+    def test_stdout(self, mock_stdout):
+        report = Report('-').open()
+        report.record(Host(hostname='server1', user='root'), STATUS_ADDED)
+        report.close()
+
+        self.assertEqual(json.loads(mock_stdout.write.call_args[0][0])['host'], 'root@server1:22')
+        mock_stdout.flush.assert_called_with()
+        mock_stdout.close.assert_not_called()
+        self.assertIsNone(report.fh)
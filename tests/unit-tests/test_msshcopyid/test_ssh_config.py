@@ -0,0 +1,122 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, patch
+import paramiko
+import unittest2 as unittest
+
+from msshcopyid.ssh_config import get_cache_file, load_cached_ssh_config, save_cached_ssh_config, SSHConfigIndex
+
+
+SSH_CONFIG = '''
+Host server1 server1.acme.com
+    User alice
+    Port 2222
+
+Host web*.dc1 !web9.dc1
+    User www
+
+Host db?.dc1
+    Port 3306
+
+Match host server2
+    IdentityFile ~/.ssh/server2
+
+Host *
+    User default
+    ServerAliveInterval 5
+'''
+
+
+class TestSSHConfigIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.ssh_config = paramiko.config.SSHConfig.from_text(SSH_CONFIG)
+        self.index = SSHConfigIndex(self.ssh_config)
+
+    def test_index(self):
+        self.assertEqual(self.index.literals, {'server1': [1], 'server1.acme.com': [1]})
+        self.assertEqual([index for index, _ in self.index.wildcards], [0, 3, 5])
+        self.assertEqual(self.index.always, [2, 4])
+
+    def test_lookup_same_as_paramiko(self):
+        for hostname in ('server1', 'server1.acme.com', 'server2', 'web1.dc1', 'web9.dc1', 'db1.dc1', 'db10.dc1',
+                         'other'):
+            self.assertEqual(self.index.lookup(hostname), self.ssh_config.lookup(hostname), hostname)
+
+    def test_lookup_memoized(self):
+        with patch('msshcopyid.ssh_config.paramiko.config.SSHConfig') as mock_ssh_config:
+            result1 = self.index.lookup('server1')
+            result2 = self.index.lookup('server1')
+
+        self.assertIs(result1, result2)
+        mock_ssh_config.return_value.lookup.assert_called_once_with('server1')
+
+    def test_lookup_cache_size(self):
+        self.index.cache_size = 2
+
+        for hostname in ('server1', 'server2', 'server3'):
+            self.index.lookup(hostname)
+
+        self.assertEqual(list(self.index.cache), ['server3'])
+
+    def test_lookup_not_indexed(self):
+        ssh_config = paramiko.config.SSHConfig.from_text('Host *\n    CanonicalizeHostname yes\n')
+        ssh_config.lookup = MagicMock()
+
+        index = SSHConfigIndex(ssh_config)
+        result = index.lookup('server1')
+
+        self.assertIsNone(index.contexts)
+        self.assertEqual(result, ssh_config.lookup.return_value)
+        ssh_config.lookup.assert_called_once_with('server1')
+
+
+class TestSSHConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.config = os.path.join(self.tmp_dir, 'config')
+        self.write_config(SSH_CONFIG)
+
+    def write_config(self, text):
+        with open(self.config, 'w') as fh:
+            fh.write(text)
+        return paramiko.config.SSHConfig.from_path(self.config)
+
+    def test_save_and_load(self):
+        ssh_config = paramiko.config.SSHConfig.from_path(self.config)
+
+        save_cached_ssh_config(self.config, ssh_config, self.cache_dir)
+        result = load_cached_ssh_config(self.config, self.cache_dir)
+
+        self.assertEqual(os.stat(self.cache_dir).st_mode & 0o777, 0o700)
+        for hostname in ('server1', 'server2', 'web1.dc1', 'other'):
+            self.assertEqual(result.lookup(hostname), ssh_config.lookup(hostname))
+
+    def test_load_not_cached(self):
+        self.assertIsNone(load_cached_ssh_config(self.config, self.cache_dir))
+
+    def test_load_config_changed(self):
+        save_cached_ssh_config(self.config, paramiko.config.SSHConfig.from_path(self.config), self.cache_dir)
+        self.write_config('Host *\n    User bob\n')
+
+        self.assertIsNone(load_cached_ssh_config(self.config, self.cache_dir))
+
+    def test_load_paramiko_changed(self):
+        with patch('msshcopyid.ssh_config.paramiko.__version__', '0.0.0'):
+            save_cached_ssh_config(self.config, paramiko.config.SSHConfig.from_path(self.config), self.cache_dir)
+
+        self.assertIsNone(load_cached_ssh_config(self.config, self.cache_dir))
+
+    def test_load_corrupted(self):
+        os.makedirs(self.cache_dir)
+        with open(get_cache_file(self.config, self.cache_dir), 'w') as fh:
+            fh.write('{"version":')
+
+        self.assertIsNone(load_cached_ssh_config(self.config, self.cache_dir))
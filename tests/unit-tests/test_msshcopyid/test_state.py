@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from mock import patch
+import unittest2 as unittest
+
+from msshcopyid import Host
+from msshcopyid.state import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.filename = os.path.join(self.tmp_dir, 'mssh-copy-id', 'state.db')
+        self.host = Host(hostname='server1', port=2222, user='root')
+        self.host.host_key = 'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5'
+
+    def test_record_success(self):
+        state = StateStore(self.filename, fingerprint='SHA256:key1').open()
+
+        state.record_success(self.host)
+        state.close()
+
+        connection = sqlite3.connect(self.filename)
+        rows = connection.execute('SELECT hostname, port, user, fingerprint, host_key FROM hosts').fetchall()
+        connection.close()
+        self.assertEqual(rows, [('server1', 2222, 'root', 'SHA256:key1', 'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5')])
+
+    def test_is_known_good(self):
+        state = StateStore(self.filename, fingerprint='SHA256:key1').open()
+        state.record_success(self.host)
+        state.close()
+
+        state = StateStore(self.filename, fingerprint='SHA256:key1').open()
+        self.assertTrue(state.is_known_good(self.host))
+        self.assertFalse(state.is_known_good(Host(hostname='server1', port=22, user='root')))
+        self.assertFalse(state.is_known_good(Host(hostname='server1', port=2222, user='admin')))
+        state.close()
+
+        state = StateStore(self.filename, fingerprint='SHA256:key2').open()
+        self.assertFalse(state.is_known_good(self.host))
+        state.close()
+
+    @patch('msshcopyid.state.time.time')
+    def test_is_known_good_max_age(self, mock_time):
+        state = StateStore(self.filename, fingerprint='SHA256:key1').open()
+        mock_time.return_value = 1000000
+        state.record_success(self.host)
+
+        mock_time.return_value = 1000000 + 3600
+        self.assertTrue(state.is_known_good(self.host, max_age=7200))
+        self.assertFalse(state.is_known_good(self.host, max_age=1800))
+        state.close()
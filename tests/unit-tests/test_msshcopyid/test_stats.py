@@ -0,0 +1,69 @@
+from __future__ import unicode_literals
+
+from mock import MagicMock, patch
+import unittest2 as unittest
+
+from msshcopyid import Host
+from msshcopyid.stats import percentile, PhaseTimer, Stats
+
+
+class TestStatsModule(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertIsNone(percentile([], 50))
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    @patch('msshcopyid.stats.monotonic', side_effect=[10.0, 10.5, 11.5, 11.75])
+    def test_mark(self, mock_monotonic):
+        timer = PhaseTimer()
+
+        timer.mark('connect')
+        timer.mark('auth')
+        timer.mark('connect')
+
+        self.assertEqual(timer.timings, {'connect': 0.75, 'auth': 1.0})
+
+    @patch('msshcopyid.stats.monotonic', side_effect=[10.0, 12.0])
+    def test_wrap(self, mock_monotonic):
+        timer = PhaseTimer()
+        func = MagicMock()
+
+        result = timer.wrap(func, 'handshake')('arg', key='value')
+
+        self.assertEqual(result, func.return_value)
+        func.assert_called_once_with('arg', key='value')
+        self.assertEqual(timer.timings, {'handshake': 2.0})
+
+
+class TestStats(unittest.TestCase):
+
+    def add_host(self, stats, hostname, timings):
+        host = Host(hostname=hostname, user='root')
+        host.timings = timings
+        stats.add(host)
+
+    def test_format(self):
+        stats = Stats()
+        self.add_host(stats, 'server1', {'connect': 0.1, 'auth': 0.2})
+        self.add_host(stats, 'server2', {'connect': 0.3, 'auth': 0.4, 'exec': 0.5})
+
+        lines = stats.format(slowest=1)
+
+        self.assertEqual(lines, ['phase           min      p50      p95      p99      max',
+                                 'connect       0.100    0.100    0.300    0.300    0.300',
+                                 'auth          0.200    0.200    0.400    0.400    0.400',
+                                 'exec          0.500    0.500    0.500    0.500    0.500',
+                                 'total         0.300    0.300    1.200    1.200    1.200',
+                                 'Slowest hosts:',
+                                 '  root@server2:22 1.200s (connect 0.300s, auth 0.400s, exec 0.500s)'])
+
+    def test_format_no_host(self):
+        self.assertEqual(Stats().format(), ['phase           min      p50      p95      p99      max'])
@@ -1,6 +1,13 @@
 from __future__ import unicode_literals
 
+import argparse
+import io
+import os
+import shutil
+import tempfile
+
 from mock import MagicMock, mock_open, patch
+import pytest
 import unittest2 as unittest
 
 import msshcopyid.cli
@@ -29,6 +36,25 @@ class TestUtilsModule(unittest.TestCase):
         self.assertEqual(result, None)
         mock_isatty.assert_called_once_with()
 
+    @patch('msshcopyid.utils.getpass.getpass')
+    def test_get_passphrase(self, mock_getpass):
+        result = msshcopyid.utils.get_passphrase('/home/user/.ssh/id_rsa')
+        self.assertEqual(result, mock_getpass.return_value)
+        mock_getpass.assert_called_once_with('Enter the passphrase for the key [/home/user/.ssh/id_rsa]: ')
+
+    def test_parse_duration(self):
+        self.assertEqual(msshcopyid.utils.parse_duration('3600'), 3600)
+        self.assertEqual(msshcopyid.utils.parse_duration('30s'), 30)
+        self.assertEqual(msshcopyid.utils.parse_duration('1.5m'), 90)
+        self.assertEqual(msshcopyid.utils.parse_duration('12h'), 43200)
+        self.assertEqual(msshcopyid.utils.parse_duration('7d'), 604800)
+        self.assertEqual(msshcopyid.utils.parse_duration('2w'), 1209600)
+
+    def test_parse_duration_invalid(self):
+        for duration in ('', 'd', '7y', '-1d', '7 days'):
+            with pytest.raises(argparse.ArgumentTypeError):
+                msshcopyid.utils.parse_duration(duration)
+
     @patch('msshcopyid.utils.open', new_callable=mock_open)
     @patch('msshcopyid.utils.os.path.isfile', return_value=True)
     @patch('msshcopyid.utils.paramiko.config.SSHConfig')
@@ -40,16 +66,43 @@ class TestUtilsModule(unittest.TestCase):
         self.assertEqual(result, ssh_config)
         ssh_config.parse.assert_called_once_with(mock_bopen.return_value)
 
+    @patch('msshcopyid.utils.save_cached_ssh_config')
+    @patch('msshcopyid.utils.load_cached_ssh_config')
     @patch('msshcopyid.utils.open', new_callable=mock_open)
-    @patch('msshcopyid.utils.os.path.isfile', return_value=False)
+    @patch('msshcopyid.utils.os.path.isfile', return_value=True)
     @patch('msshcopyid.utils.paramiko.config.SSHConfig')
-    def test_load_ssh_config_not_exist(self, mock_ssh_config, mock_isfile, mock_bopen):
+    def test_load_ssh_config_cached(self, mock_ssh_config, mock_isfile, mock_bopen, mock_load_cached_ssh_config,
+                                    mock_save_cached_ssh_config):
+        result = msshcopyid.utils.load_ssh_config(config='/path/to/config', cache_dir='/path/to/cache')
+
+        self.assertEqual(result, mock_load_cached_ssh_config.return_value)
+        mock_load_cached_ssh_config.assert_called_once_with('/path/to/config', '/path/to/cache')
+        mock_ssh_config.return_value.parse.assert_not_called()
+        mock_save_cached_ssh_config.assert_not_called()
+
+    @patch('msshcopyid.utils.save_cached_ssh_config')
+    @patch('msshcopyid.utils.load_cached_ssh_config', return_value=None)
+    @patch('msshcopyid.utils.open', new_callable=mock_open)
+    @patch('msshcopyid.utils.os.path.isfile', return_value=True)
+    @patch('msshcopyid.utils.paramiko.config.SSHConfig')
+    def test_load_ssh_config_not_cached(self, mock_ssh_config, mock_isfile, mock_bopen, mock_load_cached_ssh_config,
+                                        mock_save_cached_ssh_config):
         ssh_config = mock_ssh_config.return_value
 
-        result = msshcopyid.utils.load_ssh_config()
+        result = msshcopyid.utils.load_ssh_config(config='/path/to/config', cache_dir='/path/to/cache')
 
         self.assertEqual(result, ssh_config)
-        ssh_config.parse.assert_not_called()
+        ssh_config.parse.assert_called_once_with(mock_bopen.return_value)
+        mock_save_cached_ssh_config.assert_called_once_with('/path/to/config', ssh_config, '/path/to/cache')
+
+    @patch('msshcopyid.utils.open', new_callable=mock_open)
+    @patch('msshcopyid.utils.os.path.isfile', return_value=False)
+    @patch('msshcopyid.utils.paramiko.config.SSHConfig')
+    def test_load_ssh_config_not_exist(self, mock_ssh_config, mock_isfile, mock_bopen):
+        result = msshcopyid.utils.load_ssh_config()
+
+        self.assertIsNone(result)
+        mock_ssh_config.assert_not_called()
 
     @patch('msshcopyid.utils.getpass.getuser', return_value='me')
     def test_parse_hosts_no_port_with_no_ssh_config(self, mock_getuser):
@@ -57,10 +110,14 @@ class TestUtilsModule(unittest.TestCase):
 
         result = msshcopyid.utils.parse_hosts(hosts, ssh_port=None, ssh_config=None)
 
-        self.assertEqual(result[0].__dict__, {'hostname': 'server1', 'port': 22, 'user': 'me', 'password': None})
-        self.assertEqual(result[1].__dict__, {'hostname': 'server2', 'port': 22, 'user': 'me', 'password': None})
-        self.assertEqual(result[2].__dict__, {'hostname': 'server3', 'port': 22, 'user': 'john', 'password': None})
-        self.assertEqual(result[3].__dict__, {'hostname': 'server4', 'port': 22, 'user': 'doe', 'password': None})
+        self.assertEqual(result[0].__dict__, {'hostname': 'server1', 'port': 22, 'user': 'me', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[1].__dict__, {'hostname': 'server2', 'port': 22, 'user': 'me', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[2].__dict__, {'hostname': 'server3', 'port': 22, 'user': 'john', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[3].__dict__, {'hostname': 'server4', 'port': 22, 'user': 'doe', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
 
     @patch('msshcopyid.utils.getpass.getuser', return_value='me')
     def test_parse_hosts_no_port_with_ssh_config(self, mock_getuser):
@@ -73,10 +130,14 @@ class TestUtilsModule(unittest.TestCase):
 
         result = msshcopyid.utils.parse_hosts(hosts, ssh_port=None, ssh_config=ssh_config)
 
-        self.assertEqual(result[0].__dict__, {'hostname': 'server1', 'port': 22, 'user': 'me', 'password': None})
-        self.assertEqual(result[1].__dict__, {'hostname': 'server2', 'port': 987, 'user': 'alice', 'password': None})
-        self.assertEqual(result[2].__dict__, {'hostname': 'server3', 'port': 22, 'user': 'john', 'password': None})
-        self.assertEqual(result[3].__dict__, {'hostname': 'server4', 'port': 654, 'user': 'doe', 'password': None})
+        self.assertEqual(result[0].__dict__, {'hostname': 'server1', 'port': 22, 'user': 'me', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[1].__dict__, {'hostname': 'server2', 'port': 987, 'user': 'alice', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[2].__dict__, {'hostname': 'server3', 'port': 22, 'user': 'john', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[3].__dict__, {'hostname': 'server4', 'port': 654, 'user': 'doe', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
 
     @patch('msshcopyid.utils.getpass.getuser', return_value='me')
     def test_parse_hosts_with_port_with_ssh_config(self, mock_getuser):
@@ -89,7 +150,80 @@ class TestUtilsModule(unittest.TestCase):
 
         result = msshcopyid.utils.parse_hosts(hosts, ssh_port=12345, ssh_config=ssh_config)
 
-        self.assertEqual(result[0].__dict__, {'hostname': 'server1', 'port': 12345, 'user': 'me', 'password': None})
-        self.assertEqual(result[1].__dict__, {'hostname': 'server2', 'port': 12345, 'user': 'alice', 'password': None})
-        self.assertEqual(result[2].__dict__, {'hostname': 'server3', 'port': 12345, 'user': 'john', 'password': None})
-        self.assertEqual(result[3].__dict__, {'hostname': 'server4', 'port': 12345, 'user': 'doe', 'password': None})
+        self.assertEqual(result[0].__dict__, {'hostname': 'server1', 'port': 12345, 'user': 'me', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[1].__dict__, {'hostname': 'server2', 'port': 12345, 'user': 'alice', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[2].__dict__, {'hostname': 'server3', 'port': 12345, 'user': 'john', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(result[3].__dict__, {'hostname': 'server4', 'port': 12345, 'user': 'doe', 'password': None,
+                                              'host_key': None, 'timings': None, 'attempts': 0})
+
+    @patch('msshcopyid.utils.getpass.getuser', return_value='me')
+    def test_parse_hosts_with_range_and_port(self, mock_getuser):
+        hosts = ['john@web[08-09].dc1:2222', 'db{a,b}']
+        ssh_config = MagicMock()
+        ssh_config.lookup.return_value = {'port': 987}
+
+        result = msshcopyid.utils.parse_hosts(hosts, ssh_port=12345, ssh_config=ssh_config)
+
+        self.assertEqual([host.__dict__ for host in result],
+                         [{'hostname': 'web08.dc1', 'port': 2222, 'user': 'john', 'password': None,
+                           'host_key': None, 'timings': None, 'attempts': 0},
+                          {'hostname': 'web09.dc1', 'port': 2222, 'user': 'john', 'password': None,
+                           'host_key': None, 'timings': None, 'attempts': 0},
+                          {'hostname': 'dba', 'port': 12345, 'user': 'me', 'password': None,
+                           'host_key': None, 'timings': None, 'attempts': 0},
+                          {'hostname': 'dbb', 'port': 12345, 'user': 'me', 'password': None,
+                           'host_key': None, 'timings': None, 'attempts': 0}])
+        ssh_config.lookup.assert_any_call('web08.dc1')
+
+    def test_expand_host(self):
+        self.assertEqual(list(msshcopyid.utils.expand_host('server1')), ['server1'])
+        self.assertEqual(list(msshcopyid.utils.expand_host('web[8-10]')), ['web8', 'web9', 'web10'])
+        self.assertEqual(list(msshcopyid.utils.expand_host('web[08-10]')), ['web08', 'web09', 'web10'])
+        self.assertEqual(list(msshcopyid.utils.expand_host('web[3-1]')), ['web3', 'web2', 'web1'])
+        self.assertEqual(list(msshcopyid.utils.expand_host('root@db{a,b}.dc[1-2]:2222')),
+                         ['root@dba.dc1:2222', 'root@dba.dc2:2222', 'root@dbb.dc1:2222', 'root@dbb.dc2:2222'])
+        self.assertEqual(list(msshcopyid.utils.expand_host('db{a}[x-y]')), ['db{a}[x-y]'])
+
+    def test_expand_host_is_lazy(self):
+        result = msshcopyid.utils.expand_host('web[0000000001-9999999999].dc{1,2}')
+
+        self.assertEqual([next(result) for _ in range(3)], ['web0000000001.dc1', 'web0000000001.dc2',
+                                                            'web0000000002.dc1'])
+
+    @patch('msshcopyid.utils.getpass.getuser', return_value='me')
+    def test_iter_hosts_is_lazy(self, mock_getuser):
+        hosts = MagicMock()
+        hosts.__iter__.return_value = iter(['server1', 'john@server2'])
+
+        result = msshcopyid.utils.iter_hosts(hosts)
+
+        hosts.__iter__.assert_not_called()
+        self.assertEqual(next(result).__dict__, {'hostname': 'server1', 'port': 22, 'user': 'me', 'password': None,
+                                                 'host_key': None, 'timings': None, 'attempts': 0})
+        self.assertEqual(next(result).__dict__, {'hostname': 'server2', 'port': 22, 'user': 'john', 'password': None,
+                                                 'host_key': None, 'timings': None, 'attempts': 0})
+
+    def test_read_hosts_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        hosts_file = os.path.join(tmp_dir, 'hosts')
+        with open(hosts_file, 'w') as fh:
+            fh.write('# Web servers\n'
+                     'server1\n'
+                     '\n'
+                     '  john@server2 server3  # legacy\n')
+
+        result = msshcopyid.utils.read_hosts_file(hosts_file)
+
+        self.assertEqual(list(result), ['server1', 'john@server2', 'server3'])
+
+    @patch('msshcopyid.utils.sys.stdin', new_callable=lambda: io.StringIO('server1\nserver2\n'))
+    def test_read_hosts_file_stdin(self, mock_stdin):
+        result = msshcopyid.utils.read_hosts_file('-')
+
+        self.assertEqual(next(result), 'server1')
+        self.assertEqual(mock_stdin.tell(), len('server1\n'))
+        self.assertEqual(list(result), ['server2'])